@@ -1,4 +1,11 @@
 from ply import lex, yacc
+import os
+import sys
+
+PARSER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "構文解析")  # 表のキャッシュ (tablecache.py) は asm.py と共有する
+
+sys.path.insert(0, PARSER_DIR)
+from tablecache import cached_build
 
 class LexicalAnalyze:
     """オブジェクトの説明
@@ -6,7 +13,7 @@ class LexicalAnalyze:
 | - | - | - |
 | .__init__ | code | codeの中に解析するコードの文字列を入れる |
 | .set_code | code | codeの中に解析するコードの文字列を入れる |
-| .build | **kwargs | lexにオブジェクトを認識させる(ブロック構文で自動実行) |
+| .build | **kwargs | lexにオブジェクトを認識させる(ブロック構文で自動実行)<br>kwargs が無ければキャッシュ済みの表を使う |
 | .get_tokens | - | lexで字句解析をし、トークン化する |
 | .parse | - | YACCで構文解析をし、トークン化する |
     """
@@ -15,6 +22,9 @@ class LexicalAnalyze:
         self.code = code
 
     def build(self, **kwargs):
+        if not kwargs:
+            self.lexer, self.yacc = cached_build(self, "sample")
+            return
         self.lexer = lex.lex(module=self, **kwargs)
         self.yacc = yacc.yacc(module=self, **kwargs)
     
@@ -1,161 +1,383 @@
 from ply import lex, yacc
-from sys import argv, exit
-import os
+from sys import argv, exit, intern
+from array import array
+from profiling import PhaseTimer
+from tracing import MultiTracer, PrintTracer, trace_productions
+from tablecache import cached_lexer, cached_parser, grammar_hash
+from itertools import islice
+import copy
+import io
+import re
+import threading
+
+class HackSyntaxError(Exception):
+    """
+    解釈できない命令 (SyntaxError は PLY のエラー回復に使われるので別の例外にする)
+    """
 
-class HackCodeAnalyze:
-    """オブジェクトの説明
-| method | args | description |
+def a_value_error(lineno, text):
+    """
+    範囲外の A命令の値 (@40000 など) のエラーメッセージ (ply / fast で同じにする)
+    """
+    return f"Value Error : line {lineno} : @{text} : The A-instruction value must be 0 to 32767."
+
+REGISTER_NUM                    = 16
+
+PREDEFINED_SYMBOLS              = {     # 定義済みシンボル (定数名)
+    "SP"                        : 0, 
+    "LCL"                       : 1, 
+    "ARG"                       : 2, 
+    "THIS"                      : 3, 
+    "THAT"                      : 4,
+    "SCREEN"                    : 16384, 
+    "KBD"                       : 24576,
+    **{f"R{i}": i for i in range(REGISTER_NUM)}
+}
+RESERVED_SYMBOLS                = frozenset(PREDEFINED_SYMBOLS)
+
+# C命令の各フィールドのビット表 (C_TABLE の元になる)
+DEST_TABLE                      = {
+    "M"                         : 0b001,
+    "D"                         : 0b010,
+    "MD"                        : 0b011,
+    "DM"                        : 0b011,
+    "A"                         : 0b100,
+    "AM"                        : 0b101,
+    "AD"                        : 0b110,
+    "AMD"                       : 0b111,
+    "ADM"                       : 0b111,
+}
+
+COMP_TABLE                      = {
+    # a == 0
+    "0"                         : 0b0101010,
+    "1"                         : 0b0111111,
+    "-1"                        : 0b0111010,
+    "D"                         : 0b0001100,
+    "A"                         : 0b0110000,
+    "!D"                        : 0b0001101,
+    "!A"                        : 0b0110001,
+    "-D"                        : 0b0001111,
+    "-A"                        : 0b0110011,
+    "D+1"                       : 0b0011111,
+    "A+1"                       : 0b0110111,
+    "D-1"                       : 0b0001110,
+    "A-1"                       : 0b0110010,
+    "D+A"                       : 0b0000010,
+    "D-A"                       : 0b0010011,
+    "A-D"                       : 0b0000111,
+    "D&A"                       : 0b0000000,
+    "D|A"                       : 0b0010101,
+
+    # a == 1
+    "M"                         : 0b1110000,
+    "!M"                        : 0b1110001,
+    "-M"                        : 0b1110011,
+    "M+1"                       : 0b1110111,
+    "M-1"                       : 0b1110010,
+    "D+M"                       : 0b1000010,
+    "D-M"                       : 0b1010011,
+    "M-D"                       : 0b1000111,
+    "D&M"                       : 0b1000000,
+    "D|M"                       : 0b1010101,
+}
+
+JUMP_TABLE                      = {
+    "JGT"                       : 0b001,
+    "JEQ"                       : 0b010,
+    "JGE"                       : 0b011,
+    "JLT"                       : 0b100,
+    "JNE"                       : 0b101,
+    "JLE"                       : 0b110,
+    "JMP"                       : 0b111,
+}
+
+def build_c_table():
+    """
+    dest=comp;jump の全ての書き方 (AMD/ADM, MD/DM の別名を含む) から
+    16bit の命令語への表を作る
+    """
+    table                       = {}
+    for compText, comp in COMP_TABLE.items():
+        for destText, dest in {"": 0, **DEST_TABLE}.items():
+            for jumpText, jump in {"": 0, **JUMP_TABLE}.items():
+                cText           = compText
+                if destText:
+                    cText       = f"{destText}={cText}"
+                if jumpText:
+                    cText       = f"{cText};{jumpText}"
+                table[cText]    = 0b111 << 13 | comp << 6 | dest << 3 | jump
+    return table
+
+C_TABLE                         = build_c_table()
+
+class HackProgram:
+    """命令列の中間表現 (命令ごとの dict の代わり)
+| attribute / method | args | description |
 | - | - | - |
-| .__init__ | code | codeの中に解析するコードの文字列を入れる |
-| .set_code | code | codeの中に解析するコードの文字列を入れる |
-| .build | **kwargs | lexにオブジェクトを認識させる(ブロック構文で自動実行) |
-| .get_tokens | - | lexで字句解析をし、トークン化する |
-| .parse | - | YACCで構文解析をし、トークン化する |
-| .asm | - | Hackアセンブリ化したコードをリストで返す |
+| .words | - | 命令語の array('H') (未解決の A命令は 0 のまま) |
+| .relocations | - | 未解決シンボル → 参照している命令の位置 (array('I')、最初に参照された順) |
+| .append | inst | 命令語 (int) か未解決シンボル (str) を 1 つ追加する |
+| .lines | - | .hack の各行 (16bit バイナリ文字列) のリストを返す |
     """
+    __slots__                   = ("words", "relocations")
+
+    def __init__(self):
+        self.words              = array("H")
+        self.relocations        = {}
+
+    def __len__(self):
+        return len(self.words)
+
+    def append(self, inst):
+        if isinstance(inst, str):
+            indices             = self.relocations.get(inst)
+            if indices is None:
+                indices         = self.relocations[intern(inst)] = array("I")
+            indices.append(len(self.words))
+            inst                = 0
+        self.words.append(inst)
+
+    def lines(self):
+        return [f"{word:016b}" for word in self.words]
+
+class SymbolTable:
+    """シンボルテーブル
+| attribute / method | args | description |
+| - | - | - |
+| .values | - | シンボル → アドレス (定義済みシンボル、ラベル、割り当て済みの変数) |
+| .reserved | - | 定数名の frozenset (再定義できない) |
+| .labels | - | ラベル → アドレス (L命令で定義されたものだけ) |
+| .nextVarAddr | - | 次に割り当てる変数のアドレス |
+| .define | label, addr | ラベルを登録する (定数名と freeze の後は無視、同名なら後の定義で上書き) |
+| .freeze | - | ラベルを確定させ、以降の define を無視する |
+| .get_next_addr | - | 変数のアドレスを 1 つ進める (SCREEN 以降は None) |
+| .address | symbol | シンボルのアドレスを返す (未定義なら変数として割り当てる) |
+| .resolve | program | program.relocations をまとめて words に書き込む |
+    """
+    __slots__                   = ("values", "reserved", "labels", "nextVarAddr", "frozen")
 
-    def set_code(
-        self,
-        code                    = ""
-    ):
-        self.code               = code
+    def __init__(self):
+        self.values             = dict(PREDEFINED_SYMBOLS)
+        self.reserved           = RESERVED_SYMBOLS
+        self.labels             = {}
+        self.nextVarAddr        = REGISTER_NUM
+        self.frozen             = False
 
-    def build(self, **kwargs):
-        self.lexer              = lex.lex(
-            module              = self, 
-            **kwargs
-        )
-        
-        self.yacc               = yacc.yacc(
-            module              = self, 
-            **kwargs
-        )
-    
-    def parse(self): # yacc による構文解析
-        self.pc                 = 0
-        return self.yacc.parse(
-            self.code, 
-            lexer               = self.lexer
-        )
-    
-    def get_tokens(self):
-        self.lexer.input(self.code)
-        self.sourceTokenList    = []
-        while True:
-            tok                 = self.lexer.token()
-            if not tok:
-                break
-            self.sourceTokenList.append(tok)
-        return self.sourceTokenList
-    
+    def __contains__(self, symbol):
+        return symbol in self.values
 
-    def __str__(self):
-        self.get_tokens()
-        return "\n".join([str(t) for t in self.sourceTokenList])
+    def define(self, label, addr):
+        if (label not in self.reserved) and not self.frozen:
+            label               = intern(label)
+            self.values[label]  = addr
+            self.labels[label]  = addr
 
-    def __enter__(self):
-        self.build()
-        return self
-    
-    def __exit__(self, *args):
-        pass
+    def freeze(self):
+        """
+        iter_asm の 2 パス目用 (1 パス目で確定した、最後の定義のアドレスを使い続ける)
+        """
+        self.frozen             = True
+
+    def get_next_addr(self):
+        value = None
+        if self.nextVarAddr     < self.values["SCREEN"]:
+            value               = self.nextVarAddr
+        self.nextVarAddr += 1
+        return value
+
+    def address(self, symbol):
+        value                   = self.values.get(symbol)
+        if value is None:
+            value               = self.get_next_addr()
+            if value is None:               # 変数領域が足りない
+                value           = 0
+            self.values[symbol] = value
+        return value
+
+    def resolve(self, program):
+        """
+        シンボルごとに値を 1 回だけ求め、参照している位置へまとめて書き込む
+        変数は最初に参照された順にアドレスを割り当てる
+        """
+        words                   = program.words
+        for symbol, indices in program.relocations.items():
+            value               = self.address(symbol)
+            for index in indices:
+                words[index]    = value
+        program.relocations     = {}
+        return program
+
+class AsmContext:
+    """アセンブル 1 回分の状態 (HackCodeAnalyze.new_context で作る)
+| attribute / method | args | description |
+| - | - | - |
+| .symbols | - | シンボルテーブル (SymbolTable) |
+| .varTable | - | シンボル → アドレスの dict |
+| .nextVarAddr | - | 次に割り当てる変数のアドレス |
+| .pc | - | 次の命令のアドレス |
+| .program | - | 構文解析中の HackProgram |
+| .tracer | - | 命令ごとのイベントを受け取るトレーサー (None なら無し) |
+| .lexer / .parser | - | この状態専用の lexer / parser (表は共有) |
+| .attach | tracer | トレーサーを付け替える |
+| .parse | code | YACCで構文解析をし、未解決の HackProgram を返す |
+| .iter_chunks | code, chunk | chunk 行ずつ構文解析し、HackProgram を順に返す |
+| .resolve | program | program の未解決シンボルを埋める |
+    """
 
     def __init__(
         self, 
-        code                    = "", 
-        debug                   = True
+        tracer                  = None, 
+        lexer                   = None, 
+        parser                  = None
     ):
-        self.debug              = debug
-        self.set_code(code)
+        self.symbols            = SymbolTable()
+        self.pc                 = 0
+        self.program            = HackProgram()
 
-        self.varTable           = {         # シンボルテーブル
-            "SP"                : 0, 
-            "LCL"               : 1, 
-            "ARG"               : 2, 
-            "THIS"              : 3, 
-            "THAT"              : 4,
-            "SCREEN"            : 16384, 
-            "KBD"               : 24576
-        }
+        self.lexer              = lexer
+        self.parser             = parser
+        self.tracer             = None
+        if parser is not None:              # 文法アクションからは p.parser.ctx で参照する
+            parser.ctx          = self
+            self.productions    = parser.productions    # 共有の (トレースしない) 文法アクション
+        self.attach(tracer)
 
-        self.reservedVars       = [         # 定数名
-            "SP", 
-            "LCL", 
-            "ARG", 
-            "THIS", 
-            "THAT",
-            "SCREEN", 
-            "KBD"
-        ]
-        
-        self.registerNum        = 16
-        for i in range(self.registerNum):
-            self.varTable[f"R{i}"] = i
-            self.reservedVars.append(f"R{i}")
+    def attach(self, tracer):
+        """
+        トレーサーを付け替える (None で外す)
+        トレースするときだけ、この parser の文法アクションをトレース付きの複製に差し替える
+        """
+        self.tracer             = tracer
+        if self.parser is None:
+            return
+        if tracer is None:
+            self.parser.productions = self.productions
+        else:
+            self.parser.productions = trace_productions(self.productions, tracer)
 
-        self.nextVarAddr        = self.registerNum
-        self.pc                 = 0
+    @property
+    def varTable(self):
+        return self.symbols.values
+
+    @property
+    def nextVarAddr(self):
+        return self.symbols.nextVarAddr
+
+    def get_next_addr(self):
+        return self.symbols.get_next_addr()
 
-        self.t_ignore           = ' \t'     # A string containing ignored characters (spaces and tabs)
-        self.t_ignore_comment   = r'//.*'
-
-        self.reservedWords      = (         # 予約語
-            "AMD",
-            "ADM",
-            "AD", 
-            "AM", 
-            "MD", 
-            "DM",
-            "A", 
-            "M", 
-            "D", 
-            "JGT", 
-            "JEQ", 
-            "JGE", 
-            "JLT", 
-            "JNE", 
-            "JLE", 
-            "JMP"
+    def parse(self, code): # yacc による構文解析
+        self.pc                 = 0
+        self.program            = HackProgram()
+        self.parser.parse(
+            code, 
+            lexer               = self.lexer,
+            tracking            = self.tracer is not None   # トレースするときだけ命令の行を記録する
         )
+        return self.program
 
-        self.tokens             = (         # tokensの要素に t_を付けると定義可能
-            "AT",       # "@"
-            "LPAREN",   # "("
-            "RPAREN",   # ")"
-            "EQUAL",    # "="
-            "SEMI",     # ";"
-            "PLUS",     # "+"
-            "MINUS",    # "-"
-            "AND",      # "&"
-            "OR",       # "|"
-            "NOT",      # "!"
-            "NUMBER",
-            "SYMBOL",
-
-        ) + self.reservedWords
-        
-        
-        self.t_AT               = r'@'
-        self.t_LPAREN           = r'\('
-        self.t_RPAREN           = r'\)'
-        self.t_EQUAL            = r'='
-        self.t_SEMI             = r';'
-        self.t_PLUS             = r'\+'
-        self.t_MINUS            = r'-'
-        self.t_AND              = r'&'
-        self.t_OR               = r'\|'
-        self.t_NOT              = r'!'
+    def iter_chunks(self, code, chunk):
+        """
+        ソースを chunk 行ずつ構文解析し、chunk ごとの HackProgram を順に返す
+        """
+        self.pc                 = 0
+        self.lexer.lineno       = 1
+        source                  = io.StringIO(code)
+        while True:
+            lines               = "".join(islice(source, chunk))
+            if not lines:
+                break
+            self.program        = HackProgram()
+            self.parser.parse(
+                lines, 
+                lexer           = self.lexer,
+                tracking        = self.tracer is not None
+            )
+            yield self.program
+
+    def resolve(self, program):
+        """
+        未解決シンボルのアドレスを words に書き込む
+        """
+        return self.symbols.resolve(program)
+
+class HackGrammar:
+    """字句・文法の規則 (状態を持たない)
+| attribute / method | args | description |
+| - | - | - |
+| .tokens / .t_* | - | 字句解析の規則 |
+| .p_* | p | 構文解析の規則 (アセンブル 1 回分の状態は p.parser.ctx の AsmContext) |
+| .reservedWords / .reservedVars | - | 予約語と定数名 |
+| .numberPattern / .symbolPattern | - | fast エンジンが使う、NUMBER / SYMBOL と同じ正規表現 |
+
+lexer / parser はこのクラスのインスタンスから作ってプロセス内で共有するので、
+規則はクラス属性と p.parser.ctx 以外を参照しない (HackCodeAnalyze のソースや結果を表が持ち続けない)
+    """
 
+    reservedVars                = RESERVED_SYMBOLS          # 定数名
+
+    t_ignore                    = ' \t\r'   # A string containing ignored characters (spaces, tabs and CR of CRLF)
+    t_ignore_comment            = r'//.*'
+
+    reservedWords               = (         # 予約語
+        "AMD",
+        "ADM",
+        "AD", 
+        "AM", 
+        "MD", 
+        "DM",
+        "A", 
+        "M", 
+        "D", 
+        "JGT", 
+        "JEQ", 
+        "JGE", 
+        "JLT", 
+        "JNE", 
+        "JLE", 
+        "JMP"
+    )
+
+    tokens                      = (         # tokensの要素に t_を付けると定義可能
+        "AT",       # "@"
+        "LPAREN",   # "("
+        "RPAREN",   # ")"
+        "EQUAL",    # "="
+        "SEMI",     # ";"
+        "PLUS",     # "+"
+        "MINUS",    # "-"
+        "AND",      # "&"
+        "OR",       # "|"
+        "NOT",      # "!"
+        "NUMBER",
+        "SYMBOL",
+        "NEWLINE",  # 文の区切り
+
+    ) + reservedWords
+    
     
+    t_AT                        = r'@'
+    t_LPAREN                    = r'\('
+    t_RPAREN                    = r'\)'
+    t_EQUAL                     = r'='
+    t_SEMI                      = r';'
+    t_PLUS                      = r'\+'
+    t_MINUS                     = r'-'
+    t_AND                       = r'&'
+    t_OR                        = r'\|'
+    t_NOT                       = r'!'
+
     # Define a rule so we can track line numbers
-    def t_newline(self, t):
+    # 改行は文の区切りとしてトークンにする (fast エンジンと同じく 1 行 1 命令)
+    def t_NEWLINE(self, t):
         r'\n+'
         t.lexer.lineno          += len(t.value)
+        return t
 
     # Error handling rule
     def t_error(self, t):
-        print("Illegal character '%s'" % t.value[0])
-        t.lexer.skip(1)
+        raise HackSyntaxError(f"Syntax Error : line {t.lexer.lineno} : Illegal character {t.value[0]!r}")
 
     # A regular expression rule with some action code
     # Note addition of self parameter since we're in a class
@@ -169,55 +391,58 @@ class HackCodeAnalyze:
         if t.value in self.reservedWords:
             t.type              = t.value
         return t
+
+    numberPattern               = re.compile(t_NUMBER.__doc__)
+    symbolPattern               = re.compile(t_SYMBOL.__doc__)
+    splitPattern                = re.compile(r'[A-Za-z0-9_\.\$:][ \t\r]+[A-Za-z0-9_\.\$:]')   # 空白で分かれた名前・数値 (ply では別のトークン)
     
 
 
     # 構文解析
     def p_error(self, p):
-        print("Syntax error at", p)
+        # fast エンジンと同じく、解釈できない命令は例外にする (表示だけして続けると一部の命令が抜けた結果になる)
+        if p is None:
+            raise HackSyntaxError("Syntax Error : unexpected end of input")
+        raise HackSyntaxError(f"Syntax Error : line {p.lineno} : {p.value}")
+
+    def p_program(self, p):
+        """
+        program     : statements
+                    | statements statement
+        """
+        # 最後の文は改行で終わらなくてもよい
+        p[0]                    = p.parser.ctx.program
 
     def p_statements(self, p):
         """
-        statements  : statement statements
+        statements  : statements statement NEWLINE
+                    | statements NEWLINE
                     | empty
         """
-        if len(p)               == 3:
-            p[0]                = [p[1]] + p[2]
-        else:
-            p[0]                = []
+        # 左再帰にして 1 文ごとに還元させる
+        # 文は改行で区切るので、次の行の -1 などが前の行の C命令につながることは無い
+        # 命令は各 statement で ctx.program に追加済み
+        p[0]                    = p.parser.ctx.program
 
     def p_empty(self, p):
         "empty : "
 
     def p_statement_a(self, p):
         "statement  : a_instruction"
-        p[0]                    = p[1]
-        if self.debug:
-            print("A命令")
-        
-        self.pc += 1
+        # トレースは AsmContext.attach で差し替えた複製のアクションから呼ばれる
+        ctx                     = p.parser.ctx
+        ctx.program.append(p[1])
+        ctx.pc += 1
     
     def p_statement_l(self, p):
         "statement  : l_instruction"
-        p[0]                    = p[1]
-        if self.debug:
-            print("Label")
     
     def p_statement_c(self, p):
         "statement  : c_instruction"
-        p[0]                    = p[1]
-        if self.debug:
-            print("C命令")
-        
-        self.pc += 1
+        ctx                     = p.parser.ctx
+        ctx.program.append(p[1])
+        ctx.pc += 1
 
-    
-    def get_next_addr(self):
-        value = None
-        if self.nextVarAddr     < self.varTable["SCREEN"]:
-            value               = self.nextVarAddr
-        self.nextVarAddr += 1
-        return value
 
     # A命令
     def p_a_instruction(self, p):
@@ -225,34 +450,19 @@ class HackCodeAnalyze:
         a_instruction   : AT SYMBOL
                         | AT NUMBER
         """
+        # 命令語 (int) か、未解決のシンボル名 (str) を返す
         if isinstance(p[2], int):
-            value               = p[2]
-            if self.debug:
-                print(f"0{value:015b}")
-            p[0]                = {
-                "instruction"   : "A", 
-                "type"          : f"{p.slice[2].type}", 
-                "code"          : f"0{value:015b}", 
-                "at"            : str(p[2])
-            }
+            if p[2]             > 0x7FFF:
+                raise HackSyntaxError(a_value_error(p.lineno(2), self.number_text(p, 2)))
+            p[0]                = p[2]
         else:
+            # 同名のラベルが後で定義し直されることもあるので、
+            # 定義済みシンボル以外は最後にまとめて解決する
             label                   = str(p[2])
-            if label in self.varTable.keys():
-                value               = self.varTable[label]
-                p[0]                = {
-                    "instruction"   : "A", 
-                    "type"          : f"{p.slice[2].type}", 
-                    "code"          : f"0{value:015b}", 
-                    "at"            : str(p[2])
-                }
+            if label in self.reservedVars:
+                p[0]                = PREDEFINED_SYMBOLS[label]
             else:
-                self.varTable[label] = -1 # 不定フラグ
-                p[0]                = {
-                    "instruction"   : "A", 
-                    "type"          : f"{p.slice[2].type}", 
-                    "code"          : f"pending", 
-                    "at"            : str(p[2])
-                }
+                p[0]                = label
 
     # L命令 (LABEL)
     def p_l_instruction(self, p):
@@ -260,8 +470,8 @@ class HackCodeAnalyze:
         l_instruction : LPAREN SYMBOL RPAREN
         """
         label                   = p[2]
-        if label not in self.reservedVars:
-            self.varTable[label] = self.pc
+        ctx                     = p.parser.ctx
+        ctx.symbols.define(label, ctx.pc)
 
         p[0]                    = {
             "instruction": "L", 
@@ -278,41 +488,12 @@ class HackCodeAnalyze:
                         | comp
         
         """
+        # 各フィールドは文字列なので、つなげた命令文で C_TABLE を引くだけ
+        cText                   = "".join(p[1:])
+        if cText not in C_TABLE:
+            raise HackSyntaxError(f"Syntax Error : {cText} Unknown")
 
-        dest                    = dict()
-        dest["code"]            = "000"
-        comp                    = None
-        jump                    = dict()
-        jump["code"]            = "000"
-
-        if len(p)               == 2:
-            comp                = p[1]
-        elif (
-            (len(p)             == 4 ) and 
-            (p.slice[2].type    == "SEMI")
-        ):
-            comp                = p[1]
-            jump                = p[3]
-        elif (
-            (len(p)             == 4) and 
-            (p.slice[2].type    == "EQUAL")
-        ):
-            dest                = p[1]
-            comp                = p[3]
-        elif len(p)             == 6:
-            dest                = p[1]
-            comp                = p[3]
-            jump                = p[5]
-        
-        cCode                   = f"111{comp["code"]}{dest["code"]}{jump["code"]}"
-
-        p[0]                    = {
-            "instruction"       : "C",
-            "dest"              : dest,
-            "comp"              : comp,
-            "jump"              : jump,
-            "code"              : cCode
-        }
+        p[0]                    = C_TABLE[cText]
 
 
     def p_dest(self, p):
@@ -327,20 +508,7 @@ class HackCodeAnalyze:
                 | M
                 | D
         """
-
-        destCode                = 0b000
-        if "A" in str(p[1]):
-            destCode            |= 0b100
-        if "D" in str(p[1]):
-            destCode            |= 0b010
-        if "M" in str(p[1]):
-            destCode            |= 0b001
-        
-        destCode                = f"{destCode:03b}"
-        p[0]                    = {
-            "value"             : str(p[1]),
-            "code"              : destCode
-        }
+        p[0]                    = str(p[1])
 
     def p_comp_1(self, p):      # 演算
         """
@@ -355,28 +523,7 @@ class HackCodeAnalyze:
         comp        : register
                     | num
         """
-
-        code                    = f"{str(p[1])}"
-
-        monomialPattern         = {
-            # a == 0
-            "0"                 : "0101010",
-            "1"                 : "0111111",
-            "-1"                : "0111010",
-            "D"                 : "0001100",
-            "A"                 : "0110000",
-
-            # a == 1
-            "M"                 : "1110000",
-        }
-
-        if code not in monomialPattern.keys():
-            raise f"Syntax Error : {code} Unknown"
-
-        p[0]                    = {
-            "value"             : code,
-            "code"              : monomialPattern[code]
-        }
+        p[0]                    = str(p[1])
     
     def p_registers(self, p):
         """
@@ -385,114 +532,49 @@ class HackCodeAnalyze:
                         | register AND register
                         | register OR register
         """
-
-        code                    = f"{str(p[1])}{str(p[2])}{str(p[3])}"
-
-        registersPattern        = {
-            # a == 0
-            "D+A": "0000010",
-            "D-A": "0010011",
-            "A-D": "0000111",
-            "D&A": "0000000",
-            "D|A": "0010101",
-
-            # a == 1
-            "D+M": "1000010",
-            "D-M": "1010011",
-            "M-D": "1000111",
-            "D&M": "1000000",
-            "D|M": "1010101",
-        }
-
-        if code not in registersPattern.keys():
-            raise f"Syntax Error : {code} Unknown"
-        
-        p[0]                    = {
-            "op"                : p[2], 
-            "left"              : p[1], 
-            "right"             : p[3],
-            "code"              : registersPattern[code]
-        }
+        p[0]                    = f"{p[1]}{p[2]}{p[3]}"
 
     def p_register_func(self, p):
         """
         registerFunc    : NOT register
                         | MINUS register
         """
-
-        code                    = f"{str(p[1])}{str(p[2])}"
-
-        registerFuncPattern     = {
-            # a == 0
-            "!D"                : "0001101",
-            "!A"                : "0110001",
-            "-D"                : "0001111",
-            "-A"                : "0110011",
-
-            # a == 1
-            "!M"                : "1110001",
-            "-M"                : "1110011",
-        }
-
-        if code not in registerFuncPattern.keys():
-            raise f"Syntax Error : {code} Unknown"
-
-        p[0]                    = {
-            "op"                : p[1], 
-            "value"             : p[2],
-            "code"              : registerFuncPattern[code]
-        }
+        p[0]                    = f"{p[1]}{p[2]}"
     
     def p_register_num(self, p):
         """
         registerNum     : register PLUS num
                         | register MINUS num
         """
-
-        code                    = f"{str(p[1])}{str(p[2])}{str(p[3])}"
-        
-        registerNumPattern      = {
-            # a == 0
-            "D+1"               : "0011111",
-            "A+1"               : "0110111",
-            "D-1"               : "0001110",
-            "A-1"               : "0110010",
-
-            # a == 1
-            "M+1"               : "1110111",
-            "M-1"               : "1110010",
-        }
-
-        if code not in registerNumPattern.keys():
-            raise f"Syntax Error : {code} Unknown"
-
-        p[0]                    = {
-            "op"                : p[2], 
-            "left"              : p[1], 
-            "right"             : p[3],
-            "code"              : registerNumPattern[code]
-        }
+        p[0]                    = f"{p[1]}{p[2]}{p[3]}"
 
     def p_num(self, p):
         """
         num : NUMBER
         """
-        if p[1] in [0, 1]:
+        # 00 や 01 も値は 0 / 1 になるので、書かれたままの数字で確かめる (fast エンジンと同じ)
+        text                    = self.number_text(p, 1)
+        if text in ["0", "1"]:
             p[0]                = p[1]
         else:
-            print("Value Error : The only available values are 1, 0, and -1.")
-            p[0]                = 0
+            raise HackSyntaxError(f"Syntax Error : {text} : The only available values are 1, 0, and -1.")
 
     def p_minus_num(self, p):
         """
         num        : MINUS NUMBER
         """
-        if p[2]                 == 1:
+        text                    = self.number_text(p, 2)
+        if text                 == "1":
             p[0]                = - p[2]
 
         else:
-            print("Value Error : The only available values are 1, 0, and -1.")
-            p[0]                = 0
+            raise HackSyntaxError(f"Syntax Error : -{text} : The only available values are 1, 0, and -1.")
+
+    def number_text(self, p, n):
+        """
+        p[n] の NUMBER トークンのソース上の文字列
+        """
+        return self.numberPattern.match(p.lexer.lexdata, p.lexpos(n)).group()
 
     
     
@@ -515,85 +597,437 @@ class HackCodeAnalyze:
                 | JLE
                 | JMP
         """
+        p[0]                    = str(p[1])
 
-        jumpPattern             = {
-            "JGT"               : "001",
-            "JEQ"               : "010",
-            "JGE"               : "011",
-            "JLT"               : "100",
-            "JNE"               : "101",
-            "JLE"               : "110",
-            "JMP"               : "111"
-        }
+class HackCodeAnalyze(HackGrammar):
+    """オブジェクトの説明
+| method | args | description |
+| - | - | - |
+| .__init__ | code | codeの中に解析するコードの文字列を入れる |
+| .set_code | code | codeの中に解析するコードの文字列を入れる |
+| .build | **kwargs | lexにオブジェクトを認識させる(ブロック構文で自動実行)<br>kwargs が無ければキャッシュ済みの表を使う |
+| .grammarClass | - | lexer / parser を作る規則のクラス (HackGrammar) |
+| .get_tokens | - | lexで字句解析をし、トークン化する |
+| .new_context | - | 共有の表を使う、アセンブル 1 回分の状態 (AsmContext) を作る |
+| .parse | - | 構文解析 (fast エンジンは表引き) をし、未解決の HackProgram を返す |
+| .encode | - | アセンブルしてシンボル解決済みの HackProgram を返す |
+| .optimize | ctx, program | optimizer があれば未解決の HackProgram を最適化する (peephole.PeepholeOptimizer) |
+| .asm | - | Hackアセンブリ化したコードをリストで返す |
+| .iter_asm | batch, chunk | Hackアセンブリ化したコードを逐次 yield する |
+| .collect_labels | ctx, chunk | ラベルだけを登録する (iter_asm の 1 パス目) |
+| .iter_chunks | ctx, chunk | chunk 行ずつ構文解析し、未解決の HackProgram を順に返す (iter_asm の 2 パス目) |
+| .fast_parse | ctx, lines, firstLine, cache | PLY を使わず表引きで変換し、未解決の HackProgram を返す |
+| .fast_asm | - | PLY を使わず表引きでアセンブルし、リストで返す |
+| .timer | - | フェーズごとの wall / CPU 時間 (profiling.PhaseTimer) |
+| .labels | - | 直近のアセンブルで定義されたラベル → アドレス |
+| .optimizeReport | - | 直近の最適化の結果 (peephole.PeepholeReport、optimizer が無ければ None) |
+    """
 
-        jumpCode                = dict()
-        jumpCode["type"]        = str(p[1])
+    def set_code(
+        self,
+        code                    = ""
+    ):
+        self.code               = code
 
-        if jumpCode["type"] not in jumpPattern.keys():
-            raise f"Syntax Error : {jumpCode["type"]} Unknown"
-        
-        jumpCode["code"]        = jumpPattern[jumpCode["type"]]
-        
-        p[0] = jumpCode
+    built                       = {}        # 規則のクラスごとにプロセス内で共有する lexer / parser
+    buildLock                   = threading.Lock()
+    grammarClass                = HackGrammar   # 表を作る字句・文法の規則 (状態を持たない)
 
+    def build(self, **kwargs):
+        with self.timer.phase("build"):
+            self.build_tables(**kwargs)
+
+    def build_tables(self, **kwargs):
+        if not kwargs:                      # 表はキャッシュから読み込み、プロセス内で共有する
+            with HackCodeAnalyze.buildLock:
+                shared          = HackCodeAnalyze.built.setdefault(self.grammarClass, {})
+                if "lexer" not in shared:
+                    shared["lexer"]     = cached_lexer(self.grammarClass(), "hack")
+                if (
+                    (self.engine        != "fast") and  # 構文解析表は使わない
+                    ("parser" not in shared)
+                ):
+                    shared["parser"]    = cached_parser(self.grammarClass(), "hack")
+            self.lexer          = shared["lexer"]
+            self.yacc           = shared.get("parser")
+            return
+
+        grammar                 = self.grammarClass()
+        self.lexer              = lex.lex(
+            module              = grammar, 
+            **kwargs
+        )
+        if self.engine          == "fast":
+            return
+
+        self.yacc               = yacc.yacc(
+            module              = grammar, 
+            **kwargs
+        )
+    
+    def new_context(self):
+        """
+        lexer は複製し、parser は表を共有したまま解析中の状態だけを分ける
+        (1 つのインスタンスを複数スレッドから使っても互いに干渉しない)
+        """
+        lexer                   = None
+        parser                  = None
+        if self.engine          != "fast":  # fast エンジンは lexer / parser を使わない
+            lexer               = self.lexer.clone()
+            parser              = copy.copy(self.yacc)
+        return AsmContext(
+            self.tracer, 
+            lexer, 
+            parser
+        )
+
+    def parse(self): # 構文解析 (fast エンジンは表引き) をし、未解決の HackProgram を返す
+        self.context            = self.new_context()
+        if self.engine          == "fast":
+            return self.fast_parse(self.context)
+        return self.context.parse(self.code)
+    
+    def get_tokens(self):
+        with self.timer.phase("tokens"):
+            lexer               = self.lexer.clone()
+            lexer.input(self.code)
+            self.sourceTokenList = []
+            while True:
+                tok             = lexer.token()
+                if not tok:
+                    break
+                self.sourceTokenList.append(tok)
+        return self.sourceTokenList
+    
+
+    def __str__(self):
+        self.get_tokens()
+        return "\n".join([str(t) for t in self.sourceTokenList])
+
+    def __enter__(self):
+        self.build()
+        return self
     
+    def __exit__(self, *args):
+        pass
+
+    def __init__(
+        self, 
+        code                    = "", 
+        debug                   = True,
+        engine                  = "ply",    # "ply" | "fast"
+        tracer                  = None,
+        timer                   = None,     # profiling.PhaseTimer (MemoryMeter を持たせるとメモリも計る)
+        optimizer               = None      # peephole.PeepholeOptimizer (構文解析とシンボル解決の間に適用する)
+    ):
+        if engine not in ("ply", "fast"):
+            raise ValueError(f"Unknown engine : {engine}")
+
+        self.debug              = debug
+        self.engine             = engine
+        self.tracer             = tracer    # tracing.Tracer (debug=True なら命令ごとに print する)
+        if (tracer is None) and debug:
+            self.tracer         = PrintTracer()
+        self.timer              = timer or PhaseTimer()
+        self.optimizer          = optimizer
+        self.optimizeReport     = None
+        memory                  = self.timer.memory
+        if (memory is not None) and (memory.limit is not None):    # 構文解析の途中でもメモリの上限を確認する
+            checker             = memory.tracer()
+            self.tracer         = checker if self.tracer is None else MultiTracer(self.tracer, checker)
+        self.set_code(code)
+
+        self.registerNum        = REGISTER_NUM
+        self.context            = AsmContext()              # 直近のアセンブルの状態
+
+    # 直近のアセンブルの状態
+    @property
+    def varTable(self):
+        return self.context.varTable
+
+    @property
+    def nextVarAddr(self):
+        return self.context.nextVarAddr
+
+    @property
+    def pc(self):
+        return self.context.pc
+
+    @property
+    def labels(self):
+        return self.context.symbols.labels
+
+    def get_next_addr(self):
+        return self.context.get_next_addr()
+
+
+    def encode(self):
+        """
+        アセンブルしてシンボル解決済みの HackProgram を返す
+        """
+        ctx                             = self.new_context()
+        if self.timer.detail and (ctx.lexer is not None):
+            self.timer.time_lexer(ctx.lexer)
+
+        with self.timer.phase("parse"):
+            if self.engine              == "fast":
+                program                 = self.fast_parse(ctx)
+            else:
+                program                 = ctx.parse(self.code)
+        program                         = self.optimize(ctx, program)
+        with self.timer.phase("resolve"):
+            ctx.resolve(program)
+
+        self.context                    = ctx
+        self.timer.instructions         = len(program)
+        return program
+
+    def optimize(self, ctx, program):
+        """
+        ラベルのアドレスは ctx.symbols の上で付け直される (トレーサーのイベントのアドレスは最適化前のもの)
+        """
+        if self.optimizer is None:
+            return program
+        with self.timer.phase("optimize"):
+            program, self.optimizeReport = self.optimizer.optimize(program, ctx.symbols)
+        ctx.program                     = program
+        ctx.pc                          = len(program)
+        return program
+
     def asm(self):
         """
         .hack 用の 16bit バイナリを list で返す
         """
+        program                         = self.encode()
+        with self.timer.phase("format"):
+            return program.lines()
 
-        out = []
-        for inst in self.parse():
-            if inst["instruction"]      == "A":
-                if inst["type"]         == "NUMBER":
-                    out.append(inst["code"])
-                else:
-                    if (
-                        (inst["code"]                   == "pending") and 
-                        (self.varTable[inst["at"]]      == -1)
-                    ):
-                        addr = self.get_next_addr()
-                        if addr is not None:
-                            self.varTable[inst["at"]]   = addr
-                        else: 
-                            self.varTable[inst["at"]]   = 0
-                    out.append(f"0{self.varTable[inst["at"]]:015b}")
-
-            elif inst["instruction"]    == "C":
-                out.append(inst["code"])
-
-        return out
+    def iter_asm(
+        self,
+        batch                           = None,
+        chunk                           = 1024
+    ):
+        """
+        .hack 用の 16bit バイナリを逐次 yield する
+        batch を指定すると batch 語ずつのリストで yield する
+
+        1 パス目でラベルのアドレスだけを確定させ (collect_labels)、
+        2 パス目で chunk 行ずつ変換して出力するため、
+        前方参照の待ち合わせが不要で、保持するのは chunk 行分の命令だけになる
+        """
+        if self.optimizer is not None:          # 最適化にはプログラム全体が要るので、まとめてアセンブルする
+            lines                       = self.asm()
+            if batch is None:
+                yield from lines
+            else:
+                for i in range(0, len(lines), batch):
+                    yield lines[i:i + batch]
+            return
+
+        ctx                             = self.new_context()
+        self.context                    = ctx
+        ctx.attach(None)
+        self.collect_labels(ctx, chunk)
+        ctx.symbols.freeze()                    # 同名のラベルを chunk ごとに定義し直さない (asm() と同じく最後の定義)
+        ctx.attach(self.tracer)
+
+        out                             = []
+        for program in self.iter_chunks(ctx, chunk):
+            for word in ctx.resolve(program).words:
+                code                    = f"{word:016b}"
+                if batch is None:
+                    yield code
+                    continue
+                out.append(code)
+                if len(out)             >= batch:
+                    yield out
+                    out                 = []
+
+        if out:
+            yield out
+
+    def collect_labels(self, ctx, chunk):
+        """
+        iter_asm の 1 パス目 (ラベルを ctx.symbols に登録する)
+        ply は chunk 行ずつ構文解析して結果を捨て、fast は命令の行を数えてラベルの行だけを解釈する
+        (fast の構文エラーは 2 パス目でその行まで進んだときに例外になる)
+        """
+        if self.engine                  != "fast":
+            for _ in ctx.iter_chunks(self.code, chunk):
+                pass
+            return
+
+        pc                              = 0
+        for lineno, line in enumerate(self.code.split("\n"), 1):
+            text                        = line.split("//", 1)[0].strip()
+            if not text:
+                continue
+            if text[0]                  != "(":
+                pc                      += 1
+                continue
+            ctx.symbols.define(self.fast_decode(line, lineno)[1], pc)
+
+    def iter_chunks(self, ctx, chunk):
+        """
+        エンジンに合わせてソースを chunk 行ずつ構文解析し、chunk ごとの未解決の HackProgram を順に返す
+        """
+        if self.engine                  != "fast":
+            yield from ctx.iter_chunks(self.code, chunk)
+            return
+
+        ctx.pc                          = 0
+        cache                           = {}
+        lines                           = self.code.split("\n")
+        for start in range(0, len(lines), chunk):
+            ctx.program                 = HackProgram()
+            yield self.fast_parse(ctx, lines[start:start + chunk], start + 1, cache)
     
 
-if __name__ == "__main__":
-    debug           = False
+    def fast_decode(self, line, lineno):
+        """
+        1 行を表引きで解釈する
+        | 戻り値 | 意味 |
+        | - | - |
+        | None | 空行 |
+        | int | 確定した命令語 (定義済みシンボルの A命令も ply と同じく値にする) |
+        | ("@", symbol) | シンボル参照の A命令 |
+        | ("(", label) | L命令 |
+        """
+        line                    = line.split("//", 1)[0]
+        if self.splitPattern.search(line):  # A M=D, @1 2 など (ply と同じく受け付けない)
+            raise HackSyntaxError(f"Syntax Error : line {lineno} : {line.strip()}")
+        line                    = line.replace(" ", "").replace("\t", "").replace("\r", "")
+        if not line:
+            return None
+
+        if line[0]              == "@":
+            value               = line[1:]
+            if self.numberPattern.fullmatch(value):
+                if int(value)   > 0x7FFF:
+                    raise HackSyntaxError(a_value_error(lineno, value))
+                return int(value)
+            if value in self.reservedVars:
+                return PREDEFINED_SYMBOLS[value]
+            if (
+                self.symbolPattern.fullmatch(value) and 
+                (value not in self.reservedWords)
+            ):
+                return ("@", value)
+
+        elif line[0]            == "(":
+            label               = line[1:-1]
+            if (
+                (line[-1]       == ")") and 
+                self.symbolPattern.fullmatch(label) and 
+                (label not in self.reservedWords)
+            ):
+                return ("(", label)
+
+        elif line in C_TABLE:
+            return C_TABLE[line]
+
+        raise HackSyntaxError(f"Syntax Error : line {lineno} : {line}")
+
+    def fast_parse(
+        self, 
+        ctx, 
+        lines                   = None,     # 省略時は code 全体
+        firstLine               = 1,        # lines[0] の行番号
+        cache                   = None      # 行 → 解釈結果 (同じ行は一度だけ解釈する)
+    ):
+        """
+        PLY を使わず 1 行ずつ表引きで変換し、ラベルを登録する (1 パス目)
+        未解決の HackProgram を返す
+        """
+        if lines is None:
+            lines               = self.code.split("\n")
+        if cache is None:
+            cache               = {}
+        if ctx.tracer is not None:
+            return self.fast_parse_traced(ctx, lines, firstLine, cache)
+
+        program                 = ctx.program
+        for lineno, line in enumerate(lines, firstLine):
+            if line in cache:
+                inst            = cache[line]
+            else:
+                inst            = self.fast_decode(line, lineno)
+                cache[line]     = inst
+
+            if inst is None:
+                continue
+
+            if isinstance(inst, int):
+                program.append(inst)
+                ctx.pc          += 1
+            elif inst[0]        == "@":
+                program.append(inst[1])
+                ctx.pc          += 1
+            else:
+                ctx.symbols.define(inst[1], ctx.pc)
 
-    if len(argv)    < 2:
-        file        = "main.asm"
-    else:
-        file        = argv[1]
+        return program
 
-    with open(file, "r", encoding="UTF-8") as source:
-        program     = source.read()
+    def fast_parse_traced(self, ctx, lines, firstLine, cache):
+        """
+        fast_parse と同じ変換をし、命令ごとに ctx.tracer へイベントを送る
+        """
+        program                 = ctx.program
+        event                   = ctx.tracer.event
+        for lineno, line in enumerate(lines, firstLine):
+            if line in cache:
+                inst            = cache[line]
+            else:
+                inst            = self.fast_decode(line, lineno)
+                cache[line]     = inst
+
+            if inst is None:
+                continue
+
+            if isinstance(inst, int):
+                program.append(inst)
+                event("C" if inst & 0x8000 else "A", ctx.pc, inst, lineno)
+                ctx.pc          += 1
+            elif inst[0]        == "@":
+                program.append(inst[1])
+                event("A", ctx.pc, PREDEFINED_SYMBOLS.get(inst[1], inst[1]), lineno)   # ply と同じく定数名は値にする
+                ctx.pc          += 1
+            else:
+                ctx.symbols.define(inst[1], ctx.pc)
+                event("L", ctx.pc, inst[1], lineno)
 
-    with HackCodeAnalyze(program, debug = debug) as l:
-        # print(l)
-        result      = l.asm()
-    
-    dirName         = os.path.dirname(file)
-    buildDir        = f"{dirName}/build"
-    os.makedirs(buildDir, exist_ok=True)
+        return program
 
-    baseName        = os.path.splitext(os.path.basename(file))[0]  # ファイル名だけ取り出す
-    hackFile        = os.path.join(buildDir, f"{baseName}.hack")
+    def fast_asm(self):
+        """
+        PLY を使わない 2 パスアセンブラ
+        1 パス目でラベルを登録し、2 パス目でシンボルを解決する
+        (PLY を使う asm() と同じ結果になる)
+        """
+        ctx                     = self.new_context()
+        with self.timer.phase("parse"):
+            program             = self.fast_parse(ctx)
+        program                 = self.optimize(ctx, program)
+        with self.timer.phase("resolve"):
+            ctx.resolve(program)
+        self.context            = ctx
+        with self.timer.phase("format"):
+            return program.lines()
+    
 
-    with open(hackFile, "w", encoding="UTF-8") as f:
-        f.write("")
+def assemble(code, engine = "ply"):
+    """
+    code をアセンブルして 16bit バイナリのリストを返す
+    表はプロセス内で共有されるので、スレッドプールなどから繰り返し呼んでも再構築しない
+    """
+    with HackCodeAnalyze(code, debug = False, engine = engine) as l:
+        return l.asm()
     
-    with open(hackFile, "a", encoding="UTF-8") as f:
-        for r in result:
-            print(r, file = f)
-            if (debug):
-                print(r)
-        
-    input("終了")
\ No newline at end of file
+
+if __name__ == "__main__":
+    from batch import main  # ファイル・ディレクトリ・glob を並列にアセンブルする
+
+    status          = main(argv[1:])
+    if len(argv)    < 2:    # 引数なし (ダブルクリックでの起動) のときだけ止める
+        input("終了")
+    exit(status)
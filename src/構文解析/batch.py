@@ -0,0 +1,353 @@
+"""複数の .asm をまとめてアセンブルする
+| function | args | description |
+| - | - | - |
+| collect_sources | paths | ファイル・ディレクトリ・glob から .asm の一覧を作る |
+| build_version | engine, optimize | アセンブラ (asm.py, rom.py, sourcemap.py)・文法・エンジンのハッシュ (最適化するなら peephole.py と設定も含める) |
+| load_manifest / save_manifest | buildDir | build/manifest.json を読み書きする |
+| build_file | file, engine, formats, previous, version, profile, memory, optimize | 1 ファイルをアセンブルし、同じ階層の build/ に書き出す (変更が無ければ飛ばす) |
+| build_all | files, jobs, engine, formats, force, profile, memory, optimize | プロセスプールで並列にアセンブルし、manifest を更新する |
+| main | args | コマンドライン (asm.py からも呼ばれる) |
+
+```bash
+python batch.py . ../字句解析/Hack -j 8 -f hack -f bin
+python asm.py "*.asm" --engine fast
+python asm.py Pong.asm --force --profile profile.json --cprofile
+python asm.py build_big.asm --memory-limit 512
+python asm.py Pong.asm --source-map       # build/Pong.map.json (ROM アドレス → 行・ラベル) も書き出す
+python asm.py Pong.asm --optimize --disable-rule inc_dec     # ピープホール最適化 (peephole.py)
+```
+"""
+
+from asm import HackCodeAnalyze, HackGrammar
+from tablecache import grammar_hash
+from profiling import MemoryMeter, PhaseTimer, format_memory, format_memory_failures, profile_call, total_phases, write_report
+from rom import FORMATS, write_rom
+from peephole import RULES, PeepholeOptimizer
+from sourcemap import SourceMapTracer, collect_source_map
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from sys import argv, exit
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+
+MANIFEST_NAME               = "manifest.json"
+MAP_FORMAT                  = "map.json"        # formats に入れるとソースマップも書き出す (manifest では出力形式と同じ扱い)
+
+# build_file の結果 (skipped は manifest と一致して書き出しを省略したとき True)
+# phases はフェーズごとの時間、actions は cProfile を使ったときの文法アクションごとの時間
+BuildResult                 = namedtuple(
+    "BuildResult", 
+    "file words sec error skipped entry phases actions", 
+    defaults                = (None, None)
+)
+
+def collect_sources(paths):
+    """
+    ディレクトリは直下の *.asm、glob は一致したファイル (** も可) に展開する
+    重複は除き、指定順を保つ
+    """
+    files                   = []
+    for path in paths:
+        if os.path.isdir(path):
+            found           = sorted(glob.glob(os.path.join(path, "*.asm")))
+        elif os.path.exists(path):
+            found           = [path]
+        else:
+            found           = sorted(glob.glob(path, recursive = True))
+            if not found:
+                raise FileNotFoundError(f"No such file or pattern : {path}")
+        files               += [f for f in found if os.path.isfile(f)]
+    return list(dict.fromkeys(files))
+
+def build_base(file):
+    """
+    <ソースのディレクトリ>/build/<ファイル名> (拡張子なし)
+    """
+    buildDir                = os.path.join(os.path.dirname(file), "build")
+    baseName                = os.path.splitext(os.path.basename(file))[0]
+    return os.path.join(buildDir, baseName)
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def build_version(engine = "ply", optimize = None):
+    """
+    アセンブラのソース (asm.py, rom.py, sourcemap.py)・文法・エンジンから求めたハッシュ
+    どれかが変われば、ソースが同じでも作り直す (別のエンジンで作った出力は使わない)
+    optimize (使うルールのタプル) を指定すると peephole.py と使うルールもハッシュに含める
+    """
+    digest                  = hashlib.sha256(grammar_hash(HackGrammar()).encode())
+    digest.update(engine.encode())
+    here                    = os.path.dirname(os.path.abspath(__file__))
+    names                   = ["asm.py", "rom.py", "sourcemap.py"]
+    if optimize is not None:
+        names.append("peephole.py")
+        digest.update(",".join(sorted(optimize)).encode())
+    for name in names:
+        with open(os.path.join(here, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def load_manifest(buildDir):
+    """
+    { ソースのファイル名 : { "source", "assembler", "words", "outputs" : { 出力ファイル名 : ハッシュ } } }
+    """
+    try:
+        with open(os.path.join(buildDir, MANIFEST_NAME), "r", encoding="UTF-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(buildDir, manifest):
+    path                    = os.path.join(buildDir, MANIFEST_NAME)
+    tmpPath                 = f"{path}.tmp"
+    with open(tmpPath, "w", encoding="UTF-8") as f:
+        json.dump(manifest, f, indent = 2, sort_keys = True)
+    os.replace(tmpPath, path)
+
+def is_up_to_date(entry, sourceHash, version, base, formats):
+    """
+    ソースとアセンブラが同じで、要求された全形式の出力が記録どおりに残っていれば True
+    """
+    if (
+        (entry is None) or 
+        (entry.get("source")    != sourceHash) or 
+        (entry.get("assembler") != version)
+    ):
+        return False
+
+    outputs                 = entry.get("outputs", {})
+    for ext in formats:
+        path                = f"{base}.{ext}"
+        name                = os.path.basename(path)
+        if (name not in outputs) or not os.path.exists(path):
+            return False
+        with open(path, "rb") as f:
+            if content_hash(f.read()) != outputs[name]:
+                return False
+    return True
+
+def warm_up(engine):
+    """
+    ワーカープロセスの起動時に表を読み込んでおく
+    """
+    HackCodeAnalyze(debug = False, engine = engine).build()
+
+def build_file(
+    file,
+    engine                  = "ply",
+    formats                 = ("hack",),
+    previous                = None,
+    version                 = None,
+    profile                 = None,         # None | "phases" | "cprofile"
+    memory                  = None,         # None | MemoryMeter の引数 {"limit" : bytes}
+    optimize                = None          # None | ピープホール最適化で使うルールのタプル (PeepholeOptimizer.rules)
+):
+    """
+    BuildResult を返す (成功時の error は None)
+    previous (前回の manifest の項目) と一致すればアセンブルせずに飛ばす
+    profile を指定すると字句解析の時間も分けて計り、"cprofile" なら文法アクションごとの時間も返す
+    memory を指定すると tracemalloc でフェーズごとのメモリも計り、上限を超えた時点で失敗にする
+    optimize を指定すると構文解析の後にピープホール最適化をする
+    """
+    start                   = time.perf_counter()
+    base                    = build_base(file)
+    meter                   = None if memory is None else MemoryMeter(**memory).start()
+    timer                   = PhaseTimer(detail = profile is not None, memory = meter)
+    actions                 = None
+    try:
+        with open(file, "rb") as source:
+            data            = source.read()
+        sourceHash          = content_hash(data)
+
+        if is_up_to_date(previous, sourceHash, version, base, formats):
+            return BuildResult(file, previous.get("words", 0), time.perf_counter() - start, None, True, previous)
+
+        optimizer           = None if optimize is None else PeepholeOptimizer(set(RULES) - set(optimize), optimize)
+        tracer              = SourceMapTracer() if MAP_FORMAT in formats else None     # ソースマップはこのアセンブルから作る
+        with HackCodeAnalyze(data.decode("UTF-8"), debug = False, engine = engine, tracer = tracer, timer = timer, optimizer = optimizer) as l:
+            if profile      == "cprofile":
+                result, actions = profile_call(l.encode)
+            else:
+                result      = l.encode()
+
+        with timer.phase("write"):
+            os.makedirs(os.path.dirname(base), exist_ok=True)
+            outputs         = dict((previous or {}).get("outputs", {}))
+            paths           = write_rom(base, result.words, [ext for ext in formats if ext != MAP_FORMAT])
+            if tracer is not None:
+                sourceMap   = collect_source_map(l, tracer, os.path.basename(file))
+                paths.append(sourceMap.save(f"{base}.{MAP_FORMAT}"))
+            for path in paths:
+                with open(path, "rb") as f:
+                    outputs[os.path.basename(path)] = content_hash(f.read())
+    except Exception as e:
+        return BuildResult(file, 0, time.perf_counter() - start, f"{type(e).__name__}: {e}", False, None, timer.as_dict())
+    finally:
+        if meter is not None:
+            meter.stop()
+
+    entry                   = {
+        "source"            : sourceHash,
+        "assembler"         : version,
+        "words"             : len(result),
+        "outputs"           : outputs
+    }
+    return BuildResult(file, len(result), time.perf_counter() - start, None, False, entry, timer.as_dict(), actions)
+
+def build_all(
+    files,
+    jobs                    = None,
+    engine                  = "ply",
+    formats                 = ("hack",),
+    force                   = False,
+    profile                 = None,
+    memory                  = None,
+    optimize                = None
+):
+    """
+    jobs 個のワーカーで並列にアセンブルし、BuildResult を files の順で返す
+    jobs が 1 ならこのプロセスで順に処理する
+    manifest はワーカー同士が書き合わないよう、このプロセスでまとめて更新する
+    失敗したファイルは manifest に記録しない (次の実行でもアセンブルし直してエラーを出す)
+    """
+    version                 = build_version(engine, optimize)
+    manifests               = {}
+    previous                = []
+    for file in files:
+        buildDir            = os.path.dirname(build_base(file))
+        if buildDir not in manifests:
+            manifests[buildDir] = load_manifest(buildDir)
+        entry               = manifests[buildDir].get(os.path.basename(file))
+        previous.append(None if force else entry)
+
+    if (jobs == 1) or (len(files) <= 1):
+        warm_up(engine)
+        results             = list(map(
+            build_file,
+            files,
+            [engine] * len(files),
+            [formats] * len(files),
+            previous,
+            [version] * len(files),
+            [profile] * len(files),
+            [memory] * len(files),
+            [optimize] * len(files)
+        ))
+    else:
+        jobs                = jobs or os.cpu_count() or 1
+        with ProcessPoolExecutor(
+            max_workers     = jobs,
+            initializer     = warm_up,
+            initargs        = (engine,)
+        ) as pool:
+            results         = list(pool.map(
+                build_file,
+                files,
+                [engine] * len(files),
+                [formats] * len(files),
+                previous,
+                [version] * len(files),
+                [profile] * len(files),
+                [memory] * len(files),
+                [optimize] * len(files),
+                chunksize   = max(1, len(files) // (jobs * 4))  # 小さいファイルが多いときの往復を減らす
+            ))
+
+    changed                 = set()
+    for result in results:
+        if result.skipped or (result.error is not None) or (result.entry is None):
+            continue
+        buildDir            = os.path.dirname(build_base(result.file))
+        manifests[buildDir][os.path.basename(result.file)] = result.entry
+        changed.add(buildDir)
+    for buildDir in changed:
+        save_manifest(buildDir, manifests[buildDir])
+
+    return results
+
+def print_summary(results, elapsed):
+    width                   = max([len(r.file) for r in results] + [4])
+    print(f"{'file':<{width}} {'words':>8} {'sec':>8}  status")
+    for r in results:
+        status              = r.error or ("up to date" if r.skipped else "ok")
+        print(f"{r.file:<{width}} {r.words:>8} {r.sec:>8.3f}  {status}")
+
+    failed                  = sum([1 for r in results if r.error is not None])
+    skipped                 = sum([1 for r in results if r.skipped])
+    words                   = sum([r.words for r in results if not r.skipped])
+    print(
+        f"{len(results)} files, {failed} failed, {skipped} up to date, {words} words "
+        f"in {elapsed:.3f}s ({words / max(elapsed, 1e-9):.0f} words/s)"
+    )
+    return failed
+
+def main(args):
+    parser                  = argparse.ArgumentParser(
+        description         = "Hack アセンブラ (ファイル・ディレクトリ・glob をまとめてアセンブルする)"
+    )
+    parser.add_argument("sources", nargs = "*", default = ["main.asm"])
+    parser.add_argument("-j", "--jobs", type = int, default = None, help = "ワーカー数 (既定は CPU 数)")
+    parser.add_argument("-f", "--format", action = "append", choices = list(FORMATS), help = "出力形式 (複数指定可、既定は hack)")
+    parser.add_argument("--engine", choices = ("ply", "fast"), default = "ply")
+    parser.add_argument("--source-map", action = "store_true", help = "ROM アドレス → 行・ラベルのソースマップ (.map.json) も書き出す")
+    parser.add_argument("--optimize", action = "store_true", help = "構文解析の後にピープホール最適化をする (peephole.py)")
+    parser.add_argument("--disable-rule", action = "append", default = [], metavar = "RULE", help = "--optimize で使わないルール (複数指定可)")
+    parser.add_argument("--enable-rule", action = "append", default = [], metavar = "RULE", help = "--optimize で既定では使わないルール (dead_code) も使う")
+    parser.add_argument("--force", action = "store_true", help = "manifest を無視してすべて作り直す")
+    parser.add_argument("--profile", metavar = "REPORT", help = "フェーズごとの時間を JSON に書き出す")
+    parser.add_argument("--cprofile", action = "store_true", help = "--profile に文法アクションごとの時間 (cProfile) も加える")
+    parser.add_argument("--memory", action = "store_true", help = "tracemalloc でフェーズごとのメモリを計る (遅くなる)")
+    parser.add_argument("--memory-limit", type = float, metavar = "MiB", help = "1 ファイルあたりのメモリの上限 (--memory を含む)")
+    options                 = parser.parse_args(args)
+    if options.optimize and options.source_map:
+        parser.error("--source-map can not be used with --optimize (the source map has the unoptimized addresses)")
+    try:
+        rules               = tuple(PeepholeOptimizer(options.disable_rule, options.enable_rule).rules)
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        files               = collect_sources(options.sources)
+    except FileNotFoundError as e:
+        print(e)
+        return 2
+
+    memory                  = None
+    if options.memory or (options.memory_limit is not None):
+        memory              = {"limit": None if options.memory_limit is None else int(options.memory_limit * (1 << 20))}
+
+    start                   = time.perf_counter()
+    results                 = build_all(
+        files,
+        jobs                = options.jobs,
+        engine              = options.engine,
+        formats             = tuple(options.format or ["hack"]) + ((MAP_FORMAT,) if options.source_map else ()),
+        force               = options.force,
+        profile             = ("cprofile" if options.cprofile else "phases") if options.profile else None,
+        memory              = memory,
+        optimize            = rules if options.optimize else None
+    )
+    elapsed                 = time.perf_counter() - start
+    failed                  = print_summary(results, elapsed)
+    if memory is not None:
+        # 上限を超えたファイルも、超えるまでの計測結果を合計に入れる
+        print("\n".join(format_memory(total_phases(results, failed = True)) + format_memory_failures(results)))
+    if options.profile:
+        write_report(
+            options.profile, 
+            results, 
+            elapsed, 
+            engine          = options.engine, 
+            jobs            = options.jobs, 
+            cprofile        = options.cprofile
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    exit(main(argv[1:]))
@@ -0,0 +1,480 @@
+"""ベンチマーク
+| function | args | description |
+| - | - | - |
+| synthesize | lines | 指定行数程度の Hack アセンブリを生成する |
+| run_asm | code, engine | HackCodeAnalyze でアセンブルし、経過時間と語数を返す |
+| bench_scaling | file, scales, engines | 入力サイズを増やしながらアセンブル時間を計測する |
+| bench_startup | file, engines | 新しいプロセスが最初の命令語を出すまでの時間を計測する (表キャッシュなし / あり) |
+| bench_memory | file, engines | parse() の結果と asm() のピークメモリを 1 命令あたりで計測する |
+| bench_incremental | file | 1 行の編集を全体の再アセンブルとインクリメンタル再アセンブルで比較する |
+| bench_suite | sizes, engines, seed, ... | サンプルと合成プログラムで HackCodeAnalyze / LexicalAnalyze を計測し、正しさも確認する |
+| compare | results, baseline | 保存した 2 つの結果の速度を比べる |
+| main | args | コマンドライン |
+
+```bash
+python bench.py Pong.asm                                 # 上の各計測を表示する
+python bench.py --suite --out results.json               # サンプルと 1 万〜100 万行の合成プログラム
+python bench.py --suite --sizes 10000000 --engine fast --compare results.json
+```
+"""
+
+from asm import HackCodeAnalyze
+from generate import generate_calc, generate_hack
+from incremental import assemble_lines, reassemble
+from rom import read_hack
+from sys import argv, exit
+import argparse
+import contextlib
+import gc
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE                        = os.path.dirname(os.path.abspath(__file__))
+LEXICAL_DIR                 = os.path.join(HERE, "..", "字句解析")     # LexicalAnalyze (sample.py)
+
+sys.path.insert(0, LEXICAL_DIR)
+from sample import LexicalAnalyze
+
+# 最初の命令語を 1 つ出力するだけの子プロセス
+FIRST_WORD_SCRIPT           = """
+from asm import HackCodeAnalyze
+from sys import argv
+with open(argv[1], "r", encoding="UTF-8") as source:
+    program = source.read()
+with HackCodeAnalyze(program, debug = False, engine = argv[2]) as l:
+    print(next(l.iter_asm()), flush = True)
+"""
+
+# LexicalAnalyze で構文解析を終えるまでの子プロセス (PRINT の出力は捨てる)
+CALC_START_SCRIPT           = """
+from sample import LexicalAnalyze
+from sys import argv
+import contextlib, os
+with open(argv[1], "r", encoding="UTF-8") as source:
+    program = source.read()
+with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+    with LexicalAnalyze(program) as l:
+        l.parse()
+print("done", flush = True)
+"""
+
+def synthesize(lines = 10000):
+    """
+    ラベル・変数・C 命令を混ぜた Hack アセンブリを lines 行程度生成する
+    """
+    block                   = (
+        "@{i}",
+        "D=A",
+        "@var{v}",
+        "M=D",
+        "(LOOP{i})",
+        "@SP",
+        "AM=M+1",
+        "A=A-1",
+        "D=M",
+        "@LOOP{i}",
+        "D;JGT",
+    )
+    out                     = []
+    i                       = 0
+    while len(out)          < lines:
+        for line in block:
+            out.append(line.format(i = i, v = i % 64))
+        i                   += 1
+    return "\n".join(out[:lines]) + "\n"
+
+def run_asm(code, engine = "ply"):
+    with HackCodeAnalyze(code, debug = False, engine = engine) as l:
+        start               = time.perf_counter()
+        result              = l.asm()
+        elapsed             = time.perf_counter() - start
+    return elapsed, len(result)
+
+def bench_scaling(
+    file                    = "Pong.asm",
+    scales                  = (1, 2, 4, 8),
+    engines                 = ("ply", "fast")
+):
+    """
+    file とその n 倍の合成入力でアセンブル時間を計測し、1 行あたりの時間を表示する
+    線形時間であれば us/line はサイズによらずほぼ一定になる
+    """
+    with open(file, "r", encoding="UTF-8") as source:
+        program             = source.read()
+
+    lineCount               = program.count("\n") + 1
+    cases                   = [(file, program)]
+    for scale in scales:
+        cases.append((f"synthetic x{scale}", synthesize(lineCount * scale)))
+
+    print(f"{'input':<20} {'engine':<6} {'lines':>10} {'words':>10} {'sec':>10} {'us/line':>10}")
+    for name, code in cases:
+        lines               = code.count("\n") + 1
+        for engine in engines:
+            elapsed, words  = run_asm(code, engine)
+            print(f"{name:<20} {engine:<6} {lines:>10} {words:>10} {elapsed:>10.3f} {elapsed / lines * 1e6:>10.2f}")
+
+
+def first_word_time(
+    file, 
+    engine, 
+    cacheDir, 
+    script                  = FIRST_WORD_SCRIPT, 
+    cwd                     = HERE
+):
+    env                     = dict(os.environ, HACKASM_CACHE = cacheDir)
+    start                   = time.perf_counter()
+    with subprocess.Popen(
+        [sys.executable, "-c", script, file, engine],
+        stdout              = subprocess.PIPE,
+        cwd                 = cwd,
+        env                 = env,
+        text                = True
+    ) as proc:
+        proc.stdout.readline()
+        elapsed             = time.perf_counter() - start
+    return elapsed
+
+def bench_startup(
+    file                    = "Add.asm",
+    engines                 = ("ply", "fast"),
+    calc                    = False
+):
+    """
+    空のキャッシュ (cold) と生成済みのキャッシュ (warm) で
+    プロセス起動から最初の命令語が出るまでの時間を比較する
+    calc を指定すると LexicalAnalyze で main.txt の構文解析を終えるまでの時間も計る
+    """
+    file                    = os.path.abspath(file)
+    cases                   = [("HackCodeAnalyze", engine, file, FIRST_WORD_SCRIPT, HERE) for engine in engines]
+    if calc:
+        cases.append(("LexicalAnalyze", "ply", os.path.join(LEXICAL_DIR, "main.txt"), CALC_START_SCRIPT, LEXICAL_DIR))
+
+    results                 = []
+    print(f"{'assembler':<16} {'engine':<6} {'cold sec':>10} {'warm sec':>10}")
+    for assembler, engine, path, script, cwd in cases:
+        with tempfile.TemporaryDirectory() as cacheDir:
+            cold            = first_word_time(path, engine, cacheDir, script, cwd)
+            warm            = first_word_time(path, engine, cacheDir, script, cwd)
+        print(f"{assembler:<16} {engine:<6} {cold:>10.3f} {warm:>10.3f}")
+        results.append({
+            "assembler"     : assembler,
+            "engine"        : engine,
+            "input"         : os.path.basename(path),
+            "coldSec"       : cold,
+            "warmSec"       : warm,
+        })
+    return results
+
+
+def bench_memory(
+    file                    = "Pong.asm",
+    engines                 = ("ply", "fast")
+):
+    """
+    parse() の結果が保持するバイト数と、asm() 実行中のピークを 1 命令あたりで表示する
+    (fast エンジンは parse() を持たないので asm() のみ)
+    """
+    with open(file, "r", encoding="UTF-8") as source:
+        program             = source.read()
+
+    print(f"{'engine':<6} {'words':>10} {'parse B/inst':>14} {'asm peak B/inst':>16}")
+    for engine in engines:
+        with HackCodeAnalyze(program, debug = False, engine = engine) as l:
+            words           = len(l.asm())
+            parsed          = float("nan")
+            if engine       != "fast":
+                gc.collect()
+                tracemalloc.start()
+                result      = l.parse()
+                parsed      = tracemalloc.get_traced_memory()[0] / words
+                tracemalloc.stop()
+                del result
+
+            gc.collect()
+            tracemalloc.start()
+            l.asm()
+            peak            = tracemalloc.get_traced_memory()[1] / words
+            tracemalloc.stop()
+        print(f"{engine:<6} {words:>10} {parsed:>14.1f} {peak:>16.1f}")
+
+
+def bench_incremental(file = "Pong.asm"):
+    """
+    ソースの中ほどで行を書き換える・挿入する・ラベル行を消す編集について、
+    全体の再アセンブル (ply / fast) と reassemble() の時間を比べ、結果が一致するか確認する
+    """
+    with open(file, "r", encoding="UTF-8") as source:
+        lines               = source.read().split("\n")
+
+    middle                  = len(lines) // 2
+    cIndex                  = next(i for i in range(middle, len(lines)) if "=" in lines[i])
+    labelIndex              = next(i for i in range(middle, len(lines)) if lines[i].strip().startswith("("))
+    cases                   = [
+        ("replace C line", [(cIndex, cIndex + 1, ["D=D+1"])]),
+        ("insert 2 lines", [(middle, middle, ["@SP", "M=M+1"])]),
+        ("delete label", [(labelIndex, labelIndex + 1, [])]),
+    ]
+
+    print(f"{'edit':<16} {'ply sec':>10} {'fast sec':>10} {'incr sec':>10} {'same':>6}")
+    for name, edits in cases:
+        assembly            = assemble_lines("\n".join(lines))
+        edited              = list(lines)
+        for start, end, newLines in sorted(edits, reverse = True):
+            edited[start:end] = newLines
+        code                = "\n".join(edited)
+
+        elapsed             = {}
+        for engine in ("ply", "fast"):
+            elapsed[engine], _ = run_asm(code, engine)
+
+        start               = time.perf_counter()
+        reassemble(assembly, edits)
+        incr                = time.perf_counter() - start
+
+        with HackCodeAnalyze(code, debug = False, engine = "fast") as l:
+            same            = assembly.lines() == l.asm()
+        print(f"{name:<16} {elapsed['ply']:>10.4f} {elapsed['fast']:>10.4f} {incr:>10.4f} {str(same):>6}")
+
+
+
+def timed(func, repeat = 1):
+    """
+    func を repeat 回実行し、(最短の秒数, 最後の戻り値) を返す
+    """
+    best                    = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start               = time.perf_counter()
+        result              = func()
+        best                = min(best, time.perf_counter() - start)
+    return best, result
+
+def peak_bytes(func):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def hack_case(
+    name, 
+    code, 
+    expected, 
+    engine, 
+    repeat                  = 1, 
+    memory                  = True
+):
+    """
+    HackCodeAnalyze で code を計測し、expected (命令語の列、無ければ None) と比べる
+    """
+    lines                   = code.count("\n") + 1
+    l                       = HackCodeAnalyze(code, debug = False, engine = engine)
+    l.build()
+    sec, program            = timed(l.encode, repeat)
+    firstWord, _            = timed(lambda: next(l.iter_asm(), None), repeat)
+    return {
+        "assembler"         : "HackCodeAnalyze",
+        "engine"            : engine,
+        "input"             : name,
+        "lines"             : lines,
+        "words"             : len(program),
+        "sec"               : sec,
+        "linesPerSec"       : lines / sec,
+        "firstWordSec"      : firstWord,
+        "peakBytes"         : peak_bytes(l.encode) if memory else None,
+        "ok"                : None if expected is None else list(program.words) == list(expected),
+    }
+
+def calc_case(
+    name, 
+    code, 
+    expected, 
+    repeat                  = 1, 
+    memory                  = True
+):
+    """
+    LexicalAnalyze で code を計測し、expected (最後の symbolTable、無ければ None) と比べる
+    """
+    lines                   = code.count("\n") + 1
+    l                       = LexicalAnalyze(code)
+    l.build()
+
+    def run():
+        l.symbolTable       = {}
+        with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+            l.parse()
+        return l.symbolTable
+
+    sec, symbolTable        = timed(run, repeat)
+    return {
+        "assembler"         : "LexicalAnalyze",
+        "engine"            : "ply",
+        "input"             : name,
+        "lines"             : lines,
+        "words"             : len(symbolTable),
+        "sec"               : sec,
+        "linesPerSec"       : lines / sec,
+        "firstWordSec"      : None,
+        "peakBytes"         : peak_bytes(run) if memory else None,
+        "ok"                : None if expected is None else symbolTable == expected,
+    }
+
+def sample_cases():
+    """
+    (名前, ソース, build/<name>.hack の命令語) のリスト
+    """
+    cases                   = []
+    for file in sorted(glob.glob(os.path.join(HERE, "*.asm"))):
+        with open(file, "r", encoding="UTF-8") as source:
+            code            = source.read()
+        baseName            = os.path.splitext(os.path.basename(file))[0]
+        hackFile            = os.path.join(HERE, "build", f"{baseName}.hack")
+        cases.append((os.path.basename(file), code, read_hack(hackFile) if os.path.exists(hackFile) else None))
+    return cases
+
+def print_case(case):
+    ok                      = {None: "-", True: "OK", False: "NG"}[case["ok"]]
+    peak                    = "-" if case["peakBytes"] is None else f"{case['peakBytes'] / (1 << 20):.1f}"
+    first                   = "-" if case["firstWordSec"] is None else f"{case['firstWordSec']:.4f}"
+    print(
+        f"{case['assembler']:<16} {case['engine']:<6} {case['input']:<22} {case['lines']:>9} "
+        f"{case['sec']:>9.4f} {case['linesPerSec']:>11.0f} {first:>9} {peak:>9} {ok:>4}"
+    )
+
+def bench_suite(
+    sizes                   = (10000, 100000, 1000000),
+    engines                 = ("ply", "fast"),
+    seed                    = 0,
+    labelDensity            = 0.05,
+    variables               = 64,
+    plyMax                  = 100000,   # ply エンジンと LexicalAnalyze で計測する最大の行数
+    memoryMax               = 1000000,  # tracemalloc でピークを計る最大の行数
+    repeat                  = 3,        # サンプルは repeat 回の最短を取る
+    startup                 = True
+):
+    """
+    サンプル (build/*.hack と比較) と seed から生成した合成プログラム (生成時の期待値と比較) を計測する
+    JSON にできる dict を返す
+    """
+    cases                   = []
+    print(
+        f"{'assembler':<16} {'engine':<6} {'input':<22} {'lines':>9} "
+        f"{'sec':>9} {'lines/s':>11} {'first s':>9} {'peak MiB':>9} {'ok':>4}"
+    )
+    for name, code, expected in sample_cases():
+        for engine in engines:
+            cases.append(hack_case(name, code, expected, engine, repeat))
+            print_case(cases[-1])
+
+    with open(os.path.join(LEXICAL_DIR, "main.txt"), "r", encoding="UTF-8") as source:
+        cases.append(calc_case("main.txt", source.read(), None, repeat))
+        print_case(cases[-1])
+
+    for lines in sizes:
+        memory              = lines <= memoryMax
+        hack                = generate_hack(lines, seed, labelDensity, variables)
+        for engine in engines:
+            if (engine != "fast") and (lines > plyMax):
+                continue
+            cases.append(hack_case(f"synthetic {lines}", hack.code, hack.words, engine, memory = memory))
+            print_case(cases[-1])
+        del hack
+
+        if lines            <= plyMax:
+            calc            = generate_calc(lines, seed)
+            cases.append(calc_case(f"synthetic {lines}", calc.code, calc.symbolTable, memory = memory))
+            print_case(cases[-1])
+            del calc
+
+    return {
+        "meta"              : {
+            "time"          : time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python"        : platform.python_version(),
+            "platform"      : platform.platform(),
+            "cpus"          : os.cpu_count(),
+            "seed"          : seed,
+            "labelDensity"  : labelDensity,
+            "variables"     : variables,
+        },
+        "cases"             : cases,
+        "startup"           : bench_startup(engines = engines, calc = True) if startup else [],
+    }
+
+def compare(results, baseline):
+    """
+    同じ (assembler, engine, input) の計測について、baseline に対する速さの比を表示する
+    """
+    base                    = {
+        (c["assembler"], c["engine"], c["input"]): c for c in baseline["cases"]
+    }
+    print(f"{'assembler':<16} {'engine':<6} {'input':<22} {'base sec':>10} {'sec':>10} {'speedup':>8}")
+    for case in results["cases"]:
+        old                 = base.get((case["assembler"], case["engine"], case["input"]))
+        if old is None:
+            continue
+        print(
+            f"{case['assembler']:<16} {case['engine']:<6} {case['input']:<22} "
+            f"{old['sec']:>10.4f} {case['sec']:>10.4f} {old['sec'] / case['sec']:>7.2f}x"
+        )
+
+def main(args):
+    parser                  = argparse.ArgumentParser(description = "Hack アセンブラのベンチマーク")
+    parser.add_argument("file", nargs = "?", default = "Pong.asm", help = "--suite なしのときに計測するファイル")
+    parser.add_argument("--suite", action = "store_true", help = "サンプルと合成プログラムで計測する")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [10000, 100000, 1000000], help = "合成プログラムの行数")
+    parser.add_argument("--engine", action = "append", choices = ("ply", "fast"), help = "計測するエンジン (既定は両方)")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--label-density", type = float, default = 0.05, help = "ラベル定義行の割合")
+    parser.add_argument("--variables", type = int, default = 64, help = "変数の種類")
+    parser.add_argument("--ply-max", type = int, default = 100000, help = "ply で計測する最大の行数")
+    parser.add_argument("--no-startup", action = "store_true", help = "起動時間を計測しない")
+    parser.add_argument("--out", help = "結果を JSON で保存する")
+    parser.add_argument("--compare", metavar = "BASELINE", help = "以前の結果 (JSON) と比べる")
+    options                 = parser.parse_args(args)
+
+    if not options.suite:
+        file                = options.file
+        bench_scaling(file)
+        print()
+        bench_startup()
+        print()
+        bench_memory(file)
+        print()
+        bench_incremental(file)
+        return 0
+
+    results                 = bench_suite(
+        sizes               = options.sizes,
+        engines             = tuple(options.engine or ("ply", "fast")),
+        seed                = options.seed,
+        labelDensity        = options.label_density,
+        variables           = options.variables,
+        plyMax              = options.ply_max,
+        startup             = not options.no_startup
+    )
+    if options.out:
+        with open(options.out, "w", encoding="UTF-8") as f:
+            json.dump(results, f, indent = 2, ensure_ascii = False)
+    if options.compare:
+        with open(options.compare, "r", encoding="UTF-8") as f:
+            print()
+            compare(results, json.load(f))
+
+    failed                  = [c for c in results["cases"] if c["ok"] is False]
+    for case in failed:
+        print(f"NG  {case['assembler']} {case['engine']} {case['input']} : output differs from the expected result")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    exit(main(argv[1:]))
@@ -0,0 +1,393 @@
+"""Hack CPU エミュレータ
+| class / function | args | description |
+| - | - | - |
+| HackMachine | rom | ROM を読み込んだ Hack コンピュータ (CPU, 32K 語の RAM, SCREEN, KBD) |
+| load_rom | path | .hack / .bin を array('H') で読み込む |
+| load_program | path | .asm ならアセンブルし、(命令語, ラベル → アドレス) を返す (ラベルは .asm のときだけ) |
+| decode | word, ram | 命令語を 1 命令分の関数 op(A, D, pc) -> (A, D, pc) にする |
+| c_source | word | C命令の関数のソースを返す |
+| alu | comp, x, y | comp の 6 ビット (zx nx zy ny f no) どおりに ALU を計算する |
+| run_frames | machine, options | --frames の出力 (--frame-interval 命令ごとに SCREEN を書き出す) |
+| report_hotspots | counts, options | --hotspots / --collapsed の出力 (ソースマップがあればラベル・行にまとめる) |
+| main | args | コマンドライン (Pong などを実行して 1 秒あたりの命令数を表示する) |
+
+レジスタと RAM は 16bit の符号なし整数で持ち、負の数は 0x8000 以上の値として扱う
+C命令は M への書き込みとジャンプ先に実行前の A を使う (ハードウェアと同じ)
+
+```python
+m = HackMachine(load_rom("build/Pong.hack"))
+m.run(1000000)
+m.ram[16384:24576]  # SCREEN
+```
+
+```bash
+python emulator.py build/Pong.hack --cycles 5000000
+python emulator.py Pong.asm --jit
+python emulator.py Pong.asm --skip-idle --cycles 1000000000
+python emulator.py Pong.asm --hotspots 30 --collapsed pong.folded
+python emulator.py build/Pong.hack --hotspots        # build/Pong.map.json (batch.py --source-map) を使う
+python emulator.py build/Pong.hack --batch 1000 --keys 0,130,132 --cycles 100000
+python emulator.py Pong.asm --jit --cycles 20000000 --frames pong.npy --frame-interval 200000 --dirty
+python emulator.py Pong.asm --skip-idle --cycles 30000000 --load-snapshot pong.snap --save-snapshot pong.snap
+```
+"""
+
+from asm import HackCodeAnalyze
+from rom import read_bin, read_hack
+from array import array
+from itertools import repeat
+from sys import argv, exit
+import argparse
+import os
+import time
+
+RAM_SIZE                    = 32768     # 15bit のアドレス空間
+ROM_SIZE                    = 32768
+SCREEN                      = 16384
+SCREEN_SIZE                 = 8192      # 512 x 256 ピクセル
+KBD                         = 24576
+
+# comp (a ビットを含む 7bit) → Python の式 (x は D、y は A か M)
+COMP_EXPRESSIONS            = {
+    0b0101010               : "0",
+    0b0111111               : "1",
+    0b0111010               : "0xFFFF",
+    0b0001100               : "D",
+    0b0110000               : "A",
+    0b0001101               : "D ^ 0xFFFF",
+    0b0110001               : "A ^ 0xFFFF",
+    0b0001111               : "-D & 0xFFFF",
+    0b0110011               : "-A & 0xFFFF",
+    0b0011111               : "(D + 1) & 0xFFFF",
+    0b0110111               : "(A + 1) & 0xFFFF",
+    0b0001110               : "(D - 1) & 0xFFFF",
+    0b0110010               : "(A - 1) & 0xFFFF",
+    0b0000010               : "(D + A) & 0xFFFF",
+    0b0010011               : "(D - A) & 0xFFFF",
+    0b0000111               : "(A - D) & 0xFFFF",
+    0b0000000               : "D & A",
+    0b0010101               : "D | A",
+    0b1110000               : "M",
+    0b1110001               : "M ^ 0xFFFF",
+    0b1110011               : "-M & 0xFFFF",
+    0b1110111               : "(M + 1) & 0xFFFF",
+    0b1110010               : "(M - 1) & 0xFFFF",
+    0b1000010               : "(D + M) & 0xFFFF",
+    0b1010011               : "(D - M) & 0xFFFF",
+    0b1000111               : "(M - D) & 0xFFFF",
+    0b1000000               : "D & M",
+    0b1010101               : "D | M",
+}
+
+# jump (3bit) → 出力 out で飛ぶ条件 (None は飛ばない)
+JUMP_CONDITIONS             = {
+    0b000                   : None,
+    0b001                   : "0 < out < 0x8000",       # JGT
+    0b010                   : "out == 0",               # JEQ
+    0b011                   : "out < 0x8000",           # JGE
+    0b100                   : "out >= 0x8000",          # JLT
+    0b101                   : "out != 0",               # JNE
+    0b110                   : "not (0 < out < 0x8000)", # JLE
+    0b111                   : "True",                   # JMP
+}
+
+def alu(comp, x, y):
+    """
+    COMP_EXPRESSIONS に無い comp (ALU のビットの組み合わせ) の計算
+    comp は a ビットを除いた 6bit
+    """
+    if comp & 0b100000:             # zx
+        x                   = 0
+    if comp & 0b010000:             # nx
+        x                   ^= 0xFFFF
+    if comp & 0b001000:             # zy
+        y                   = 0
+    if comp & 0b000100:             # ny
+        y                   ^= 0xFFFF
+    if comp & 0b000010:             # f
+        out                 = (x + y) & 0xFFFF
+    else:
+        out                 = x & y
+    if comp & 0b000001:             # no
+        out                 ^= 0xFFFF
+    return out
+
+def c_source(word):
+    """
+    C命令 1 つ分の関数のソース
+    M を読むのは comp が M を使うときだけ、M に書くのは dest に M があるときだけにする
+    """
+    comp                    = (word >> 6) & 0b1111111
+    dest                    = (word >> 3) & 0b111
+    jump                    = word & 0b111
+
+    if comp in COMP_EXPRESSIONS:
+        expression          = COMP_EXPRESSIONS[comp]
+    elif comp & 0b1000000:
+        expression          = f"alu({comp & 0b111111}, D, M)"
+    else:
+        expression          = f"alu({comp & 0b111111}, D, A)"
+
+    lines                   = ["def op(A, D, pc):"]
+    if "M" in expression:
+        lines.append("    M = ram[A & 0x7FFF]")
+    lines.append(f"    out = {expression}")
+    if dest & 0b001:
+        lines.append("    ram[A & 0x7FFF] = out")
+
+    condition               = JUMP_CONDITIONS[jump]
+    target                  = "A & 0x7FFF"  # 実行前の A
+    newA                    = "out" if dest & 0b100 else "A"
+    newD                    = "out" if dest & 0b010 else "D"
+    if condition            == "True":
+        lines.append(f"    return {newA}, {newD}, {target}")
+    elif condition is None:
+        lines.append(f"    return {newA}, {newD}, pc + 1")
+    else:
+        lines.append(f"    if {condition}:")
+        lines.append(f"        return {newA}, {newD}, {target}")
+        lines.append(f"    return {newA}, {newD}, pc + 1")
+    return "\n".join(lines) + "\n"
+
+def decode(word, ram):
+    """
+    命令語を関数 op(A, D, pc) -> (A, D, 次の pc) にする
+    """
+    if not word & 0x8000:           # A命令
+        def op(A, D, pc, value = word):
+            return value, D, pc + 1
+        return op
+
+    namespace               = {"ram": ram, "alu": alu}
+    exec(compile(c_source(word), f"<hack {word:016b}>", "exec"), namespace)
+    return namespace["op"]
+
+def wrap_pc(op):
+    """
+    最後の番地の命令用 (PC は 15bit なので、次は 0 番地に戻る)
+    """
+    def last(A, D, pc):
+        A, D, pc            = op(A, D, pc)
+        return A, D, pc & 0x7FFF
+    return last
+
+def load_rom(path):
+    """
+    拡張子が .bin ならビッグエンディアンの uint16、それ以外は .hack として読む
+    """
+    if os.path.splitext(path)[1].lower() == ".bin":
+        return read_bin(path)
+    return read_hack(path)
+
+def load_program(path):
+    """
+    .asm は fast エンジンでアセンブルし、定義されたラベルも返す
+    (.hack / .bin にはラベルが無いので None)
+    """
+    if os.path.splitext(path)[1].lower() != ".asm":
+        return load_rom(path), None
+
+    with open(path, "r", encoding="UTF-8") as source:
+        code                = source.read()
+    with HackCodeAnalyze(code, debug = False, engine = "fast") as l:
+        words               = l.encode().words
+        return words, dict(l.labels)
+
+class HackMachine:
+    """Hack コンピュータ
+| attribute / method | args | description |
+| - | - | - |
+| .rom | - | 命令語 array('H') |
+| .ram | - | 32K 語の RAM array('H') (SCREEN と KBD を含む) |
+| .A / .D / .pc | - | レジスタ |
+| .cycles | - | これまでに実行した命令数 |
+| .ops | - | ROM のアドレス → デコード済みの命令 (32K 語分、ROM の外は @0) |
+| .reset | - | レジスタを 0 にする (RAM はそのまま) |
+| .step | - | 1 命令実行する |
+| .run | cycles | cycles 命令実行し、実行した命令数を返す |
+| .write_rom | addr, word | ROM を書き換え、その番地の命令をデコードし直す (最後の番地は 0 番地へ戻る命令にする) |
+| .set_key | code | キーボードの入力 (KBD) を設定する (0 で離す) |
+| .screen | - | SCREEN の 8K 語の memoryview |
+    """
+
+    def __init__(self, rom):
+        if len(rom)         > ROM_SIZE:
+            raise ValueError(f"ROM is too large : {len(rom)} words (max {ROM_SIZE})")
+
+        self.rom            = array("H", rom)
+        self.ram            = array("H", bytes(2 * RAM_SIZE))
+        self.ops            = self.decode_rom()
+        self.cycles         = 0
+        self.reset()
+
+    def decode_rom(self):
+        """
+        同じ命令語は同じ関数を使う (関数はこのマシンの RAM を参照する)
+        """
+        table               = {}
+        ops                 = []
+        for word in self.rom:
+            if word not in table:
+                table[word] = decode(word, self.ram)
+            ops.append(table[word])
+        empty               = table.get(0) or decode(0, self.ram)
+        ops                 += [empty] * (ROM_SIZE - len(ops))
+        ops[-1]             = wrap_pc(ops[-1])
+        return ops
+
+    def reset(self):
+        self.A              = 0
+        self.D              = 0
+        self.pc             = 0
+
+    def step(self):
+        self.A, self.D, self.pc = self.ops[self.pc](self.A, self.D, self.pc)
+        self.cycles         += 1
+
+    def run(self, cycles):
+        ops                 = self.ops
+        A, D, pc            = self.A, self.D, self.pc
+        for _ in repeat(None, cycles):
+            A, D, pc        = ops[pc](A, D, pc)
+        self.A, self.D, self.pc = A, D, pc
+        self.cycles         += cycles
+        return cycles
+
+    def write_rom(self, addr, word):
+        """
+        プログラムの外の番地なら、その番地まで ROM を 0 で延ばしてから書き換える
+        """
+        if addr             >= len(self.rom):
+            self.rom.frombytes(bytes(2 * (addr + 1 - len(self.rom))))
+        self.rom[addr]      = word
+        op                  = decode(word, self.ram)
+        self.ops[addr]      = wrap_pc(op) if addr == ROM_SIZE - 1 else op
+
+    def set_key(self, code):
+        self.ram[KBD]       = code
+
+    def screen(self):
+        return memoryview(self.ram)[SCREEN:SCREEN + SCREEN_SIZE]
+
+def report_hotspots(counts, options):
+    from hotspot import collapsed_stacks, format_hotspots
+    from sourcemap import load_source_map
+
+    path                    = options.source_map
+    if path is None:
+        path                = options.rom
+        if os.path.splitext(path)[1].lower() != ".asm":
+            path            = os.path.splitext(path)[0] + ".map.json"
+    sourceMap               = load_source_map(path) if os.path.exists(path) else None
+    source                  = None
+    if sourceMap is not None:
+        sourcePath          = os.path.join(os.path.dirname(options.rom), sourceMap.file)
+        if not os.path.exists(sourcePath):     # build/ の下の ROM なら、ソースは 1 つ上の階層
+            sourcePath      = os.path.join(os.path.dirname(os.path.dirname(options.rom)), sourceMap.file)
+        if os.path.exists(sourcePath):
+            with open(sourcePath, "r", encoding="UTF-8") as f:
+                source      = f.read().split("\n")
+
+    if options.hotspots is not None:
+        print("\n".join(format_hotspots(counts, sourceMap, options.hotspots, source)))
+    if options.collapsed is not None:
+        with open(options.collapsed, "w", encoding="UTF-8") as f:
+            f.write("\n".join(collapsed_stacks(counts, sourceMap)) + "\n")
+
+def run_frames(machine, options):
+    """
+    cycles を --frame-interval ごとに区切って実行し、区切るたびに 1 枚書く (端数はフレームを書かずに実行する)
+    """
+    from frames import capture, open_writer
+    frames, rest            = divmod(options.cycles, options.frame_interval)
+    with open_writer(options.frames, options.frame_format) as writer:
+        capture(machine, frames, options.frame_interval, writer, options.dirty)
+    machine.run(rest)
+    return frames
+
+def main(args):
+    parser                  = argparse.ArgumentParser(description = "Hack CPU エミュレータ")
+    parser.add_argument("rom", help = ".hack か .bin (.asm ならアセンブルして実行する)")
+    parser.add_argument("--cycles", type = int, default = 5000000, help = "実行する命令数")
+    parser.add_argument("--jit", action = "store_true", help = "基本ブロックを Python の関数に変換して実行する")
+    parser.add_argument("--skip-idle", action = "store_true", help = "待ちループを検出して早送りする (--jit を含む)")
+    parser.add_argument("--hotspots", type = int, nargs = "?", const = 20, metavar = "N", help = "アドレスごとの命令数を数え、ラベル・行ごとの上位 N 件を表示する")
+    parser.add_argument("--collapsed", metavar = "PATH", help = "ホットスポットを flamegraph 用の collapsed 形式で書き出す")
+    parser.add_argument("--source-map", metavar = "PATH", help = "ソースマップ (既定は .asm ならアセンブルして、それ以外は <ROM>.map.json)")
+    parser.add_argument("--batch", type = int, metavar = "N", help = "N 台を NumPy でまとめて実行する (numpy が必要)")
+    parser.add_argument("--keys", default = "0", help = "--batch のマシンに順に割り当てるキーコード (カンマ区切り)")
+    parser.add_argument("--frames", metavar = "PATH", help = "SCREEN を書き出す (.npy / .raw、それ以外は PNG の連番のディレクトリ、numpy が必要)")
+    parser.add_argument("--frame-interval", type = int, default = 100000, metavar = "N", help = "--frames で N 命令ごとに 1 枚書く")
+    parser.add_argument("--frame-format", choices = ("npy", "png", "raw"), help = "--frames の形式 (既定は PATH の拡張子から決める)")
+    parser.add_argument("--dirty", action = "store_true", help = "--frames で前のフレームから変わった語だけを展開し直す")
+    parser.add_argument("--load-snapshot", metavar = "PATH", help = "スナップショットの状態から実行を始める (snapshot.py)")
+    parser.add_argument("--save-snapshot", metavar = "PATH", help = "実行した後の状態をスナップショットに書き出す")
+    options                 = parser.parse_args(args)
+    if options.frames and options.batch:
+        parser.error("--frames can not be used with --batch")
+    if options.save_snapshot and options.batch:
+        parser.error("--save-snapshot can not be used with --batch")
+    if options.frame_interval <= 0:
+        parser.error("--frame-interval must be positive")
+
+    start                   = time.perf_counter()
+    words, labels           = load_program(options.rom)
+    profiling               = (options.hotspots is not None) or (options.collapsed is not None)
+    if options.batch:
+        from lockstep import BatchMachine
+        codes               = [int(code) for code in options.keys.split(",")]
+        machine             = BatchMachine(words, options.batch)
+        machine.set_keys([codes[i % len(codes)] for i in range(options.batch)])
+    elif profiling:
+        from hotspot import ProfilingMachine
+        machine             = ProfilingMachine(words, labels)
+    elif options.skip_idle:
+        from idle import IdleSkipMachine
+        machine             = IdleSkipMachine(words, labels)
+    elif options.jit:
+        from jit import JitMachine
+        machine             = JitMachine(words, labels)
+    else:
+        machine             = HackMachine(words)
+    if options.load_snapshot:
+        from snapshot import load_snapshot
+        with load_snapshot(options.load_snapshot) as snap:
+            if options.batch:
+                snap.restore_batch(machine)
+            else:
+                snap.restore(machine)
+    loaded                  = time.perf_counter() - start
+
+    start                   = time.perf_counter()
+    if options.frames:
+        frames              = run_frames(machine, options)
+    else:
+        machine.run(options.cycles)
+    elapsed                 = time.perf_counter() - start
+    print(f"load {loaded:.3f}s ({len(words)} words)")
+    if options.batch:
+        total               = options.cycles * machine.n
+        print(
+            f"{machine.n} machines x {options.cycles} cycles in {elapsed:.3f}s "
+            f"({total / max(elapsed, 1e-9):,.0f} instructions/s in total, "
+            f"{total / max(machine.steps, 1):.1f} machines per step), {len(set(machine.pc.tolist()))} distinct pc"
+        )
+        return 0
+    print(
+        f"{options.cycles} cycles in {elapsed:.3f}s "
+        f"({options.cycles / max(elapsed, 1e-9):,.0f} instructions/s), pc = {machine.pc}, total {machine.cycles} cycles"
+    )
+    if options.frames:
+        print(f"wrote {frames} frames to {options.frames}")
+    if options.save_snapshot:
+        from snapshot import save_snapshot
+        print(f"saved snapshot to {save_snapshot(machine, options.save_snapshot)}")
+    if profiling:
+        report_hotspots(machine.counts(), options)
+    elif options.skip_idle:
+        print(f"skipped {machine.skipped} cycles in {machine.skips} idle loops")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main(argv[1:]))
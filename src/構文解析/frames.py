@@ -0,0 +1,223 @@
+"""SCREEN のフレームの書き出し (画面を表示しない実行用)
+| class / function | args | description |
+| - | - | - |
+| screen_words | ram | RAM (array('H') か ndarray) の SCREEN の 8K 語を、コピーしない NumPy の view で返す |
+| unpack_screen | words | (..., 8192) の SCREEN の語を (..., 256, 512) の 0/1 (1 が黒) の uint8 にする |
+| ScreenTracker | ram | 前のフレームから変わった語だけを展開し直してフレームを更新する |
+| NpyWriter | path | フレームを (枚数, 256, 512) の 1 つの .npy に書く |
+| PngWriter | directory, prefix | 1bit グレースケールの PNG を連番で書く |
+| RawVideoWriter | path | 8bit グレースケールの生の動画を書く |
+| open_writer | path, format | 形式 (省略時は拡張子) から Writer を選ぶ |
+| capture | machine, frames, interval, writer, dirty | interval 命令ごとに frames 枚を書き出す |
+
+SCREEN は 1 行 32 語で、語の最下位ビットが左端のピクセル
+リトルエンディアンのバイト列にして np.unpackbits(bitorder="little") するとピクセルの順に並ぶので、
+ピクセルごとの Python のループは無い (複数台の (n, 8192) もまとめて展開できる)
+
+dirty=True では、前のフレームの SCREEN の語と比べて値が変わった語だけを展開し直す
+(書き込んでも値が同じ語は見た目が変わらないので、書き込みを追跡した場合と同じフレームになる)
+
+numpy が必要 (pip install numpy)
+
+```bash
+python emulator.py Pong.asm --jit --cycles 20000000 --frames pong.npy --frame-interval 200000 --dirty
+python emulator.py Pong.asm --frames png/ --frame-interval 500000
+python emulator.py Pong.asm --frames pong.raw
+ffmpeg -f rawvideo -pixel_format gray -video_size 512x256 -framerate 30 -i pong.raw pong.mp4
+```
+"""
+
+from emulator import SCREEN, SCREEN_SIZE
+import numpy as np
+import os
+import shutil
+import struct
+import zlib
+
+SCREEN_WIDTH                = 512
+SCREEN_HEIGHT               = 256
+WORD_BITS                   = 16
+PNG_SIGNATURE               = b"\x89PNG\r\n\x1a\n"
+
+def screen_words(ram):
+    if isinstance(ram, np.ndarray):
+        return ram[..., SCREEN:SCREEN + SCREEN_SIZE]
+    return np.frombuffer(ram, dtype = np.uint16, count = SCREEN_SIZE, offset = SCREEN * ram.itemsize)
+
+def unpack_words(words):
+    """
+    語の並び (..., k) を (..., k * 16) のピクセルにする (語の下位ビットから順)
+    """
+    data                    = np.ascontiguousarray(words, dtype = "<u2")
+    return np.unpackbits(data.view(np.uint8), axis = -1, bitorder = "little")
+
+def unpack_screen(words):
+    words                   = np.asarray(words)
+    return unpack_words(words).reshape(*words.shape[:-1], SCREEN_HEIGHT, SCREEN_WIDTH)
+
+class ScreenTracker:
+    """変わった語だけを展開し直すフレーム
+| attribute / method | args | description |
+| - | - | - |
+| .frame | - | (256, 512) の 0/1 の uint8 (update で書き換わる) |
+| .dirty | - | 直近の update で変わった範囲 (y0, y1, x0, x1)、変化が無ければ None |
+| .changed | - | 直近の update で展開し直した語の数 |
+| .update | - | SCREEN の変化を frame に反映して返す |
+    """
+
+    def __init__(self, ram):
+        self.words          = screen_words(ram)
+        self.previous       = np.array(self.words)
+        self.frame          = unpack_screen(self.previous)
+        self.dirty          = (0, SCREEN_HEIGHT, 0, SCREEN_WIDTH)
+        self.changed        = SCREEN_SIZE
+
+    def update(self):
+        changed             = np.flatnonzero(self.words != self.previous)
+        self.changed        = len(changed)
+        if not self.changed:
+            self.dirty      = None
+            return self.frame
+
+        values              = self.words[changed]
+        self.previous[changed] = values
+        self.frame.reshape(SCREEN_SIZE, WORD_BITS)[changed] = unpack_words(values).reshape(-1, WORD_BITS)
+
+        rows                = changed // (SCREEN_WIDTH // WORD_BITS)
+        columns             = changed % (SCREEN_WIDTH // WORD_BITS)
+        self.dirty          = (
+            int(rows.min()),
+            int(rows.max()) + 1,
+            int(columns.min()) * WORD_BITS,
+            (int(columns.max()) + 1) * WORD_BITS
+        )
+        return self.frame
+
+class FrameWriter:
+    """Writer の基底クラス (with 構文で close する)
+| attribute / method | args | description |
+| - | - | - |
+| .count | - | 書いたフレームの数 |
+| .write | frame | (256, 512) の 0/1 のフレームを 1 枚書く |
+| .close | - | 書き終える |
+    """
+
+    def __init__(self):
+        self.count          = 0
+
+    def write(self, frame):
+        self.write_frame(np.asarray(frame, dtype = np.uint8))
+        self.count          += 1
+
+    def write_frame(self, frame):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class NpyWriter(FrameWriter):
+    """
+    枚数は最後まで分からないので、フレームを一時ファイルに追記し、close で .npy のヘッダを付ける
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path           = path
+        self.tmpPath        = f"{path}.tmp"
+        self.file           = open(self.tmpPath, "wb")
+
+    def write_frame(self, frame):
+        self.file.write(frame.tobytes())
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file           = None
+        with open(self.path, "wb") as f, open(self.tmpPath, "rb") as frames:
+            np.lib.format.write_array_header_1_0(f, {
+                "descr"         : "|u1",
+                "fortran_order" : False,
+                "shape"         : (self.count, SCREEN_HEIGHT, SCREEN_WIDTH),
+            })
+            shutil.copyfileobj(frames, f)
+        os.remove(self.tmpPath)
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+def encode_png(frame, level = 6):
+    """
+    1bit グレースケールの PNG (1 が白なので、1 が黒のフレームを反転して左のピクセルから MSB に詰める)
+    """
+    rows                    = np.packbits(frame ^ 1, axis = 1)
+    raw                     = np.hstack([np.zeros((len(rows), 1), dtype = np.uint8), rows])    # 各行の先頭はフィルタ 0
+    header                  = struct.pack(">IIBBBBB", frame.shape[1], frame.shape[0], 1, 0, 0, 0, 0)
+    return (
+        PNG_SIGNATURE +
+        png_chunk(b"IHDR", header) +
+        png_chunk(b"IDAT", zlib.compress(raw.tobytes(), level)) +
+        png_chunk(b"IEND", b"")
+    )
+
+class PngWriter(FrameWriter):
+    def __init__(self, directory, prefix = "frame"):
+        super().__init__()
+        self.directory      = directory
+        self.prefix         = prefix
+        os.makedirs(directory, exist_ok = True)
+
+    def write_frame(self, frame):
+        path                = os.path.join(self.directory, f"{self.prefix}_{self.count:06d}.png")
+        with open(path, "wb") as f:
+            f.write(encode_png(frame))
+
+class RawVideoWriter(FrameWriter):
+    """
+    1 ピクセル 1 バイト (0 が黒、255 が白) のフレームを続けて書く
+    ffmpeg / ffplay では -f rawvideo -pixel_format gray -video_size 512x256 で読める
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.file           = open(path, "wb")
+
+    def write_frame(self, frame):
+        self.file.write(((frame ^ 1) * 255).astype(np.uint8).tobytes())
+
+    def close(self):
+        self.file.close()
+
+WRITERS                     = {
+    "npy"                   : NpyWriter,
+    "png"                   : PngWriter,
+    "raw"                   : RawVideoWriter,
+}
+
+def open_writer(path, format = None):
+    """
+    format を省略すると .npy は npy、.raw / .gray は raw、それ以外 (ディレクトリ) は png にする
+    """
+    if format is None:
+        ext                 = os.path.splitext(path)[1].lower()
+        format              = {".npy": "npy", ".raw": "raw", ".gray": "raw"}.get(ext, "png")
+    if format not in WRITERS:
+        raise ValueError(f"Unknown frame format : {format}")
+    return WRITERS[format](path)
+
+def capture(machine, frames, interval, writer, dirty = False):
+    """
+    machine (HackMachine / JitMachine / IdleSkipMachine など) を interval 命令ずつ実行し、そのたびに 1 枚書く
+    """
+    tracker                 = ScreenTracker(machine.ram) if dirty else None
+    words                   = screen_words(machine.ram)
+    for _ in range(frames):
+        machine.run(interval)
+        writer.write(tracker.update() if dirty else unpack_screen(words))
+    return writer.count
@@ -0,0 +1,190 @@
+"""ベンチマーク用の合成プログラム
+| function | args | description |
+| - | - | - |
+| generate_hack | lines, seed, labelDensity, variables, mix | 正しい Hack アセンブリと、その期待される命令語を生成する |
+| generate_calc | lines, seed, variables | 字句解析のサンプル (LexicalAnalyze) の言語のプログラムと、最後の変数の値を生成する |
+| var_name | i | i 番目の変数名 (A, B, ..., Z, BA, BB, ...) |
+
+同じ seed からは同じプログラムが生成される
+期待値はアセンブラを通さずに生成時の情報から求めるので、出力の正しさの確認に使える
+
+```python
+hack = generate_hack(100000, seed = 1, labelDensity = 0.02, variables = 500)
+hack.code       # ソース
+hack.words      # 期待される命令語 array('H')
+```
+"""
+
+from asm import C_TABLE, PREDEFINED_SYMBOLS, REGISTER_NUM
+from array import array
+from collections import namedtuple
+import random
+
+SyntheticHack               = namedtuple("SyntheticHack", "code words labels variables")
+SyntheticCalc               = namedtuple("SyntheticCalc", "code symbolTable")
+
+# 命令の種類 → 既定の割合
+HACK_MIX                    = {
+    "c"                     : 0.45,     # C命令 (dest=comp, comp;jump など)
+    "const"                 : 0.10,     # @数値
+    "predefined"            : 0.10,     # @SP, @R13 など
+    "var"                   : 0.15,     # @変数
+    "jump"                  : 0.10,     # @ラベル と ジャンプ命令の 2 行
+    "comment"               : 0.05,     # コメント行
+    "blank"                 : 0.05,     # 空行
+}
+
+C_FORMS                     = sorted(C_TABLE)
+COMMON_C                    = (        # コンパイラの出力によく現れる C命令
+    "D=M", "M=D", "A=M", "AM=M+1", "AM=M-1", "D=A", "A=A-1", "M=M+1", "M=M-1",
+    "D=D+M", "D=M-D", "M=D+M", "M=-M", "M=!M", "D=0", "M=0", "M=-1", "0;JMP",
+)
+JUMPS                       = ("0;JMP", "D;JEQ", "D;JNE", "D;JGT", "D;JLT", "D;JGE", "D;JLE")
+PREDEFINED_NAMES            = sorted(PREDEFINED_SYMBOLS)
+MAX_VARIABLES               = PREDEFINED_SYMBOLS["SCREEN"] - REGISTER_NUM
+
+def generate_hack(
+    lines                   = 10000,
+    seed                    = 0,
+    labelDensity            = 0.05,     # ラベル定義行の割合
+    variables               = 64,       # 変数の種類
+    mix                     = None      # HACK_MIX の一部を上書きする
+):
+    """
+    約 lines 行 (ジャンプは 2 行になるので最後で切り詰める) の Hack アセンブリを生成する
+    ラベルはすべて定義され、参照は前方・後方の両方を含む
+    32K 語を超える大きさでも A命令に入るよう、参照するのはアドレスが 0x7FFF 以下のラベルだけにする
+    """
+    rng                     = random.Random(seed)
+    weights                 = {**HACK_MIX, **(mix or {})}
+    variables               = max(1, min(variables, MAX_VARIABLES))
+    labelCount              = int(lines * labelDensity)
+    labelAt                 = set(rng.sample(range(lines), labelCount))
+
+    kinds                   = rng.choices(list(weights), list(weights.values()), k = lines)
+    source                  = []
+    insts                   = []        # 命令語 (int) かシンボル名 (str)
+    labelAddr               = {}
+    jumps                   = []        # ラベルを参照する (source の行, insts の位置)
+    for i, kind in enumerate(kinds):
+        if len(source)      >= lines:
+            break
+        if i in labelAt:
+            label           = f"L{len(labelAddr)}"
+            labelAddr[label] = len(insts)
+            source.append(f"({label})")
+            continue
+
+        if kind             == "c":
+            form            = rng.choice(COMMON_C) if rng.random() < 0.7 else rng.choice(C_FORMS)
+            source.append(form)
+            insts.append(C_TABLE[form])
+        elif kind           == "const":
+            value           = rng.randrange(0x8000)
+            source.append(f"@{value}")
+            insts.append(value)
+        elif kind           == "predefined":
+            name            = rng.choice(PREDEFINED_NAMES)
+            source.append(f"@{name}")
+            insts.append(PREDEFINED_SYMBOLS[name])
+        elif kind           == "var":
+            name            = f"v{rng.randrange(variables)}"
+            source.append(f"@{name}")
+            insts.append(name)
+        elif kind           == "jump":
+            if not labelCount:
+                continue
+            label           = f"L{rng.randrange(labelCount)}"
+            jump            = rng.choice(JUMPS)
+            jumps.append((len(source), len(insts)))
+            source          += [f"@{label}", jump]
+            insts           += [label, C_TABLE[jump]]
+        elif kind           == "comment":
+            source.append(f"// comment {i}")
+        else:
+            source.append("")
+
+    for k in range(len(labelAddr), labelCount):     # 切り詰めで定義されなかったラベルを最後に置く
+        label               = f"L{k}"
+        labelAddr[label]    = len(insts)
+        source.append(f"({label})")
+
+    reachable               = [label for label, addr in labelAddr.items() if addr <= 0x7FFF]
+    for line, index in jumps:
+        if labelAddr[insts[index]] <= 0x7FFF:
+            continue
+        if not reachable:               # 先頭の 32K 語にラベルが無いときは 0 番地へ飛ぶ
+            source[line], insts[index] = "@0", 0
+            continue
+        label               = rng.choice(reachable)
+        source[line]        = f"@{label}"
+        insts[index]        = label
+
+    words                   = array("H")
+    varAddr                 = {}
+    for inst in insts:
+        if isinstance(inst, str):
+            if inst in labelAddr:
+                inst        = labelAddr[inst]
+            else:                       # 最初に参照された順に 16 番地から割り当てる
+                inst        = varAddr.setdefault(inst, REGISTER_NUM + len(varAddr))
+        words.append(inst)
+
+    return SyntheticHack("\n".join(source) + "\n", words, len(labelAddr), len(varAddr))
+
+def var_name(i):
+    """
+    A-Z だけの名前 (3 文字以下なので PRINT とは重ならない)
+    """
+    name                    = ""
+    while True:
+        name                = chr(ord("A") + i % 26) + name
+        i                   //= 26
+        if not i:
+            return name
+
+def generate_calc(
+    lines                   = 10000,
+    seed                    = 0,
+    variables               = 26
+):
+    """
+    代入と PRINT の文を lines 行生成し、期待される symbolTable を返す
+    値が大きくなりすぎたら数値の代入に戻し、0 では割らない
+    """
+    rng                     = random.Random(seed)
+    names                   = [var_name(i) for i in range(max(1, min(variables, 26 ** 3)))]
+    values                  = {}
+    defined                 = []        # 代入済みの変数 (未定義の変数は参照しない)
+    source                  = []
+    for i in range(lines):
+        target              = rng.choice(names)
+        kind                = rng.random()
+        if (not defined) or (kind < 0.2):
+            text, value     = f"{target} = {rng.randrange(1000)}", None
+        else:
+            a               = rng.choice(defined)
+            x               = values[a]
+            n               = rng.randrange(1, 10)
+            if kind         < 0.4:
+                text, value = f"{target} = {a} + {n}", x + n
+            elif kind       < 0.55:
+                b           = rng.choice(defined)
+                text, value = f"{target} = {a} - {b}", x - values[b]
+            elif kind       < 0.7:
+                text, value = f"{target} = ({a} + {n}) * {n % 4}", (x + n) * (n % 4)
+            elif kind       < 0.85:
+                text, value = f"{target} = {a} / {n}", x // n
+            else:
+                source.append(f"PRINT {a}")
+                continue
+
+        if (value is None) or (abs(value) > 10 ** 9):
+            value           = int(text.rsplit(" ", 1)[1]) if value is None else rng.randrange(1000)
+            text            = f"{target} = {value}"
+        if target not in values:
+            defined.append(target)
+        source.append(text)
+        values[target]      = value
+
+    return SyntheticCalc("\n".join(source) + "\n", values)
@@ -0,0 +1,157 @@
+"""エミュレータで実行したプログラムのホットスポット
+| class / function | args | description |
+| - | - | - |
+| ProfilingMachine | rom, labels | アドレスごとの実行命令数 (サイクル数) を数える JitMachine |
+| aggregate | counts, sourceMap | アドレスごとの数をラベルごと・行ごとにまとめる |
+| format_hotspots | counts, sourceMap, top, source | ラベルごと・行ごとの上位 top 件の表の行のリストを返す |
+| collapsed_stacks | counts, sourceMap | flamegraph.pl / speedscope などで読める collapsed 形式の行のリストを返す |
+
+ブロックの関数は抜けたときに実行した命令数を返すので、(ブロックの先頭, 命令数) ごとに回数を数え、
+あとでブロックの経路の先頭からその命令数分のアドレスに足し込む (1 命令ずつ数えるより速く、数は正確)
+
+collapsed 形式のスタックは「ファイル;ラベル;行」で、Hack には呼び出しの規約が無いので
+関数の代わりに直前のラベルでまとめる (ラベルより前の命令は "-")
+
+```python
+words, labels = load_program("Pong.asm")
+m = ProfilingMachine(words, labels)
+m.run(5000000)
+print("\\n".join(format_hotspots(m.counts(), load_source_map("Pong.asm"))))
+```
+"""
+
+from jit import MAX_BLOCK, JitMachine
+from collections import defaultdict
+from itertools import repeat
+
+COUNT_BITS                  = MAX_BLOCK.bit_length()    # (先頭 << COUNT_BITS) | 命令数 を記録のキーにする
+COUNT_MASK                  = (1 << COUNT_BITS) - 1
+NO_LABEL                    = "-"
+
+class ProfilingMachine(JitMachine):
+    """アドレスごとの実行命令数を数える JitMachine
+| attribute / method | args | description |
+| - | - | - |
+| .exits | - | (ブロックの先頭 << COUNT_BITS) \\| 実行した命令数 → 回数 |
+| .counts | - | アドレス → 実行した命令数のリストを返す (exits を足し込んで空にする) |
+| .reset_counts | - | 数えた分を捨てる |
+    """
+
+    def __init__(self, rom, labels = None, **kwargs):
+        super().__init__(rom, labels, **kwargs)
+        self.exits          = defaultdict(int)
+        self.addrCounts     = [0] * len(self.blocks)
+
+    def run(self, cycles):
+        blocks              = self.blocks
+        sizes               = self.sizes
+        exits               = self.exits
+        A, D, pc            = self.A, self.D, self.pc
+        remaining           = cycles
+        while True:
+            block           = blocks[pc]
+            if block is None:
+                block       = self.compile_block(pc)
+            if sizes[pc]    > remaining:
+                break
+            start           = pc
+            A, D, pc, count = block(A, D)
+            remaining       -= count
+            exits[(start << COUNT_BITS) | count] += 1
+
+        ops                 = self.ops
+        addrCounts          = self.addrCounts
+        for _ in repeat(None, remaining):
+            addrCounts[pc]  += 1
+            A, D, pc        = ops[pc](A, D, pc)
+        self.A, self.D, self.pc = A, D, pc
+        self.cycles         += cycles
+        return cycles
+
+    def flush(self):
+        addrCounts          = self.addrCounts
+        paths               = {}
+        for key, times in self.exits.items():
+            start           = key >> COUNT_BITS
+            if start not in paths:
+                paths[start] = list(self.covers[start])
+            for addr in paths[start][:key & COUNT_MASK]:
+                addrCounts[addr] += times
+        self.exits.clear()
+
+    def counts(self):
+        self.flush()
+        return self.addrCounts
+
+    def reset_counts(self):
+        self.exits.clear()
+        self.addrCounts     = [0] * len(self.blocks)
+
+    def write_rom(self, addr, word):
+        self.flush()                        # 捨てるブロックの経路で数えた分を先に足し込む
+        super().write_rom(addr, word)
+
+def aggregate(counts, sourceMap = None):
+    """
+    (ラベル → 命令数, 行 → 命令数, 合計) を返す
+    sourceMap が無ければラベルは NO_LABEL、行はアドレスにする
+    """
+    byLabel                 = defaultdict(int)
+    byLine                  = defaultdict(int)
+    total                   = 0
+    for addr, count in enumerate(counts):
+        if not count:
+            continue
+        total               += count
+        if sourceMap is None:
+            byLabel[NO_LABEL]   += count
+            byLine[addr]    += count
+            continue
+        location            = sourceMap.lookup(addr)
+        byLabel[location.label or NO_LABEL] += count
+        byLine[location.line]   += count
+    return dict(byLabel), dict(byLine), total
+
+def format_hotspots(counts, sourceMap = None, top = 20, source = None):
+    """
+    source (ソースの行のリスト) を渡すと、行ごとの表にソースの内容も載せる
+    """
+    byLabel, byLine, total  = aggregate(counts, sourceMap)
+    total                   = max(total, 1)
+    file                    = sourceMap.file if sourceMap is not None else "addr"
+    labelOfLine             = {}
+    if sourceMap is not None:
+        for addr, line in enumerate(sourceMap.lines):
+            labelOfLine.setdefault(line, sourceMap.label_at(addr)[0] or NO_LABEL)
+
+    lines                   = [f"{'cycles':>12} {'%':>6}  label"]
+    for label, count in sorted(byLabel.items(), key = lambda item: -item[1])[:top]:
+        lines.append(f"{count:>12} {100 * count / total:>6.2f}  {label}")
+
+    lines.append("")
+    lines.append(f"{'cycles':>12} {'%':>6}  {'line':<24} label")
+    for line, count in sorted(byLine.items(), key = lambda item: -item[1])[:top]:
+        text                = ""
+        if source and (0 < line <= len(source)):
+            text            = f"  | {source[line - 1].strip()}"
+        lines.append(
+            f"{count:>12} {100 * count / total:>6.2f}  {f'{file}:{line}':<24} "
+            f"{labelOfLine.get(line, NO_LABEL)}{text}"
+        )
+    return lines
+
+def collapsed_stacks(counts, sourceMap = None):
+    """
+    "ファイル;ラベル;行 命令数" の行 (1 行が 1 つのスタック) を命令数の多い順に返す
+    """
+    stacks                  = defaultdict(int)
+    file                    = (sourceMap.file if sourceMap is not None else "rom").replace(" ", "_")
+    for addr, count in enumerate(counts):
+        if not count:
+            continue
+        if sourceMap is None:
+            stacks[f"{file};{NO_LABEL};{addr}"] += count
+            continue
+        location            = sourceMap.lookup(addr)
+        stacks[f"{file};{location.label or NO_LABEL};line {location.line}"] += count
+    return [f"{stack} {count}" for stack, count in sorted(stacks.items(), key = lambda item: -item[1])]
@@ -0,0 +1,283 @@
+"""待ちループの検出と早送り
+| class / function | args | description |
+| - | - | - |
+| IdleSkipMachine | rom, labels, threshold | 何度も戻ってくる番地でループを調べ、早送りできれば飛ばす JitMachine |
+| analyze_loop | rom, ram, A, D, head, maxSteps | head から head に戻る 1 周を調べ、早送りできれば LoopSummary を返す |
+| fast_forward | summary, ram, iterations | LoopSummary の周回を iterations 回分まとめて RAM に反映し、レジスタ ("A" / "D" → 値) を返す |
+| first_exit | value, region, limit | 値 (c, d) が何周目に出口の範囲 region に入るか |
+
+1 周の間の値を「i 周目に c + i * d (mod 2^16)」の組 (c, d) で表して実行し、
+次の周の初めの値が同じ式の i + 1 になること (帰納法) を確かめる
+- 変化しないループ (KBD を待つループ、@END 0;JMP) は d がすべて 0 なので、残りの命令数まで飛ばせる
+- カウンタを減らす遅延ループは、条件ジャンプの out が出口に入る周回を直接求めて、その手前まで飛ばす
+- M の番地とジャンプ先は周回によらず同じで、& などの非線形な計算は周回で変わらない値だけのときに限る
+
+外部の入力 (set_key) は run() の呼び出しの間にしか変わらないので、run() の中で飛ばした結果は
+1 命令ずつ実行した場合と RAM・レジスタ・命令数のすべてが一致する
+
+```python
+m = IdleSkipMachine(*load_program("Pong.asm"))
+m.run(100000000)
+m.skipped           # 飛ばした命令数
+```
+"""
+
+from jit import JitMachine
+from collections import namedtuple
+from itertools import repeat
+
+MASK                        = 0xFFFF
+MAX_LOOP                    = 512       # 1 周として調べる最大の命令数
+THRESHOLD                   = 32        # 同じ番地に何回来たらループを調べるか
+NEVER                       = float("inf")
+
+LoopSummary                 = namedtuple("LoopSummary", "head length iterations values")
+# head       : ループの先頭の番地
+# length     : 1 周の命令数
+# iterations : 同じ経路を通る周回数 (NEVER なら外部の入力が変わるまで抜けない)
+# values     : "A" / "D" / RAM の番地 → 1 周の終わりの値 (c, d)
+
+# ジャンプ (3bit) → out が条件を満たす範囲 [(下限, 上限), ...]
+JUMP_REGIONS                = {
+    0b001                   : ((1, 0x7FFF),),                   # JGT
+    0b010                   : ((0, 0),),                        # JEQ
+    0b011                   : ((0, 0x7FFF),),                   # JGE
+    0b100                   : ((0x8000, MASK),),                # JLT
+    0b101                   : ((1, MASK),),                     # JNE
+    0b110                   : ((0, 0), (0x8000, MASK)),         # JLE
+    0b111                   : ((0, MASK),),                     # JMP
+}
+
+def in_region(value, region):
+    return any(lo <= value <= hi for lo, hi in region)
+
+def complement(region):
+    result                  = []
+    start                   = 0
+    for lo, hi in sorted(region):
+        if start < lo:
+            result.append((start, lo - 1))
+        start               = hi + 1
+    if start <= MASK:
+        result.append((start, MASK))
+    return tuple(result)
+
+def negate(value):
+    return ((MASK - value[0]) & MASK, -value[1] & MASK)
+
+def affine_alu(comp, x, y):
+    """
+    emulator.alu を (c, d) の組で計算する (comp は a ビットを除いた 6bit)
+    f=1 (足し算) と否定は線形、f=0 (&) は片方が 0 / 0xFFFF の定数か両方が周回で変わらないときだけ計算でき、
+    それ以外は None
+    """
+    if comp & 0b100000:             # zx
+        x                   = (0, 0)
+    if comp & 0b010000:             # nx
+        x                   = negate(x)
+    if comp & 0b001000:             # zy
+        y                   = (0, 0)
+    if comp & 0b000100:             # ny
+        y                   = negate(y)
+    if comp & 0b000010:             # f
+        out                 = ((x[0] + y[0]) & MASK, (x[1] + y[1]) & MASK)
+    elif (x == (0, 0)) or (y == (0, 0)):
+        out                 = (0, 0)
+    elif x                  == (MASK, 0):
+        out                 = y
+    elif y                  == (MASK, 0):
+        out                 = x
+    elif not (x[1] or y[1]):
+        out                 = (x[0] & y[0], 0)
+    else:
+        return None
+    if comp & 0b000001:             # no
+        out                 = negate(out)
+    return out
+
+def first_exit(value, region, limit):
+    """
+    i 周目の値 (c + i * d) & 0xFFFF が初めて region に入る i (1 <= i) を返す
+    limit 周までに入らなければ limit (d が 0 なら NEVER)
+    """
+    c, d                    = value
+    if not d:
+        return NEVER
+    if d in (1, MASK):              # 1 ずつ増える・減るなら範囲の端までの距離
+        if d == 1:
+            steps           = [(lo - c) & MASK for lo, hi in region]
+        else:
+            steps           = [(c - hi) & MASK for lo, hi in region]
+        return min(min([s for s in steps if s] or [NEVER]), limit)
+    v                       = c
+    for i in range(1, min(limit, MASK + 1) + 1):
+        v                   = (v + d) & MASK
+        if in_region(v, region):
+            return i
+    return limit if limit <= MASK else NEVER
+
+def trace_iteration(rom, ram, A, D, head, deltas, maxSteps, limit):
+    """
+    head から head に戻るまでの 1 周を (c, d) の組で実行する
+    deltas は "A" / "D" / RAM の番地 → 1 周あたりの増分 (無いものは 0)
+    戻り値は (命令数, 終わりの値, 書く前に読んだもの → 初めの値, 経路を外れない周回数)、調べられなければ None
+    """
+    values                  = {}        # "A" / "D" / 番地 → (c, d)
+    first                   = {}        # 書く前に読んだもの → 初めの値
+    initial                 = {"A": A, "D": D}
+
+    def read(key):
+        if key not in values:
+            value           = initial[key] if key in initial else ram[key]
+            first[key]      = value
+            values[key]     = (value, deltas.get(key, 0))
+        return values[key]
+
+    iterations              = NEVER
+    pc                      = head
+    steps                   = 0
+    while True:
+        word                = rom[pc] if pc < len(rom) else 0
+        steps               += 1
+        nextPc              = (pc + 1) & 0x7FFF
+        if not word & 0x8000:
+            values["A"]     = (word, 0)
+        else:
+            comp            = (word >> 6) & 0b111111
+            dest            = (word >> 3) & 0b111
+            jump            = word & 0b111
+            a               = None      # 命令前の A (M の番地とジャンプ先に使う)
+            if (dest & 0b001) or jump or ((word >> 12) & 1):
+                a           = read("A")
+                if a[1]:                # 番地・飛び先が周回で変わる
+                    return None
+            x               = (0, 0) if comp & 0b100000 else read("D")
+            if comp & 0b001000:
+                y           = (0, 0)
+            elif (word >> 12) & 1:
+                y           = read(a[0] & 0x7FFF)
+            else:
+                y           = read("A")
+            out             = affine_alu(comp, x, y)
+            if out is None:
+                return None
+            if dest & 0b001:
+                values[a[0] & 0x7FFF] = out
+            if dest & 0b010:
+                values["D"] = out
+            if dest & 0b100:
+                values["A"] = out
+            if jump:
+                taken       = in_region(out[0], JUMP_REGIONS[jump])
+                exits       = JUMP_REGIONS[jump] if not taken else complement(JUMP_REGIONS[jump])
+                if exits:
+                    iterations  = min(iterations, first_exit(out, exits, limit))
+                if taken:
+                    nextPc  = a[0] & 0x7FFF
+
+        pc                  = nextPc
+        if pc               == head:
+            return steps, values, first, iterations
+        if steps            >= maxSteps:
+            return None
+
+def analyze_loop(rom, ram, A, D, head, maxSteps = MAX_LOOP, limit = NEVER):
+    """
+    1 回目は増分 0 で実行して 1 周分の増分を求め、2 回目はその増分で実行して
+    書く前に読んだ値が 1 周後に c + d になっている (次の周も同じ式で表せる) ことを確かめる
+    limit は早送りできる最大の周回数 (残りの命令数から決まる)
+    """
+    result                  = trace_iteration(rom, ram, A, D, head, {}, maxSteps, limit)
+    if result is None:
+        return None
+    length, values, first, _ = result
+    deltas                  = {key: (values[key][0] - value) & MASK for key, value in first.items()}
+
+    result                  = trace_iteration(rom, ram, A, D, head, deltas, maxSteps, limit)
+    if result is None:
+        return None
+    length, values, first, iterations = result
+    for key, value in first.items():
+        if values[key]      != ((value + deltas[key]) & MASK, deltas[key]):
+            return None
+    return LoopSummary(head, length, iterations, values)
+
+def fast_forward(summary, ram, iterations):
+    """
+    iterations 周を実行した後の状態にする (値は最後の周 iterations - 1 の終わりの値)
+    """
+    i                       = iterations - 1
+    registers               = {}
+    for key, (c, d) in summary.values.items():
+        value               = (c + i * d) & MASK
+        if isinstance(key, str):
+            registers[key]  = value
+        else:
+            ram[key]        = value
+    return registers
+
+class IdleSkipMachine(JitMachine):
+    """待ちループを飛ばす JitMachine
+| attribute / method | args | description |
+| - | - | - |
+| .threshold | - | 同じ番地に何回来たらループを調べるか (失敗するたびに次に調べるまでの回数を 4 倍にする) |
+| .skips | - | 早送りした回数 |
+| .skipped | - | 早送りで飛ばした命令数 (.cycles に含まれる) |
+| .run | cycles | cycles 命令実行する (飛ばした分も数えるので命令数は正確) |
+| .try_skip | pc, A, D, remaining | pc を先頭とするループを remaining 命令以内で早送りし、(A, D, 飛ばした命令数) を返す |
+    """
+
+    def __init__(self, rom, labels = None, threshold = THRESHOLD, **kwargs):
+        super().__init__(rom, labels, **kwargs)
+        self.threshold      = threshold
+        self.hits           = [0] * len(self.blocks)
+        self.backoff        = {}        # 番地 → 次に調べるまでの回数
+        self.skips          = 0
+        self.skipped        = 0
+
+    def try_skip(self, pc, A, D, remaining):
+        summary             = analyze_loop(self.rom, self.ram, A, D, pc, limit = remaining)
+        if summary is not None:
+            iterations      = min(summary.iterations, remaining // summary.length)
+            if iterations   >= 2:
+                registers   = fast_forward(summary, self.ram, iterations)
+                self.backoff.pop(pc, None)
+                self.skips  += 1
+                self.skipped    += iterations * summary.length
+                return registers.get("A", A), registers.get("D", D), iterations * summary.length
+
+        wait                = self.backoff.get(pc, self.threshold) * 4
+        self.backoff[pc]    = wait
+        self.hits[pc]       = self.threshold - wait
+        return A, D, 0
+
+    def run(self, cycles):
+        blocks              = self.blocks
+        sizes               = self.sizes
+        hits                = self.hits
+        threshold           = self.threshold
+        A, D, pc            = self.A, self.D, self.pc
+        remaining           = cycles
+        while True:
+            block           = blocks[pc]
+            if block is None:
+                block       = self.compile_block(pc)
+            if sizes[pc]    > remaining:
+                break
+            hit             = hits[pc] + 1
+            hits[pc]        = hit
+            if hit          >= threshold:
+                hits[pc]    = 0
+                A, D, skipped = self.try_skip(pc, A, D, remaining)
+                if skipped:
+                    remaining   -= skipped
+                    continue
+            A, D, pc, count = block(A, D)
+            remaining       -= count
+
+        ops                 = self.ops
+        for _ in repeat(None, remaining):
+            A, D, pc        = ops[pc](A, D, pc)
+        self.A, self.D, self.pc = A, D, pc
+        self.cycles         += cycles
+        return cycles
@@ -0,0 +1,191 @@
+"""行単位のインクリメンタル再アセンブル
+| function / class | args | description |
+| - | - | - |
+| Assembly | code | 行ごとの解析結果とシンボルの参照位置を保持するアセンブル結果 |
+| assemble_lines | code | fast エンジンの表で全体をアセンブルし、Assembly を返す |
+| reassemble | assembly, edits | 行の編集を反映し、編集した行と値の変わったシンボルの参照だけを書き換える |
+
+edits は (start, end, newLines) のリストで、source[start:end] を newLines に置き換える
+(行番号は 0 始まりで、編集前の行番号で指定する。範囲は重ならないこと)
+
+```python
+a = assemble_lines(code)
+reassemble(a, [(120, 121, ["D=M"]), (300, 300, ["@SP", "M=M+1"])])
+a.lines()   # 全体をアセンブルし直した結果と同じ
+```
+"""
+
+from asm import HackCodeAnalyze, PREDEFINED_SYMBOLS, REGISTER_NUM
+from array import array
+from bisect import bisect_left
+
+class Assembly:
+    """行単位で編集できるアセンブル結果
+| attribute / method | args | description |
+| - | - | - |
+| .source | - | ソースの各行 |
+| .lineAddr | - | 各行の先頭の命令アドレス (array('I')、行数 + 1 個) |
+| .words | - | 命令語 (array('H')) |
+| .refs | - | シンボル → 参照している命令の位置 (昇順) |
+| .labelDefs | - | ラベル → 定義している行 (昇順、同名なら最後の定義が有効) |
+| .values | - | シンボル → 解決したアドレス |
+| .varTable | - | 全体をアセンブルしたときと同じシンボルテーブル |
+| .edit | edits | 行の編集を反映する |
+| .lines | - | .hack の各行 (16bit バイナリ文字列) のリストを返す |
+    """
+
+    def __init__(self, code = ""):
+        self.analyzer           = HackCodeAnalyze(debug = False, engine = "fast")
+        self.cache              = {}        # 行の文字列 → 解釈結果
+        self.source             = code.split("\n")
+
+        self.words, self.lineAddr, self.refs, self.labelDefs = self.decode(self.source, 0, 0)
+        self.lineAddr.append(len(self.words))
+
+        self.values             = self.resolve_values()
+        self.patch(self.values)
+
+    def decode(self, source, firstLine, firstAddr):
+        """
+        source を解釈し、(命令語, 各行のアドレス, シンボル参照, ラベル定義) を返す
+        シンボルを参照する命令語は 0 のままにしておく
+        """
+        words                   = array("H")
+        lineAddr                = array("I")
+        refs                    = {}
+        labelDefs               = {}
+        addr                    = firstAddr
+        for i, line in enumerate(source):
+            lineAddr.append(addr)
+            if line in self.cache:
+                inst            = self.cache[line]
+            else:
+                inst            = self.analyzer.fast_decode(line, firstLine + i + 1)
+                self.cache[line] = inst
+
+            if inst is None:
+                continue
+
+            if isinstance(inst, int):
+                words.append(inst)
+                addr            += 1
+            elif inst[0]        == "@":           # 定義済みシンボルは fast_decode が値にしている
+                refs.setdefault(inst[1], []).append(addr)
+                words.append(0)
+                addr            += 1
+            elif inst[1] not in self.analyzer.reservedVars:
+                labelDefs.setdefault(inst[1], []).append(firstLine + i)
+
+        return words, lineAddr, refs, labelDefs
+
+    def resolve_values(self):
+        """
+        ラベルは最後の定義行のアドレス、それ以外は最初に参照された順に変数のアドレスを割り当てる
+        (HackCodeAnalyze.asm() と同じ規則)
+        """
+        values                  = {}
+        for label, lines in self.labelDefs.items():
+            values[label]       = self.lineAddr[lines[-1]]
+
+        variables               = sorted(
+            [symbol for symbol in self.refs if symbol not in values],
+            key                 = lambda symbol: self.refs[symbol][0]
+        )
+        for rank, symbol in enumerate(variables):
+            addr                = REGISTER_NUM + rank
+            values[symbol]      = addr if addr < PREDEFINED_SYMBOLS["SCREEN"] else 0
+        return values
+
+    def patch(self, symbols):
+        for symbol in symbols:
+            value               = self.values[symbol]
+            for index in self.refs.get(symbol, ()):
+                self.words[index] = value
+
+    @property
+    def varTable(self):
+        return {**PREDEFINED_SYMBOLS, **self.values}
+
+    def splice(self, start, end, newLines):
+        """
+        source[start:end] を newLines に置き換え、後ろの命令位置・行番号をずらす
+        新しい行で参照しているシンボルの集合を返す
+        """
+        addr0                   = self.lineAddr[start]
+        addr1                   = self.lineAddr[end]
+        words, lineAddr, refs, labelDefs = self.decode(newLines, start, addr0)
+        delta                   = len(words) - (addr1 - addr0)
+        lineDelta               = len(newLines) - (end - start)
+
+        self.source[start:end]  = newLines
+        self.words[addr0:addr1] = words
+        tail                    = self.lineAddr[end:]
+        if delta:
+            tail                = array("I", [addr + delta for addr in tail])
+        self.lineAddr[start:]   = lineAddr + tail
+
+        shift_positions(self.refs, addr0, addr1, delta)
+        merge_positions(self.refs, refs)
+        shift_positions(self.labelDefs, start, end, lineDelta)
+        merge_positions(self.labelDefs, labelDefs)
+        return set(refs)
+
+    def edit(self, edits):
+        """
+        edits を後ろの範囲から順に反映し、
+        編集した行のシンボルと、値が変わったシンボル (ずれたラベルなど) の参照だけを書き換える
+        新しい行は反映する前にすべて解釈するので、HackSyntaxError のときは何も変更しない
+        """
+        for start, end, newLines in edits:
+            for i, line in enumerate(newLines):
+                if line not in self.cache:
+                    self.cache[line] = self.analyzer.fast_decode(line, start + i + 1)
+
+        dirty                   = set()
+        for start, end, newLines in sorted(edits, key = lambda e: e[0], reverse = True):
+            dirty               |= self.splice(start, end, list(newLines))
+
+        values                  = self.resolve_values()
+        for symbol, value in values.items():
+            if self.values.get(symbol) != value:
+                dirty.add(symbol)
+        self.values             = values
+        self.patch(dirty)
+        return self
+
+    def lines(self):
+        return [f"{word:016b}" for word in self.words]
+
+def shift_positions(table, start, end, delta):
+    """
+    table の各リストから [start, end) の位置を除き、end 以降を delta ずらす
+    """
+    for key, positions in list(table.items()):
+        lo                      = bisect_left(positions, start)
+        hi                      = bisect_left(positions, end)
+        if (lo == hi) and ((not delta) or (hi == len(positions))):
+            continue
+        after                   = positions[hi:]
+        if delta:
+            after               = [position + delta for position in after]
+        positions[lo:]          = after
+        if not positions:
+            del table[key]
+
+def merge_positions(table, added):
+    """
+    added の各リスト (連続した範囲) を table の昇順のリストに差し込む
+    """
+    for key, positions in added.items():
+        current                 = table.setdefault(key, [])
+        at                      = bisect_left(current, positions[0])
+        current[at:at]          = positions
+
+def assemble_lines(code):
+    return Assembly(code)
+
+def reassemble(assembly, edits):
+    """
+    assembly を直接書き換えて返す
+    """
+    return assembly.edit(edits)
@@ -0,0 +1,215 @@
+"""命令列単位の JIT
+| class / function | args | description |
+| - | - | - |
+| JitMachine | rom, labels, stopAtLabels | 命令列を Python の関数に変換して実行する HackMachine |
+| rom_hash | rom, leaders | ROM と区切りの番地のハッシュ (共有するブロックのキー) を返す |
+| block_source | rom, start, leaders | start から実行される命令列の関数のソースと (最長の命令数, 変換した番地の実行順のリスト) を返す |
+
+ブロックは実際に飛んできたアドレスごとに作り、関数 block(A, D) -> (A, D, 次の pc, 実行した命令数)
+にして compile() / exec で作る
+コードオブジェクトは (ROM のハッシュ, 先頭の番地) をキーにして同じプログラムのマシン間で共有し、
+最近使っていないものから捨てて CODE_CACHE_SIZE 個までにする
+- 条件ジャンプは飛ぶ側だけを return にして、飛ばない側はそのまま続ける (サイド出口)
+- 飛び先が定数の無条件ジャンプ (@LABEL 0;JMP) は飛び先を続けて変換する
+- 間接ジャンプ (A=M 0;JMP など)、ブロック内へ戻るループ、MAX_BLOCK 命令で区切る
+- @値 で決まった A は定数として式に埋め込み、M の読み書きを ram[定数] にする
+
+ラベルで区切るとブロックが短くなって呼び出しの回数が増えるので、既定ではラベルで区切らない
+(Pong ではラベルで区切ると 5% ほど遅い。stopAtLabels=True でラベルの手前でも区切り、重複して変換される命令を減らせる)
+ROM を書き換えたときは、その番地を含むブロックだけを捨てて作り直す
+
+```python
+words, labels = load_program("Pong.asm")
+m = JitMachine(words, labels)
+m.run(10000000)
+```
+"""
+
+from emulator import COMP_EXPRESSIONS, JUMP_CONDITIONS, ROM_SIZE, HackMachine, alu
+from collections import OrderedDict
+from itertools import repeat
+import hashlib
+import re
+
+MAX_BLOCK                   = 256       # 1 ブロックの最大の命令数
+CODE_CACHE_SIZE             = 4096      # マシン間で共有するブロックの数の上限
+
+def block_source(
+    rom,
+    start,
+    leaders                 = None,
+    maxLength               = MAX_BLOCK
+):
+    """
+    start から実行される命令を、間接ジャンプ・ループ・maxLength まで 1 つの関数にする
+    条件ジャンプは飛ぶ側を return (サイド出口) にして、飛ばない側を続けて変換する
+    飛び先が定数の無条件ジャンプは飛び先を続けて変換する
+    A は @値 の直後なら定数 a として式に埋め込み、変数 A には代入しない
+    戻り値は (ソース, 最も長い経路の命令数, 変換した番地の実行順のリスト)
+    count 命令目で抜けたときに実行したのは、リストの先頭の count 個の番地になる
+    """
+    lines                   = ["def block(A, D, ram = ram, alu = alu):"]
+    a                       = None      # 定数として分かっている A (None なら変数 A)
+    pc                      = start
+    count                   = 0
+    visited                 = {}        # 変換した番地 (実行順)
+    while True:
+        visited[pc]         = None
+        word                = rom[pc] if pc < len(rom) else 0
+        count               += 1
+        nextPc              = (pc + 1) & 0x7FFF     # PC は 15bit
+        if not word & 0x8000:
+            a               = word
+        else:
+            a, nextPc       = c_statements(word, a, count, nextPc, lines)
+            if nextPc is None:
+                break
+
+        pc                  = nextPc
+        if (pc in visited) or (count >= maxLength) or (leaders and (pc in leaders)):
+            lines.append(f"    return {register(a)}, D, {pc}, {count}")
+            break
+
+    return "\n".join(lines) + "\n", count, list(visited)
+
+def rom_hash(rom, leaders = ()):
+    """
+    ROM の内容と区切りの番地から求めたハッシュ (ブロックのキャッシュのキー)
+    """
+    digest                  = hashlib.blake2b(bytes(rom), digest_size = 16)
+    digest.update(repr(sorted(leaders)).encode())
+    return digest.digest()
+
+def register(a):
+    return "A" if a is None else str(a)
+
+def c_statements(word, a, count, nextPc, lines):
+    """
+    C命令 1 つ分の文を lines に加え、(命令後の定数 A, 続けて変換する番地) を返す
+    続けられない (飛び先が変数の無条件ジャンプ) ときの番地は None
+    M の書き込みとジャンプ先には命令前の A を使う
+    """
+    comp                    = (word >> 6) & 0b1111111
+    dest                    = (word >> 3) & 0b111
+    jump                    = word & 0b111
+
+    if comp in COMP_EXPRESSIONS:
+        expression          = COMP_EXPRESSIONS[comp]
+    elif comp & 0b1000000:
+        expression          = f"alu({comp & 0b111111}, D, M)"
+    else:
+        expression          = f"alu({comp & 0b111111}, D, A)"
+
+    addr                    = "A & 0x7FFF" if a is None else str(a & 0x7FFF)
+    expression              = re.sub(r"\bM\b", f"ram[{addr}]", expression)
+    expression              = re.sub(r"\bA\b", register(a), expression)
+
+    targets                 = []        # M, D, A の順に代入する (M の番地は代入前の A)
+    if dest & 0b001:
+        targets.append(f"ram[{addr}]")
+    if dest & 0b010:
+        targets.append("D")
+    if dest & 0b100:
+        targets.append("A")
+    newA                    = None if (dest & 0b100) else a
+    condition               = JUMP_CONDITIONS[jump]
+
+    # 飛び先は命令前の A なので、A を書き換えるときは先に取っておく
+    target                  = addr
+    if condition and (dest & 0b100) and (a is None):
+        lines.append("    target = A & 0x7FFF")
+        target              = "target"
+
+    if condition not in (None, "True"):
+        if targets or not expression.isidentifier():
+            targets.insert(0, "out")
+        else:                           # D;JNE などは out を使わずにレジスタを直接比べる
+            condition       = re.sub(r"\bout\b", expression, condition)
+    if targets:
+        lines.append(f"    {' = '.join(targets)} = {expression}")
+
+    if condition is None:
+        return newA, nextPc
+    if condition            == "True":
+        if a is None:
+            lines.append(f"    return {register(newA)}, D, {target}, {count}")
+            return newA, None
+        return newA, a & 0x7FFF
+    lines.append(f"    if {condition}:")
+    lines.append(f"        return {register(newA)}, D, {target}, {count}")
+    return newA, nextPc
+
+class JitMachine(HackMachine):
+    """命令列を関数にして実行する Hack コンピュータ
+| attribute / method | args | description |
+| - | - | - |
+| .leaders | - | ブロックを区切る番地の集合 (stopAtLabels=True のときのラベル) |
+| .blocks | - | アドレス → そこから始まるブロックの関数 (未変換なら None) |
+| .sizes | - | アドレス → ブロックの最も長い経路の命令数 |
+| .covers | - | ブロックの先頭 → 変換した番地 (実行順の dict、ROM の書き換えでの無効化に使う) |
+| .romKey | - | rom_hash (ROM を書き換えると求め直す) |
+| .run | cycles | cycles 命令実行する (端数は 1 命令ずつ実行するので命令数は正確) |
+| .write_rom | addr, word | ROM を書き換え、その番地を含むブロックだけを捨てる |
+    """
+
+    # (ROM のハッシュ, 先頭の番地) → (コードオブジェクト, 命令数, 変換した番地)、古いものから捨てる
+    codeCache               = OrderedDict()
+
+    def __init__(self, rom, labels = None, stopAtLabels = False):
+        super().__init__(rom)
+        self.labels         = labels
+        self.leaders        = set(labels.values()) if (labels and stopAtLabels) else set()
+        self.blocks         = [None] * ROM_SIZE
+        self.sizes          = [0] * ROM_SIZE
+        self.covers         = {}
+        self.romKey         = rom_hash(self.rom, self.leaders)
+
+    def compile_block(self, pc):
+        codeCache           = JitMachine.codeCache
+        key                 = (self.romKey, pc)
+        entry               = codeCache.get(key)
+        if entry is None:
+            source, size, path = block_source(self.rom, pc, self.leaders)
+            entry           = (compile(source, f"<hack block {pc}>", "exec"), size, path)
+            codeCache[key]  = entry
+            while len(codeCache) > CODE_CACHE_SIZE:
+                codeCache.popitem(last = False)
+        else:
+            codeCache.move_to_end(key)
+        code, size, path    = entry
+        namespace           = {"ram": self.ram, "alu": alu}
+        exec(code, namespace)
+
+        self.blocks[pc]     = namespace["block"]
+        self.sizes[pc]      = size
+        self.covers[pc]     = dict.fromkeys(path)
+        return self.blocks[pc]
+
+    def run(self, cycles):
+        blocks              = self.blocks
+        sizes               = self.sizes
+        A, D, pc            = self.A, self.D, self.pc
+        remaining           = cycles
+        while True:
+            block           = blocks[pc]
+            if block is None:
+                block       = self.compile_block(pc)
+            if sizes[pc]    > remaining:    # ブロックの途中で止まるかもしれない分は 1 命令ずつ
+                break
+            A, D, pc, count = block(A, D)
+            remaining       -= count
+
+        ops                 = self.ops
+        for _ in repeat(None, remaining):
+            A, D, pc        = ops[pc](A, D, pc)
+        self.A, self.D, self.pc = A, D, pc
+        self.cycles         += cycles
+        return cycles
+
+    def write_rom(self, addr, word):
+        super().write_rom(addr, word)
+        self.romKey         = rom_hash(self.rom, self.leaders)
+        for start, cover in list(self.covers.items()):
+            if addr in cover:
+                self.blocks[start] = None
+                del self.covers[start]
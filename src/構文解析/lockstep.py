@@ -0,0 +1,235 @@
+"""NumPy による複数の Hack コンピュータの一括実行
+| class / function | args | description |
+| - | - | - |
+| BatchMachine | rom, n | 同じ ROM の n 台のマシンの A, D, PC, RAM を NumPy の配列で持ち、まとめて実行する |
+| op_source | word | 命令語 1 つを、選んだマシン全部にまとめて適用する関数のソースにする |
+
+同じ PC にいるマシンの組 (グループ) に対して、1 命令を配列の演算 1 回分として実行する
+- 分岐で飛び先が分かれたマシンはグループから外れ、PC の最も小さいグループから先に進める
+  (遅れているマシンが追いつくので、if / ループを抜けたところで再び 1 つのグループに合流しやすい)
+- グループは分岐で分かれるか、他のマシンが待っている PC に着くまで続けて実行する
+- 各マシンの実行命令数は run(cycles) の cycles ちょうどで、1 台ずつ HackMachine で実行した結果と一致する
+
+numpy が必要 (pip install numpy)
+
+```python
+m = BatchMachine(read_hack("build/Pong.hack"), 1000)
+m.set_keys(np.arange(1000) % 3 * 2 + 128)  # マシンごとのキー入力
+m.run(1000000)
+m.screens()                     # (1000, 8192) の SCREEN
+```
+"""
+
+from emulator import KBD, RAM_SIZE, ROM_SIZE, SCREEN, SCREEN_SIZE, HackMachine, alu
+from array import array
+import numpy as np
+
+PARKED                      = ROM_SIZE  # 実行を終えたマシンの PC の代わり (どの PC よりも大きい)
+ALL                         = slice(None)
+
+# comp (a ビットを含む 7bit) → 配列の式 (D, A は D[sel], A[sel]、M は ram[rows, t])
+BATCH_EXPRESSIONS           = {
+    0b0101010               : "0",
+    0b0111111               : "1",
+    0b0111010               : "0xFFFF",
+    0b0001100               : "D",
+    0b0110000               : "A",
+    0b0001101               : "~D",
+    0b0110001               : "~A",
+    0b0001111               : "-D",
+    0b0110011               : "-A",
+    0b0011111               : "D + 1",
+    0b0110111               : "A + 1",
+    0b0001110               : "D - 1",
+    0b0110010               : "A - 1",
+    0b0000010               : "D + A",
+    0b0010011               : "D - A",
+    0b0000111               : "A - D",
+    0b0000000               : "D & A",
+    0b0010101               : "D | A",
+    0b1110000               : "M",
+    0b1110001               : "~M",
+    0b1110011               : "-M",
+    0b1110111               : "M + 1",
+    0b1110010               : "M - 1",
+    0b1000010               : "D + M",
+    0b1010011               : "D - M",
+    0b1000111               : "M - D",
+    0b1000000               : "D & M",
+    0b1010101               : "D | M",
+}
+
+# jump (3bit) → out で飛ぶ条件の配列の式 (uint16 なので 0x8000 以上が負)
+BATCH_CONDITIONS            = {
+    0b001                   : "(out != 0) & (out < 0x8000)",    # JGT
+    0b010                   : "out == 0",                       # JEQ
+    0b011                   : "out < 0x8000",                   # JGE
+    0b100                   : "out >= 0x8000",                  # JLT
+    0b101                   : "out != 0",                       # JNE
+    0b110                   : "(out == 0) | (out >= 0x8000)",   # JLE
+}
+
+def op_source(word):
+    """
+    op(sel, rows, nextPc) : sel は A, D の添字 (ALL か行番号の配列)、rows は RAM の行番号の配列
+    ジャンプしない命令は None を、ジャンプ命令は選んだマシンごとの次の PC の配列を返す
+    (PC はグループで共通なので、呼び出し側が nextPc で進める)
+    """
+    lines                   = ["def op(sel, rows, nextPc):"]
+    if not word & 0x8000:
+        lines.append(f"    A[sel] = {word}")
+        return "\n".join(lines) + "\n"
+
+    comp                    = (word >> 6) & 0b1111111
+    dest                    = (word >> 3) & 0b111
+    jump                    = word & 0b111
+
+    if comp in BATCH_EXPRESSIONS:
+        expression          = BATCH_EXPRESSIONS[comp]
+    else:                                   # 表に無いビットの組み合わせは 1 台分の ALU を各マシンに適用する
+        y                   = "M" if comp & 0b1000000 else "A"
+        expression          = f"np.vectorize(alu, otypes = [np.uint16])({comp & 0b111111}, D, {y})"
+
+    # M の番地とジャンプ先は命令前の A (式を計算してから A を書き換える)
+    if ("M" in expression) or (dest & 0b001) or jump:
+        lines.append("    t = A[sel] & 0x7FFF")
+    expression              = (
+        expression
+        .replace("M", "ram[rows, t]")
+        .replace("D", "D[sel]")
+        .replace("A", "A[sel]")
+    )
+    lines.append(f"    out = np.asarray({expression}, dtype = np.uint16)")
+
+    if dest & 0b001:
+        lines.append("    ram[rows, t] = out")
+    if dest & 0b010:
+        lines.append("    D[sel] = out")
+    if dest & 0b100:
+        lines.append("    A[sel] = out")
+
+    if jump                 == 0b111:
+        lines.append("    return t")
+    elif jump:
+        lines.append(f"    return np.where({BATCH_CONDITIONS[jump]}, t, nextPc)")
+    return "\n".join(lines) + "\n"
+
+class BatchMachine:
+    """同じ ROM の n 台の Hack コンピュータ
+| attribute / method | args | description |
+| - | - | - |
+| .n | - | 台数 |
+| .A / .D | - | (n,) uint16 のレジスタ |
+| .pc | - | (n,) int32 の PC |
+| .ram | - | (n, 32768) uint16 の RAM |
+| .cycles | - | マシンごとの実行命令数 (すべて同じ) |
+| .steps | - | 直近の run で実行した配列演算の回数 (n * cycles / steps がまとめて実行できた平均台数) |
+| .reset | - | レジスタを 0 にする (RAM はそのまま) |
+| .run | cycles | 全マシンを cycles 命令ずつ実行する |
+| .set_keys | codes, machines | KBD をマシンごとに設定する (codes は整数か配列) |
+| .screens | - | (n, 8192) の SCREEN の view |
+| .machine | i | i 台目の状態を写した HackMachine を返す (1 台ずつの確認用) |
+    """
+
+    def __init__(self, rom, n):
+        if len(rom)         > ROM_SIZE:
+            raise ValueError(f"ROM is too large : {len(rom)} words (max {ROM_SIZE})")
+
+        self.rom            = np.zeros(ROM_SIZE, dtype = np.uint16)
+        self.rom[:len(rom)] = rom
+        self.n              = n
+        self.rows           = np.arange(n)
+        self.A              = np.zeros(n, dtype = np.uint16)
+        self.D              = np.zeros(n, dtype = np.uint16)
+        self.pc             = np.zeros(n, dtype = np.int32)
+        self.ram            = np.zeros((n, RAM_SIZE), dtype = np.uint16)
+        self.cycles         = 0
+        self.steps          = 0
+        self.ops            = self.decode_rom()
+
+    def decode_rom(self):
+        """
+        同じ命令語は同じ関数を使う (関数はこのマシンの配列を参照する)
+        """
+        namespace           = {"A": self.A, "D": self.D, "ram": self.ram, "np": np, "alu": alu}
+        table               = {}
+        ops                 = []
+        for word in self.rom.tolist():
+            if word not in table:
+                local       = dict(namespace)
+                exec(compile(op_source(word), f"<hack batch {word:016b}>", "exec"), local)
+                table[word] = local["op"]
+            ops.append(table[word])
+        return ops
+
+    def reset(self):
+        self.A[:]           = 0
+        self.D[:]           = 0
+        self.pc[:]          = 0
+
+    def set_keys(self, codes, machines = ALL):
+        self.ram[machines, KBD] = codes
+
+    def screens(self):
+        return self.ram[:, SCREEN:SCREEN + SCREEN_SIZE]
+
+    def machine(self, i):
+        m                   = HackMachine(self.rom.tolist())
+        m.ram[:]            = array("H", self.ram[i].tobytes())
+        m.A, m.D, m.pc      = int(self.A[i]), int(self.D[i]), int(self.pc[i])
+        m.cycles            = self.cycles
+        return m
+
+    def run_group(self, sel, rows, pc, budget, waiting):
+        """
+        PC が pc のグループを、分岐で分かれるか budget 命令か waiting の PC に着くまで進める
+        戻り値は (実行した命令数, 次の PC (グループで共通なら int、分かれたら配列))
+        """
+        ops                 = self.ops
+        count               = 0
+        while count         < budget:
+            nextPc          = (pc + 1) & 0x7FFF
+            target          = ops[pc](sel, rows, nextPc)
+            count           += 1
+            if target is None:
+                pc          = nextPc
+            else:
+                first       = int(target[0])
+                if not (target == first).all():
+                    return count, target
+                pc          = first
+            if pc in waiting:
+                break
+        return count, pc
+
+    def run(self, cycles):
+        if cycles           <= 0:
+            return 0
+        key                 = self.pc.copy()    # 実行中のマシンの PC (終えたマシンは PARKED)
+        left                = np.full(self.n, cycles, dtype = np.int64)
+        steps               = 0
+        while True:
+            pc              = int(key.min())
+            if pc           == PARKED:
+                break
+            mask            = key == pc
+            if mask.all():
+                sel, rows   = ALL, self.rows
+                waiting     = ()
+            else:
+                sel         = rows = np.flatnonzero(mask)
+                waiting     = set(np.unique(key[~mask]).tolist())
+
+            count, nextPc   = self.run_group(sel, rows, pc, int(left[sel].min()), waiting)
+            steps           += count
+            key[sel]        = nextPc
+            left[sel]       -= count
+
+            finished        = self.rows[sel][left[sel] == 0]
+            if len(finished):
+                self.pc[finished] = key[finished]
+                key[finished]     = PARKED
+
+        self.cycles         += cycles
+        self.steps          = steps
+        return cycles
@@ -1,77 +0,0 @@
-
-# parsetab.py
-# This file is automatically generated. Do not edit.
-# pylint: disable=W,C,R
-_tabversion = '3.10'
-
-_lr_method = 'LALR'
-
-_lr_signature = 'A AD ADM AM AMD AND AT D DM EQUAL JEQ JGE JGT JLE JLT JMP JNE LPAREN M MD MINUS NOT NUMBER OR PLUS RPAREN SEMI SYMBOL\nstatements  : statement statements\n            | empty\nempty : statement  : a_instructionstatement  : l_instructionstatement  : c_instruction\na_instruction   : AT SYMBOL\n                | AT NUMBER\n\nl_instruction : LPAREN SYMBOL RPAREN\n\nc_instruction   : dest EQUAL comp SEMI jump\n                | comp SEMI jump\n                | dest EQUAL comp\n                | comp\n\n\ndest    : AMD\n        | ADM\n        | AD\n        | AM\n        | MD \n        | DM\n        | A\n        | M\n        | D\n\ncomp        : registers\n            | registerNum\n            | registerFunc\n\ncomp        : register\n            | num\n\nregisters       : register PLUS register\n                | register MINUS register\n                | register AND register\n                | register OR register\n\nregisterFunc    : NOT register\n                | MINUS register\n\nregisterNum     : register PLUS num\n                | register MINUS num\n\nnum : NUMBER\n\nnum        : MINUS NUMBER\n\nregister    : A\n            | M\n            | D\n\njump    : JGT\n        | JEQ\n        | JGE\n        | JLT\n        | JNE\n        | JLE\n        | JMP\n'
-    
-_lr_action_items = {'$end':([0,1,2,3,4,5,6,8,11,18,19,20,21,22,23,24,25,28,29,30,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,57,58,59,60,62,],[-3,0,-3,-2,-4,-5,-6,-36,-13,-38,-39,-40,-23,-24,-25,-26,-27,-1,-7,-8,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,-29,-35,-30,-31,-10,]),'AT':([0,2,4,5,6,8,11,18,19,20,21,22,23,24,25,29,30,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,57,58,59,60,62,],[7,7,-4,-5,-6,-36,-13,-38,-39,-40,-23,-24,-25,-26,-27,-7,-8,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,-29,-35,-30,-31,-10,]),'LPAREN':([0,2,4,5,6,8,11,18,19,20,21,22,23,24,25,29,30,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,57,58,59,60,62,],[9,9,-4,-5,-6,-36,-13,-38,-39,-40,-23,-24,-25,-26,-27,-7,-8,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,-29,-35,-30,-31,-10,]),'AMD':([0,2,4,5,6,8,11,18,19,20,21,22,23,24,25,29,30,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,57,58,59,60,62,],[12,12,-4,-5,-6,-36,-13,-38,-39,-40,-23,-24,-25,-26,-27,-7,-8,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,-29,-35,-30,-31,-10,]),'ADM':([0,2,4,5,6,8,11,18,19,20,21,22,23,24,25,29,30,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,57,58,59,60,62,],[13,13,-4,-5,-6,-36,-13,-38,-39,-40,-23,-24,-25,-26,-27,-7,-8,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,-29,-35,-30,-31,-10,]),'AD':([0,2,4,5,6,8,11,18,19,20,21,22,23,24,25,29,30,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,57,58,59,60,62,],[14,14,-4,-5,-6,-36,-13,-38,-39,-40,-23,-24,-25,-26,-27,-7,-8,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,-29,-35,-30,-31,-10,]),'AM':([0,2,4,5,6,8,11,18,19,20,21,22,23,24,25,29,30,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,57,58,59,60,62,],[15,15,-4,-5,-6,-36,-13,-38,-39,-40,-23,-24,-25,-26,-27,-7,-8,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,-29,-35,-30,-31,-10,]),'MD':([0,2,4,5,6,8,11,18,19,20,21,22,23,24,25,29,30,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,57,58,59,60,62,],[16,16,-4,-5,-6,-36,-13,-38,-39,-40,-23,-24,-25,-26,-27,-7,-8,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,-29,-35,-30,-31,-10,]),'DM':([0,2,4,5,6,8,11,18,19,20,21,22,23,24,25,29,30,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,57,58,59,60,62,],[17,17,-4,-5,-6,-36,-13,-38,-39,-40,-23,-24,-25,-26,-27,-7,-8,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,-29,-35,-30,-31,-10,]),'A':([0,2,4,5,6,8,11,18,19,20,21,22,23,24,25,26,27,29,30,32,34,35,36,37,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,57,58,59,60,62,],[18,18,-4,-5,-6,-36,-13,-38,-39,-40,-23,-24,-25,-26,-27,40,40,-7,-8,40,40,40,40,40,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,-29,-35,-30,-31,-10,]),'M':([0,2,4,5,6,8,11,18,19,20,21,22,23,24,25,26,27,29,30,32,34,35,36,37,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,57,58,59,60,62,],[19,19,-4,-5,-6,-36,-13,-38,-39,-40,-23,-24,-25,-26,-27,41,41,-7,-8,41,41,41,41,41,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,-29,-35,-30,-31,-10,]),'D':([0,2,4,5,6,8,11,18,19,20,21,22,23,24,25,26,27,29,30,32,34,35,36,37,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,57,58,59,60,62,],[20,20,-4,-5,-6,-36,-13,-38,-39,-40,-23,-24,-25,-26,-27,42,42,-7,-8,42,42,42,42,42,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,-29,-35,-30,-31,-10,]),'NOT':([0,2,4,5,6,8,11,18,19,20,21,22,23,24,25,29,30,32,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,57,58,59,60,62,],[27,27,-4,-5,-6,-36,-13,-38,-39,-40,-23,-24,-25,-26,-27,-7,-8,27,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,-29,-35,-30,-31,-10,]),'MINUS':([0,2,4,5,6,8,11,18,19,20,21,22,23,24,25,29,30,32,34,35,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,57,58,59,60,62,],[26,26,-4,-5,-6,-36,-13,-38,-39,-40,-23,-24,-25,35,-27,-7,-8,26,56,56,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,-29,-35,-30,-31,-10,]),'NUMBER':([0,2,4,5,6,7,8,11,18,19,20,21,22,23,24,25,26,29,30,32,34,35,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,56,57,58,59,60,62,],[8,8,-4,-5,-6,30,-36,-13,-38,-39,-40,-23,-24,-25,-26,-27,39,-7,-8,8,8,8,-33,-37,-38,-39,-40,-32,-9,-12,-11,-41,-42,-43,-44,-45,-46,-47,-28,-34,39,-29,-35,-30,-31,-10,]),'SYMBOL':([7,9,],[29,31,]),'SEMI':([8,11,18,19,20,21,22,23,24,25,38,39,40,41,42,43,45,54,55,57,58,59,60,],[-36,33,-38,-39,-40,-23,-24,-25,-26,-27,-33,-37,-38,-39,-40,-32,61,-28,-34,-29,-35,-30,-31,]),'EQUAL':([10,12,13,14,15,16,17,18,19,20,],[32,-14,-15,-16,-17,-18,-19,-20,-21,-22,]),'PLUS':([18,19,20,24,40,41,42,],[-38,-39,-40,34,-38,-39,-40,]),'AND':([18,19,20,24,40,41,42,],[-38,-39,-40,36,-38,-39,-40,]),'OR':([18,19,20,24,40,41,42,],[-38,-39,-40,37,-38,-39,-40,]),'RPAREN':([31,],[44,]),'JGT':([33,61,],[47,47,]),'JEQ':([33,61,],[48,48,]),'JGE':([33,61,],[49,49,]),'JLT':([33,61,],[50,50,]),'JNE':([33,61,],[51,51,]),'JLE':([33,61,],[52,52,]),'JMP':([33,61,],[53,53,]),}
-
-_lr_action = {}
-for _k, _v in _lr_action_items.items():
-   for _x,_y in zip(_v[0],_v[1]):
-      if not _x in _lr_action:  _lr_action[_x] = {}
-      _lr_action[_x][_k] = _y
-del _lr_action_items
-
-_lr_goto_items = {'statements':([0,2,],[1,28,]),'statement':([0,2,],[2,2,]),'empty':([0,2,],[3,3,]),'a_instruction':([0,2,],[4,4,]),'l_instruction':([0,2,],[5,5,]),'c_instruction':([0,2,],[6,6,]),'dest':([0,2,],[10,10,]),'comp':([0,2,32,],[11,11,45,]),'registers':([0,2,32,],[21,21,21,]),'registerNum':([0,2,32,],[22,22,22,]),'registerFunc':([0,2,32,],[23,23,23,]),'register':([0,2,26,27,32,34,35,36,37,],[24,24,38,43,24,54,57,59,60,]),'num':([0,2,32,34,35,],[25,25,25,55,58,]),'jump':([33,61,],[46,62,]),}
-
-_lr_goto = {}
-for _k, _v in _lr_goto_items.items():
-   for _x, _y in zip(_v[0], _v[1]):
-       if not _x in _lr_goto: _lr_goto[_x] = {}
-       _lr_goto[_x][_k] = _y
-del _lr_goto_items
-_lr_productions = [
-  ("S' -> statements","S'",1,None,None,None),
-  ('statements -> statement statements','statements',2,'p_statements','asm.py',180),
-  ('statements -> empty','statements',1,'p_statements','asm.py',181),
-  ('empty -> <empty>','empty',0,'p_empty','asm.py',189),
-  ('statement -> a_instruction','statement',1,'p_statement_a','asm.py',192),
-  ('statement -> l_instruction','statement',1,'p_statement_l','asm.py',200),
-  ('statement -> c_instruction','statement',1,'p_statement_c','asm.py',206),
-  ('a_instruction -> AT SYMBOL','a_instruction',2,'p_a_instruction','asm.py',224),
-  ('a_instruction -> AT NUMBER','a_instruction',2,'p_a_instruction','asm.py',225),
-  ('l_instruction -> LPAREN SYMBOL RPAREN','l_instruction',3,'p_l_instruction','asm.py',259),
-  ('c_instruction -> dest EQUAL comp SEMI jump','c_instruction',5,'p_c_instruction_1','asm.py',274),
-  ('c_instruction -> comp SEMI jump','c_instruction',3,'p_c_instruction_1','asm.py',275),
-  ('c_instruction -> dest EQUAL comp','c_instruction',3,'p_c_instruction_1','asm.py',276),
-  ('c_instruction -> comp','c_instruction',1,'p_c_instruction_1','asm.py',277),
-  ('dest -> AMD','dest',1,'p_dest','asm.py',319),
-  ('dest -> ADM','dest',1,'p_dest','asm.py',320),
-  ('dest -> AD','dest',1,'p_dest','asm.py',321),
-  ('dest -> AM','dest',1,'p_dest','asm.py',322),
-  ('dest -> MD','dest',1,'p_dest','asm.py',323),
-  ('dest -> DM','dest',1,'p_dest','asm.py',324),
-  ('dest -> A','dest',1,'p_dest','asm.py',325),
-  ('dest -> M','dest',1,'p_dest','asm.py',326),
-  ('dest -> D','dest',1,'p_dest','asm.py',327),
-  ('comp -> registers','comp',1,'p_comp_1','asm.py',346),
-  ('comp -> registerNum','comp',1,'p_comp_1','asm.py',347),
-  ('comp -> registerFunc','comp',1,'p_comp_1','asm.py',348),
-  ('comp -> register','comp',1,'p_comp_2','asm.py',354),
-  ('comp -> num','comp',1,'p_comp_2','asm.py',355),
-  ('registers -> register PLUS register','registers',3,'p_registers','asm.py',382),
-  ('registers -> register MINUS register','registers',3,'p_registers','asm.py',383),
-  ('registers -> register AND register','registers',3,'p_registers','asm.py',384),
-  ('registers -> register OR register','registers',3,'p_registers','asm.py',385),
-  ('registerFunc -> NOT register','registerFunc',2,'p_register_func','asm.py',418),
-  ('registerFunc -> MINUS register','registerFunc',2,'p_register_func','asm.py',419),
-  ('registerNum -> register PLUS num','registerNum',3,'p_register_num','asm.py',447),
-  ('registerNum -> register MINUS num','registerNum',3,'p_register_num','asm.py',448),
-  ('num -> NUMBER','num',1,'p_num','asm.py',477),
-  ('num -> MINUS NUMBER','num',2,'p_minus_num','asm.py',487),
-  ('register -> A','register',1,'p_register','asm.py',500),
-  ('register -> M','register',1,'p_register','asm.py',501),
-  ('register -> D','register',1,'p_register','asm.py',502),
-  ('jump -> JGT','jump',1,'p_jump','asm.py',509),
-  ('jump -> JEQ','jump',1,'p_jump','asm.py',510),
-  ('jump -> JGE','jump',1,'p_jump','asm.py',511),
-  ('jump -> JLT','jump',1,'p_jump','asm.py',512),
-  ('jump -> JNE','jump',1,'p_jump','asm.py',513),
-  ('jump -> JLE','jump',1,'p_jump','asm.py',514),
-  ('jump -> JMP','jump',1,'p_jump','asm.py',515),
-]
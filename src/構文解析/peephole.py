@@ -0,0 +1,435 @@
+"""構文解析とシンボル解決の間の命令列のピープホール最適化
+| class / function | args | description |
+| - | - | - |
+| PeepholeOptimizer | disabled, enabled | 未解決の HackProgram を書き換え、ラベルのアドレスを付け直す (HackCodeAnalyze の optimizer に渡す) |
+| PeepholeReport | - | 適用したルールの回数、前後の語数、命令の元のアドレス |
+| main | args | コマンドライン (前後の ROM の語数と、プロファイルから見積もった命令数を表示する) |
+
+ルール (名前を disabled に入れると、そのルールだけ使わない。OPT_IN_RULES は enabled に入れたときだけ使う)
+| rule | before | after |
+| - | - | - |
+| redundant_load | @X (A がすでに X) | (削除) |
+| push_pop | @SP / AM=M+1 / A=A-1 / M=x / @SP / AM=M-1 (push した値をすぐ pop する) | @SP / A=M / M=x |
+| | @SP / M=M+1 / A=M-1 / M=x / @SP / AM=M-1 | @SP / A=M / M=x |
+| load_store_pair | D=M / M=D、M=D / D=M | 2 命令目を削除 |
+| inc_dec | M=M+1 / M=M-1 (逆も) | (両方削除) |
+| | M=M+1 / AM=M-1 (逆も) | A=M |
+| dead_code (opt-in) | 0;JMP などの無条件ジャンプの後の、ラベルの無い命令 | (削除) |
+| jump_to_next | @L / 0;JMP の直後が (L) で、その先頭が A命令 | (両方削除) |
+
+ラベルと飛び先
+- ラベルの位置と、ジャンプ命令の直前の数値の A命令 (@133 / 0;JMP) の値を「入口」として、
+  入口をまたいでルールを適用せず、入口の命令は削除しない (入口では A の値を分からないものとして扱う)
+- 数値の A命令を飛び先として扱うのは、ジャンプ命令が A も M も読み書きせず (0;JMP、D;JGT、D=D+1;JEQ など)、
+  飛ばなかったときも A を読まない (無条件ジャンプか、次が A命令) ときだけ
+  (@9 / D=D-A;JLT や @12 / D;JLT / M=D のように A を値や番地としても使うときは値を変えられないので、
+  9 番地・12 番地までの命令を動かさない)
+- 定義済みシンボル (@R3、@SCREEN など) は数値と同じに扱う (ply / fast エンジンで同じ結果になる)
+- 最適化の後、ラベルのアドレスと、飛び先として扱った数値の A命令の値を新しいアドレスに付け直す
+- 計算で求めたアドレスへのジャンプ (A=M;JMP など) の飛び先はラベル (@RET D=A などで積んだもの) であること、
+  ラベルのアドレスを値として計算に使わないこと (D=A+1 など) を前提にする (VM 変換器の出力はこれを満たす)
+  数値で積んだ戻り先 (@133 / D=A) は定数と区別できないので、前提を満たさないプログラムでは命令を削除すると
+  アドレスがずれる。特に dead_code は戻り先の命令そのものを消すので、前提を確かめたときだけ使う (OPT_IN_RULES)
+- KBD (メモリマップの入力) への書き込みは無いものとする (emulator.py と同じく RAM として扱う)
+- push_pop は SP (RAM[0]) が 0 を指さないこと (VM のスタックは 256 から) を前提にする
+  (x は M を読まない計算に限り、pop した後の値は元と同じくスタックの上に書かれたまま残る)
+
+削除・置き換えは 1 回の実行で同じ経路を通り、残った命令はそれぞれ元と同じ回数実行されるので、
+元のプログラムのアドレスごとの実行命令数 (hotspot.ProfilingMachine) から最適化後の命令数を見積もれる
+
+```python
+with HackCodeAnalyze(code, debug = False, engine = "fast", optimizer = PeepholeOptimizer()) as l:
+    words = l.encode().words
+    l.optimizeReport.applied    # ルール → 適用した回数
+```
+
+```bash
+python peephole.py Pong.asm --profile-cycles 5000000
+python peephole.py Pong.asm --disable inc_dec -o Pong.opt.hack
+python peephole.py Pong.asm --enable dead_code      # 戻り先がすべてラベルのとき
+python peephole.py --list-rules
+```
+"""
+
+from asm import C_TABLE, PREDEFINED_SYMBOLS, HackCodeAnalyze, HackProgram
+from array import array
+from sys import argv, exit
+import argparse
+import time
+
+MAX_PASSES                  = 10        # ルールをまとめて適用し直す最大の回数 (変化が無くなれば終える)
+DEST_A                      = 0b100000
+JUMP_BITS                   = 0b111
+DEST_M                      = 0b001000
+
+D_M                         = C_TABLE["D=M"]
+M_D                         = C_TABLE["M=D"]
+M_INC                       = C_TABLE["M=M+1"]
+M_DEC                       = C_TABLE["M=M-1"]
+AM_INC                      = C_TABLE["AM=M+1"]
+AM_DEC                      = C_TABLE["AM=M-1"]
+A_M                         = C_TABLE["A=M"]
+
+LOAD_STORE_PAIRS            = frozenset(((D_M, M_D), (M_D, D_M)))
+CANCELLING_PAIRS            = frozenset(((M_INC, M_DEC), (M_DEC, M_INC)))
+REPLACED_PAIRS              = {(M_INC, AM_DEC): A_M, (M_DEC, AM_INC): A_M}
+PUSH_STEPS                  = frozenset(((AM_INC, C_TABLE["A=A-1"]), (M_INC, C_TABLE["A=M-1"])))
+SP                          = ("num", PREDEFINED_SYMBOLS["SP"])
+DEST_M_ONLY                 = 0b001
+
+# A も M も読まない comp (直前の数値の A命令を飛び先だけに使うジャンプ命令の comp)
+TARGET_ONLY_COMPS           = frozenset(
+    (word >> 6) & 0b1111111
+    for form, word in C_TABLE.items()
+    if not set(form.split("=")[-1].split(";")[0]) & set("AM")
+)
+
+class Entry:
+    """最適化中の命令 1 つ
+| attribute | description |
+| - | - |
+| .inst | 命令語 (int) か未解決シンボルの A命令 (str) |
+| .origin | 元のアドレス |
+| .labels | この命令の位置のラベル (入口でなければ空) |
+| .leader | 入口 (ラベルか、ジャンプ命令の直前の数値の A命令の飛び先) か |
+| .romRef | 飛び先だけに使う数値の A命令 (値を新しいアドレスに付け直す) か |
+    """
+    __slots__               = ("inst", "origin", "labels", "leader", "romRef")
+
+    def __init__(self, inst, origin, labels = (), leader = False, romRef = False):
+        self.inst           = inst
+        self.origin         = origin
+        self.labels         = labels
+        self.leader         = leader
+        self.romRef         = romRef
+
+def is_c(inst):
+    return isinstance(inst, int) and bool(inst & 0x8000)
+
+def is_rom_jump(inst):
+    """
+    A を飛び先だけに使うジャンプ命令 (comp が A / M を読まず、dest に A / M が無い) か
+    """
+    return (
+        is_c(inst) and bool(inst & JUMP_BITS) and
+        not (inst & (DEST_A | DEST_M)) and
+        ((inst >> 6) & 0b1111111) in TARGET_ONLY_COMPS
+    )
+
+def falls_through_to_load(insts, i):
+    """
+    insts[i] のジャンプ命令で飛ばなかったときに、A を読む前に A命令で上書きするか
+    (無条件ジャンプか、次が A命令かプログラムの終わり。ラベルは insts に無いので間にあっても同じ)
+    """
+    return (
+        ((insts[i] & JUMP_BITS) == JUMP_BITS) or
+        (i + 1 >= len(insts)) or
+        not is_c(insts[i + 1])
+    )
+
+def a_value(entry):
+    """
+    A命令で A に入る値の比較用のキー (定数名は値、ジャンプ先の数値はデータの数値と区別する)
+    """
+    inst                    = entry.inst
+    if isinstance(inst, str):
+        if inst in PREDEFINED_SYMBOLS:
+            return ("num", PREDEFINED_SYMBOLS[inst])
+        return ("sym", inst)
+    return ("rom" if entry.romRef else "num", inst)
+
+def redundant_load(code):
+    out                     = []
+    known                   = None      # A の値のキー (分からなければ None)
+    applied                 = 0
+    for e in code:
+        if e.leader:
+            known           = None
+        if is_c(e.inst):
+            if e.inst & DEST_A:
+                known       = None
+        else:
+            key             = a_value(e)
+            if key          == known:
+                applied     += 1
+                continue
+            known           = key
+        out.append(e)
+    return out, applied
+
+def push_pop(code):
+    """
+    push の後 A は積んだ位置 (元の SP) を指し、pop で SP が戻るので、元の SP の位置に x を書くだけと同じ
+    """
+    out                     = []
+    applied                 = 0
+    i                       = 0
+    while i                 < len(code):
+        window              = code[i:i + 6]
+        if (
+            (len(window) == 6) and
+            not any(e.leader for e in window[1:]) and
+            (not is_c(window[0].inst)) and (a_value(window[0]) == SP) and
+            ((window[1].inst, window[2].inst) in PUSH_STEPS) and
+            is_c(window[3].inst) and (window[3].inst & 0b1000000111111) == DEST_M_ONLY << 3 and    # a=0, dest=M, jump 無し
+            (not is_c(window[4].inst)) and (a_value(window[4]) == SP) and
+            (window[5].inst == AM_DEC)
+        ):
+            out             += [window[0], Entry(A_M, window[1].origin), window[3]]
+            applied         += 1
+            i               += 6
+            continue
+        out.append(code[i])
+        i                   += 1
+    return out, applied
+
+def load_store_pair(code):
+    out                     = []
+    applied                 = 0
+    for e in code:
+        if out and (not e.leader) and ((out[-1].inst, e.inst) in LOAD_STORE_PAIRS):
+            applied         += 1
+            continue
+        out.append(e)
+    return out, applied
+
+def inc_dec(code):
+    out                     = []
+    applied                 = 0
+    for e in code:
+        if out and not e.leader:
+            first           = out[-1]
+            pair            = (first.inst, e.inst)
+            if (pair in CANCELLING_PAIRS) and not first.leader:
+                out.pop()
+                applied     += 1
+                continue
+            if pair in REPLACED_PAIRS:
+                out[-1]     = Entry(REPLACED_PAIRS[pair], first.origin, first.labels, first.leader)
+                applied     += 1
+                continue
+        out.append(e)
+    return out, applied
+
+def dead_code(code):
+    out                     = []
+    applied                 = 0
+    dead                    = False
+    for e in code:
+        if e.leader:
+            dead            = False
+        if dead:
+            applied         += 1
+            continue
+        out.append(e)
+        if is_c(e.inst) and ((e.inst & JUMP_BITS) == JUMP_BITS):
+            dead            = True
+    return out, applied
+
+def jumps_to(load, entry):
+    if load.romRef:
+        return entry.origin == load.inst
+    return isinstance(load.inst, str) and (load.inst in entry.labels)
+
+def jump_to_next(code):
+    """
+    削除すると (L) に A の値が L 以外のまま着くので、(L) の先頭が A命令 (A を読まずに上書きする) のときだけ
+    """
+    out                     = []
+    applied                 = 0
+    i                       = 0
+    while i                 < len(code):
+        if i + 2            < len(code):
+            load, jump, target = code[i], code[i + 1], code[i + 2]
+            if (
+                (not load.leader) and (not jump.leader) and target.leader and
+                (not is_c(load.inst)) and is_c(jump.inst) and
+                (jump.inst & 0b111111) == JUMP_BITS and             # dest 無しの無条件ジャンプ
+                (not is_c(target.inst)) and jumps_to(load, target)
+            ):
+                applied     += 1
+                i           += 2
+                continue
+        out.append(code[i])
+        i                   += 1
+    return out, applied
+
+RULES                       = {
+    "redundant_load"        : redundant_load,
+    "push_pop"              : push_pop,
+    "load_store_pair"       : load_store_pair,
+    "inc_dec"               : inc_dec,
+    "dead_code"             : dead_code,
+    "jump_to_next"          : jump_to_next,
+}
+# 計算で求めた飛び先がラベルであるという前提が崩れると、アドレスのずれでは済まないルール (既定では使わない)
+OPT_IN_RULES                = frozenset(("dead_code",))
+
+class PeepholeReport:
+    """最適化の結果
+| attribute / method | args | description |
+| - | - | - |
+| .applied | - | ルール → 適用した回数 |
+| .wordsBefore / .wordsAfter | - | 前後の語数 |
+| .origins | - | 最適化後のアドレス → 元のアドレス array('I') |
+| .passes | - | ルールをまとめて適用した回数 |
+| .cycles | counts | 元のアドレスごとの実行命令数から (前, 後) の命令数を見積もる |
+| .lines | counts | 表示用の行のリスト (counts があれば命令数の見積もりも) |
+    """
+
+    def __init__(self, applied, wordsBefore, origins, passes):
+        self.applied        = applied
+        self.wordsBefore    = wordsBefore
+        self.wordsAfter     = len(origins)
+        self.origins        = origins
+        self.passes         = passes
+
+    def cycles(self, counts):
+        before              = sum(counts[:self.wordsBefore])
+        after               = sum(counts[origin] for origin in self.origins)
+        return before, after
+
+    def lines(self, counts = None):
+        lines               = [f"{'rule':<16} {'applied':>8}"]
+        for name, count in self.applied.items():
+            lines.append(f"{name:<16} {count:>8}")
+        saved               = self.wordsBefore - self.wordsAfter
+        lines.append(
+            f"words  {self.wordsBefore} -> {self.wordsAfter} "
+            f"(-{saved}, {100 * saved / max(self.wordsBefore, 1):.2f}%) in {self.passes} passes"
+        )
+        if counts is not None:
+            before, after   = self.cycles(counts)
+            lines.append(
+                f"cycles {before} -> {after} "
+                f"(-{before - after}, {100 * (before - after) / max(before, 1):.2f}%, estimated from the profile)"
+            )
+        return lines
+
+class PeepholeOptimizer:
+    """ピープホール最適化
+| attribute / method | args | description |
+| - | - | - |
+| .rules | - | 使うルールの名前のリスト (RULES の順、OPT_IN_RULES は enabled にあるものだけ) |
+| .optimize | program, symbols | 未解決の HackProgram を最適化し、(新しい HackProgram, PeepholeReport) を返す |
+    """
+
+    def __init__(self, disabled = (), enabled = ()):
+        unknown             = (set(disabled) | set(enabled)) - set(RULES)
+        if unknown:
+            raise ValueError(f"Unknown peephole rule : {', '.join(sorted(unknown))}")
+        self.rules          = [
+            name for name in RULES
+            if (name not in disabled) and ((name not in OPT_IN_RULES) or (name in enabled))
+        ]
+
+    def entries(self, program, symbols):
+        """
+        命令のリストにし、ラベルの位置とジャンプ命令の直前の数値の A命令の飛び先を入口にする
+        定義済みシンボル (@R3 / @SCREEN) はエンジンによらず同じになるよう数値にする (ply は構文解析で数値にしている)
+        A を値や番地としても使うかもしれない数値は付け直せないので、その番地までをすべて入口にして動かさない
+        """
+        insts               = list(program.words)
+        for symbol, indices in program.relocations.items():
+            for index in indices:
+                insts[index] = PREDEFINED_SYMBOLS.get(symbol, symbol)
+
+        labelsAt            = {}
+        for label, addr in symbols.labels.items():
+            labelsAt.setdefault(addr, []).append(label)
+        romRefs             = set()
+        leaders             = set(labelsAt)
+        pinned              = -1        # この番地までの命令は動かさない
+        for i in range(len(insts) - 1):
+            inst, jump      = insts[i], insts[i + 1]
+            if not (isinstance(inst, int) and (not is_c(inst)) and is_c(jump) and (jump & JUMP_BITS)):
+                continue
+            if is_rom_jump(jump) and falls_through_to_load(insts, i + 1):
+                romRefs.add(i)
+                leaders.add(inst)
+            elif inst       < len(insts):
+                pinned      = max(pinned, inst)
+        leaders.update(range(pinned + 1))
+
+        return [
+            Entry(inst, addr, frozenset(labelsAt.get(addr, ())), addr in leaders, addr in romRefs)
+            for addr, inst in enumerate(insts)
+        ]
+
+    def optimize(self, program, symbols):
+        code                = self.entries(program, symbols)
+        wordsBefore         = len(code)
+        applied             = {name: 0 for name in self.rules}
+        passes              = 0
+        for passes in range(1, MAX_PASSES + 1):
+            changed         = 0
+            for name in self.rules:
+                code, count = RULES[name](code)
+                applied[name]   += count
+                changed     += count
+            if not changed:
+                break
+
+        newAddr             = {e.origin: addr for addr, e in enumerate(code) if e.leader}
+
+        def relocate(addr):
+            if addr         >= wordsBefore:     # プログラムの外はプログラムの終わりからの距離を保つ
+                return min(len(code) + addr - wordsBefore, 0x7FFF)
+            return newAddr[addr]
+
+        optimized           = HackProgram()
+        # 変数は最初に参照された順にアドレスが決まるので、参照が消えた変数も元の順で残す
+        optimized.relocations   = {
+            symbol          : array("I")
+            for symbol in program.relocations if symbol not in PREDEFINED_SYMBOLS
+        }
+        for e in code:
+            optimized.append(relocate(e.inst) if e.romRef else e.inst)
+        for label, addr in symbols.labels.items():
+            symbols.labels[label]   = symbols.values[label] = relocate(addr)
+
+        report              = PeepholeReport(applied, wordsBefore, array("I", [e.origin for e in code]), passes)
+        return optimized, report
+
+def main(args):
+    parser                  = argparse.ArgumentParser(description = "Hack アセンブリのピープホール最適化")
+    parser.add_argument("source", nargs = "?", help = ".asm")
+    parser.add_argument("-o", "--output", metavar = "PATH", help = "最適化した .hack を書き出す")
+    parser.add_argument("--disable", action = "append", default = [], choices = list(RULES), metavar = "RULE", help = "使わないルール (複数指定可)")
+    parser.add_argument("--enable", action = "append", default = [], choices = sorted(OPT_IN_RULES), metavar = "RULE", help = "既定では使わないルール (dead_code) を使う")
+    parser.add_argument("--profile-cycles", type = int, default = 1000000, metavar = "N", help = "元のプログラムを N 命令実行して命令数を見積もる (0 で見積もらない)")
+    parser.add_argument("--list-rules", action = "store_true", help = "ルールの一覧を表示する")
+    options                 = parser.parse_args(args)
+
+    if options.list_rules:
+        print("\n".join(name + (" (opt-in)" if name in OPT_IN_RULES else "") for name in RULES))
+        return 0
+    if options.source is None:
+        parser.error("source is required")
+
+    with open(options.source, "r", encoding="UTF-8") as f:
+        code                = f.read()
+    start                   = time.perf_counter()
+    with HackCodeAnalyze(code, debug = False, engine = "fast", optimizer = PeepholeOptimizer(options.disable, options.enable)) as l:
+        result              = l.encode()
+        report              = l.optimizeReport
+    elapsed                 = time.perf_counter() - start
+
+    counts                  = None
+    if options.profile_cycles > 0:
+        from emulator import load_program
+        from hotspot import ProfilingMachine
+        machine             = ProfilingMachine(*load_program(options.source))
+        machine.run(options.profile_cycles)
+        counts              = machine.counts()
+
+    print("\n".join(report.lines(counts)))
+    print(f"assembled in {elapsed:.3f}s")
+    if options.output:
+        with open(options.output, "w", encoding="UTF-8") as f:
+            f.write("".join(line + "\n" for line in result.lines()))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main(argv[1:]))
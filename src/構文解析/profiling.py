@@ -0,0 +1,332 @@
+"""アセンブルのフェーズごとの計測
+| class / function | args | description |
+| - | - | - |
+| PhaseTimer | detail, memory | フェーズごとの wall / CPU 時間を記録する |
+| MemoryMeter | limit, interval | tracemalloc でフェーズごとのメモリを計り、上限を超えたら MemoryLimitExceeded を送出する |
+| format_memory | phases | メモリの計測結果を表の行のリストにする |
+| format_memory_failures | results | メモリの上限を超えたファイルごとの行のリストにする |
+| profile_call | func, *args | cProfile の下で func を実行し、(戻り値, 文法アクションごとの時間) を返す |
+| merge_phases / merge_actions | total, part | 複数ファイルの計測結果を足し合わせる |
+| total_phases | results, failed | アセンブルした (省略していない) ファイルのフェーズを合計する (failed なら失敗したファイルも) |
+| write_report | path, results, elapsed, **info | --profile の JSON レポートを書き出す |
+
+フェーズ
+| name | description |
+| - | - |
+| build | 字句・構文解析表の読み込み |
+| tokens | トークン列の作成 (get_tokens() のとき) |
+| lex | 字句解析 (detail=True のときだけ parse から分けて計る) |
+| parse | 構文解析 (fast エンジンでは表引きによる変換) |
+| resolve | シンボル解決 |
+| format | .hack の文字列への変換 (asm() のとき) |
+| write | ROM ファイルの書き出し (batch.build_file のとき) |
+"""
+
+from tracing import Tracer
+from contextlib import contextmanager, nullcontext
+import cProfile
+import json
+import os
+import pstats
+import time
+import tracemalloc
+
+ACTION_PREFIXES             = ("p_", "t_")  # 文法アクションと字句規則
+
+class PhaseTimer:
+    """フェーズごとの時間
+| attribute / method | args | description |
+| - | - | - |
+| .detail | - | True なら字句解析の時間を parse から分けて計る |
+| .phases | - | フェーズ名 → {"wall", "cpu", "calls"} |
+| .memory | - | MemoryMeter (None ならメモリは計らない) |
+| .instructions | - | 直近にアセンブルした命令数 (bytesPerInst の計算に使う) |
+| .phase | name | with 構文で囲んだ区間を name に加算する |
+| .time_lexer | lexer, name, within | lexer.token を計測付きに差し替える (detail=True のときだけ使う) |
+| .as_dict | - | JSON にできる dict を返す (内側で計ったフェーズの時間は外側から差し引く) |
+    """
+
+    def __init__(self, detail = False, memory = None):
+        self.detail         = detail
+        self.memory         = memory
+        self.phases         = {}
+        self.nested         = {}        # 内側のフェーズ → 外側のフェーズ
+        self.instructions   = 0
+
+    def add(self, name, wall, cpu, calls = 1):
+        entry               = self.phases.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+        entry["wall"]       += wall
+        entry["cpu"]        += cpu
+        entry["calls"]      += calls
+
+    @contextmanager
+    def phase(self, name):
+        with (nullcontext() if self.memory is None else self.memory.phase(name)):
+            wall            = time.perf_counter()
+            cpu             = time.process_time()
+            try:
+                yield self
+            finally:
+                self.add(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def time_lexer(self, lexer, name = "lex", within = "parse"):
+        """
+        lexer.token の呼び出しごとに時間を name に足し込む (within の区間の内側で呼ばれる)
+        インスタンスの属性で上書きするので、共有の lexer には影響しない
+        """
+        token               = lexer.token
+        clock               = time.perf_counter
+        cpuClock            = time.process_time
+        total               = self.phases.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+        self.nested[name]   = within
+
+        def timed_token():
+            wall            = clock()
+            cpu             = cpuClock()
+            tok             = token()
+            total["wall"]   += clock() - wall
+            total["cpu"]    += cpuClock() - cpu
+            total["calls"]  += 1
+            return tok
+
+        lexer.token         = timed_token
+        return lexer
+
+    def as_dict(self):
+        phases              = {name: dict(entry) for name, entry in self.phases.items()}
+        for part, name in self.nested.items():
+            if (part not in phases) or (name not in phases):
+                continue
+            for key in ("wall", "cpu"):
+                phases[name][key] = max(0.0, phases[name][key] - phases[part][key])
+        if self.memory is not None:
+            for name, entry in self.memory.as_dict(self.instructions).items():
+                phases.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0}).update(entry)
+        return phases
+
+class MemoryLimitExceeded(MemoryError):
+    """
+    メモリの上限を超えた (.phase で超えたフェーズ、.report でそれまでの計測結果が分かる)
+    """
+
+    def __init__(self, phase, used, limit, report):
+        self.phase          = phase
+        self.used           = used
+        self.limit          = limit
+        self.report         = report
+        peaks               = ", ".join([f"{name} {mib(entry['peak'])}" for name, entry in report.items()])
+        super().__init__(
+            f"{mib(used)} > limit {mib(limit)} in phase '{phase}' (peak : {peaks or '-'})"
+        )
+
+def mib(size):
+    return f"{size / (1 << 20):.1f} MiB"
+
+class MemoryMeter:
+    """tracemalloc によるフェーズごとのメモリ
+| attribute / method | args | description |
+| - | - | - |
+| .limit | - | 上限 (bytes、None なら無制限)。フェーズの終わりと interval 命令ごとに確認する |
+| .phases | - | フェーズ名 → {"peak", "allocated", "objects"} |
+| .start / .stop | - | tracemalloc を開始・終了する (with 構文で自動実行) |
+| .phase | name | with 構文で囲んだ区間のピーク、増えた bytes とブロック数を記録する |
+| .check | phase, used | used が上限を超えていれば MemoryLimitExceeded を送出する |
+| .tracer | - | 構文解析の途中で上限を確認するトレーサーを返す |
+| .as_dict | instructions | JSON にできる dict を返す (bytesPerInst を加える) |
+
+peak はフェーズ中の tracemalloc のピーク (それまでに確保していた分を含む)、
+allocated と objects はフェーズの前後で増えた bytes とメモリブロック数
+    """
+
+    def __init__(self, limit = None, interval = 4096):
+        self.limit          = limit
+        self.interval       = interval
+        self.phases         = {}
+        self.current        = None      # 計測中のフェーズ
+        self.started        = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started    = True
+        return self
+
+    def stop(self):
+        if self.started:
+            tracemalloc.stop()
+            self.started    = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @staticmethod
+    def blocks():
+        return sum([stat.count for stat in tracemalloc.take_snapshot().statistics("filename")])
+
+    @contextmanager
+    def phase(self, name):
+        outer               = self.current
+        self.current        = name
+        before              = tracemalloc.get_traced_memory()[0]
+        blocks              = self.blocks()
+        tracemalloc.reset_peak()
+        try:
+            yield self
+        finally:
+            current, peak   = tracemalloc.get_traced_memory()
+            entry           = self.phases.setdefault(name, {"peak": 0, "allocated": 0, "objects": 0})
+            entry["peak"]   = max(entry["peak"], peak)
+            entry["allocated"]  += current - before
+            entry["objects"]    += self.blocks() - blocks
+            self.current    = outer
+        self.check(name, peak)
+
+    def check(self, phase, used = None):
+        if self.limit is None:
+            return
+        if used is None:
+            used            = tracemalloc.get_traced_memory()[0]
+        if used             > self.limit:
+            raise MemoryLimitExceeded(phase, used, self.limit, self.as_dict())
+
+    def tracer(self):
+        return MemoryCheckTracer(self)
+
+    def as_dict(self, instructions = 0):
+        phases              = {name: dict(entry) for name, entry in self.phases.items()}
+        if instructions:
+            for entry in phases.values():
+                entry["bytesPerInst"] = entry["allocated"] / instructions
+        return phases
+
+class MemoryCheckTracer(Tracer):
+    """interval 命令ごとに MemoryMeter の上限を確認する"""
+
+    def __init__(self, meter):
+        self.meter          = meter
+        self.count          = 0
+
+    def event(self, kind, addr, value, lineno):
+        self.count          += 1
+        if not (self.count % self.meter.interval):
+            self.meter.check(self.meter.current or "parse")
+
+def format_memory(phases):
+    """
+    メモリの計測結果 (PhaseTimer.as_dict() か merge_phases の結果) を表の行にする
+    """
+    lines                   = [f"{'phase':<8} {'peak':>12} {'allocated':>12} {'objects':>9} {'B/inst':>8}"]
+    for name, entry in phases.items():
+        if "peak" not in entry:
+            continue
+        perInst             = entry.get("bytesPerInst")
+        lines.append(
+            f"{name:<8} {mib(entry['peak']):>12} {mib(entry['allocated']):>12} {entry['objects']:>9} "
+            f"{'-' if perInst is None else f'{perInst:.1f}':>8}"
+        )
+    return lines
+
+def format_memory_failures(results):
+    """
+    results は batch.BuildResult のリスト
+    メモリの上限を超えたファイルごとに、超えたフェーズとそこまでのピークを 1 行にする
+    """
+    prefix                  = f"{MemoryLimitExceeded.__name__}: "
+    return [
+        f"over limit  {r.file} : {r.error[len(prefix):]}"
+        for r in results
+        if (r.error or "").startswith(prefix)
+    ]
+
+def action_stats(profiler):
+    """
+    cProfile の結果から文法アクション (p_*) と字句規則 (t_*) の分だけを取り出す
+    """
+    actions                 = {}
+    for (fileName, line, funcName), (cc, nc, tt, ct, callers) in pstats.Stats(profiler).stats.items():
+        if not funcName.startswith(ACTION_PREFIXES):
+            continue
+        merge_actions(actions, {funcName: {"calls": nc, "tottime": tt, "cumtime": ct}})
+    return actions
+
+def profile_call(func, *args, **kwargs):
+    profiler                = cProfile.Profile()
+    result                  = profiler.runcall(func, *args, **kwargs)
+    return result, action_stats(profiler)
+
+def merge_phases(total, phases):
+    """
+    時間・増えたメモリは足し、ピークは最大を取る (bytesPerInst は words から求め直す)
+    """
+    for name, entry in phases.items():
+        current             = total.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+        for key, value in entry.items():
+            if key          == "peak":
+                current[key] = max(current.get(key, 0), value)
+            elif key        != "bytesPerInst":
+                current[key] = current.get(key, 0) + value
+    return total
+
+def total_phases(results, failed = False):
+    """
+    results は batch.BuildResult のリスト
+    failed なら失敗したファイル (メモリの上限を超えたものなど) の、失敗するまでのフェーズも合計に入れる
+    bytesPerInst は成功したファイルの allocated の合計を、その命令数の合計で割る
+    """
+    phases                  = {}
+    succeeded               = {}
+    words                   = 0
+    for r in results:
+        if r.skipped or ((r.error is not None) and not failed):
+            continue
+        merge_phases(phases, r.phases or {})
+        if r.error is None:
+            merge_phases(succeeded, r.phases or {})
+            words           += r.words
+    for name, entry in phases.items():
+        allocated           = succeeded.get(name, {}).get("allocated")
+        if (allocated is not None) and words:
+            entry["bytesPerInst"] = allocated / words
+    return phases
+
+def merge_actions(total, actions):
+    for name, entry in actions.items():
+        current             = total.setdefault(name, {"calls": 0, "tottime": 0.0, "cumtime": 0.0})
+        for key in ("calls", "tottime", "cumtime"):
+            current[key]    += entry[key]
+    return total
+
+def write_report(path, results, elapsed, **info):
+    """
+    results は batch.BuildResult のリスト
+    ファイルごとのフェーズ時間と、その合計 (actions は cProfile を使ったときだけ) を書き出す
+    失敗したファイルも files には載せるが、合計には入れない
+    """
+    actions                 = {}
+    files                   = []
+    for r in results:
+        merge_actions(actions, r.actions or {})
+        files.append({
+            "file"          : r.file,
+            "words"         : r.words,
+            "sec"           : r.sec,
+            "skipped"       : r.skipped,
+            "error"         : r.error,
+            "phases"        : r.phases or {},
+        })
+
+    report                  = {
+        **info,
+        "elapsed"           : elapsed,
+        "phases"            : total_phases(results),
+        "actions"           : dict(sorted(actions.items(), key = lambda item: -item[1]["tottime"])),
+        "files"             : files,
+    }
+    tmpPath                 = f"{path}.tmp"
+    with open(tmpPath, "w", encoding="UTF-8") as f:
+        json.dump(report, f, indent = 2, ensure_ascii = False)
+    os.replace(tmpPath, path)
+    return report
@@ -0,0 +1,157 @@
+"""ROM イメージの書き出し・読み込み
+| function | args | description |
+| - | - | - |
+| encode_hack | words | .hack (16bit バイナリ文字列の行) の bytes を返す |
+| encode_bin | words | ビッグエンディアン uint16 を並べた .bin の bytes を返す |
+| encode_ihex | words | Intel HEX (1 レコード 1 語、語アドレス) の bytes を返す |
+| encode_mif | words | Quartus 形式のメモリ初期化ファイル .mif の bytes を返す |
+| write_rom | base, words, formats | base.<拡張子> に各形式を 1 回の write で書き出す |
+| read_hack | path | .hack を読み込んで array('H') を返す |
+| read_bin | path | .bin を読み込んで array('H') を返す |
+| map_bin | path | .bin をメモリマップし、コピーせずに語を読む BinRom を返す |
+"""
+
+from array import array
+import mmap
+import os
+import struct
+import sys
+
+ROM_DEPTH                   = 32768     # Hack の ROM は 32K 語
+
+def to_array(words):
+    if isinstance(words, array) and (words.typecode == "H"):
+        return words
+    return array("H", words)
+
+def encode_hack(words, newline = os.linesep):
+    """
+    改行はテキストモードの print と同じく os.linesep (Windows では CRLF)
+    """
+    if not len(words):
+        return b""
+    return (newline.join([f"{word:016b}" for word in words]) + newline).encode("ascii")
+
+def encode_bin(words):
+    data                    = array("H", to_array(words))
+    if sys.byteorder        == "little":
+        data.byteswap()
+    return data.tobytes()
+
+def ihex_record(address, recordType, data):
+    record                  = bytes([len(data), address >> 8, address & 0xFF, recordType]) + data
+    checksum                = -sum(record) & 0xFF
+    return f":{record.hex().upper()}{checksum:02X}\n"
+
+def encode_ihex(words):
+    """
+    1 レコードに 1 語 (2 バイト、ビッグエンディアン) を入れ、アドレスは語単位にする
+    (Quartus などで 16bit 幅のメモリを初期化する形式)
+    """
+    data                    = encode_bin(words)
+    records                 = [
+        ihex_record(i, 0x00, data[2 * i:2 * i + 2])
+        for i in range(len(data) // 2)
+    ]
+    records.append(ihex_record(0, 0x01, b""))
+    return "".join(records).encode("ascii")
+
+def encode_mif(words, depth = ROM_DEPTH):
+    lines                   = [
+        "WIDTH=16;",
+        f"DEPTH={depth};",
+        "ADDRESS_RADIX=UNS;",
+        "DATA_RADIX=BIN;",
+        "CONTENT BEGIN",
+    ]
+    lines                   += [f"    {i} : {word:016b};" for i, word in enumerate(words)]
+    if len(words)           < depth:
+        lines.append(f"    [{len(words)}..{depth - 1}] : {0:016b};")
+    lines.append("END;")
+    return ("\n".join(lines) + "\n").encode("ascii")
+
+FORMATS                     = {         # 拡張子 : 変換関数
+    "hack"                  : encode_hack,
+    "bin"                   : encode_bin,
+    "hex"                   : encode_ihex,
+    "mif"                   : encode_mif,
+}
+
+def write_rom(
+    base,
+    words,
+    formats                 = ("hack",)
+):
+    """
+    同じ命令語から formats の各形式を base.<拡張子> に書き出し、パスのリストを返す
+    """
+    words                   = to_array(words)
+    paths                   = []
+    for ext in formats:
+        if ext not in FORMATS:
+            raise ValueError(f"Unknown format : {ext}")
+        path                = f"{base}.{ext}"
+        with open(path, "wb") as f:
+            f.write(FORMATS[ext](words))
+        paths.append(path)
+    return paths
+
+def read_hack(path):
+    with open(path, "r", encoding="UTF-8") as f:
+        return array("H", [int(line, 2) for line in f.read().split()])
+
+def read_bin(path):
+    words                   = array("H")
+    with open(path, "rb") as f:
+        words.frombytes(f.read())
+    if sys.byteorder        == "little":
+        words.byteswap()
+    return words
+
+class BinRom:
+    """.bin をメモリマップして読む ROM (読み込み時にテキストの解析もコピーもしない)
+| method | args | description |
+| - | - | - |
+| .__getitem__ | i | i 番目の語 (ビッグエンディアンをその場で読む) |
+| .__len__ | - | 語数 |
+| .to_array | - | array('H') にまとめて変換する |
+| .close | - | マップを閉じる (with 構文で自動実行) |
+    """
+
+    def __init__(self, path):
+        self.file           = open(path, "rb")
+        self.size           = os.fstat(self.file.fileno()).st_size // 2
+        self.map            = None
+        if self.size:                       # 空ファイルはマップできない
+            self.map        = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        self.unpack         = struct.Struct(">H").unpack_from
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if not (0 <= i < self.size):
+            raise IndexError(i)
+        return self.unpack(self.map, 2 * i)[0]
+
+    def to_array(self):
+        words               = array("H")
+        if self.map is not None:
+            words.frombytes(self.map[:2 * self.size])
+        if sys.byteorder    == "little":
+            words.byteswap()
+        return words
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def map_bin(path):
+    return BinRom(path)
@@ -0,0 +1,170 @@
+"""エミュレータの状態の保存と復元 (スナップショット)
+| class / function | args | description |
+| - | - | - |
+| Snapshot | buffer | スナップショットの bytes / mmap を読み、マシンに復元する |
+| encode_snapshot | machine | マシンの状態をスナップショットの bytes にする |
+| save_snapshot | machine, path | スナップショットをファイルに書き出す (一時ファイルから置き換える) |
+| load_snapshot | path, writable | ファイルを mmap して Snapshot を返す |
+| rom_hash | rom | ROM の命令語の SHA-256 |
+
+ファイルはヘッダ (64 バイト) と RAM (32K 語、リトルエンディアン) を並べただけの形式
+| offset | size | description |
+| - | - | - |
+| 0 | 8 | SNAPSHOT_MAGIC |
+| 8 | 2 | 形式の版 (SNAPSHOT_VERSION) |
+| 10 | 2 | 予約 (0) |
+| 12 | 4 | ROM の語数 |
+| 16 | 2 * 4 | A, D, PC, 予約 (0) |
+| 24 | 8 | 実行した命令数 |
+| 32 | 32 | ROM の SHA-256 (rom_hash) |
+| 64 | 65536 | RAM |
+
+- load_snapshot は書き込みをファイルに戻さない mmap (copy-on-write) で開くので、読むだけならコピーは無く、
+  .ram を書き換えた (キー入力などを変えた) ページだけがそのプロセス用にコピーされる
+- デコード済みの命令や JIT のブロックはマシンの RAM を参照しているので、restore は RAM を置き換えずに
+  バッファ 1 回のコピーで書き戻す (ROM と JIT のブロックはそのまま使える)
+- ROM が違うマシンへの復元は ValueError (ROM の SHA-256 で確かめる)
+
+```python
+save_snapshot(m, "pong.snap")
+snap = load_snapshot("pong.snap")
+for seed in range(1000):
+    snap.restore(m)                 # 1 回あたり数 μs
+    m.set_key(seed % 3 * 2 + 130)
+    m.run(100000)
+```
+
+```bash
+python emulator.py Pong.asm --skip-idle --cycles 30000000 --save-snapshot pong.snap
+python emulator.py Pong.asm --skip-idle --cycles 30000000 --load-snapshot pong.snap --save-snapshot pong.snap
+```
+"""
+
+from emulator import RAM_SIZE
+from array import array
+from sys import byteorder
+import hashlib
+import mmap
+import os
+import struct
+
+SNAPSHOT_MAGIC              = b"HACKSNAP"
+SNAPSHOT_VERSION            = 1
+HEADER                      = struct.Struct("<8sHHIHHHHQ32s")
+RAM_OFFSET                  = HEADER.size
+SNAPSHOT_SIZE               = RAM_OFFSET + 2 * RAM_SIZE
+
+def little_endian(words):
+    """
+    array('H') をリトルエンディアンの bytes にする
+    """
+    if byteorder           == "little":
+        return words.tobytes()
+    swapped                 = array("H", words)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+def rom_hash(rom):
+    return hashlib.sha256(little_endian(array("H", rom))).digest()
+
+def encode_snapshot(machine):
+    header                  = HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, len(machine.rom),
+        machine.A, machine.D, machine.pc, 0, machine.cycles, rom_hash(machine.rom)
+    )
+    return header + little_endian(machine.ram)
+
+def save_snapshot(machine, path):
+    tmpPath                 = f"{path}.tmp"
+    with open(tmpPath, "wb") as f:
+        f.write(encode_snapshot(machine))
+    os.replace(tmpPath, path)               # 書きかけのファイルで前のスナップショットを壊さない
+    return path
+
+class Snapshot:
+    """スナップショット
+| attribute / method | args | description |
+| - | - | - |
+| .A / .D / .pc / .cycles | - | 保存したときのレジスタと命令数 |
+| .romWords / .romHash | - | ROM の語数と SHA-256 |
+| .ram | - | RAM の 32K 語の memoryview (buffer が書き込めるなら書き換えられる) |
+| .matches | rom | rom がこのスナップショットの ROM と同じか |
+| .restore | machine, check | machine (HackMachine / JitMachine など) をこの状態にする |
+| .restore_batch | machine, machines | BatchMachine の machines 台目 (既定は全部) をこの状態にする |
+| .close | - | mmap を閉じる (with 構文でも閉じる) |
+    """
+
+    def __init__(self, buffer):
+        if len(buffer)      != SNAPSHOT_SIZE:
+            raise ValueError(f"Invalid snapshot size : {len(buffer)} bytes (expected {SNAPSHOT_SIZE})")
+        magic, version, _, self.romWords, self.A, self.D, self.pc, _, self.cycles, self.romHash = HEADER.unpack_from(buffer)
+        if magic            != SNAPSHOT_MAGIC:
+            raise ValueError("Not a Hack snapshot")
+        if version          != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version : {version}")
+
+        self.buffer         = buffer
+        self.data           = memoryview(buffer)[RAM_OFFSET:]
+        self.ram            = self.data.cast("H")
+        self.checked        = None          # 直前に確かめた ROM の bytes
+
+    def matches(self, rom):
+        """
+        直前に確かめた ROM と同じ内容なら SHA-256 を計算し直さない (write_rom で書き換えた ROM は計算し直す)
+        """
+        words               = array("H", rom).tobytes()
+        if words            == self.checked:
+            return True
+        if (len(rom) != self.romWords) or (rom_hash(rom) != self.romHash):
+            return False
+        self.checked        = words
+        return True
+
+    def restore(self, machine, check = True):
+        if check and not self.matches(machine.rom):
+            raise ValueError("Snapshot was taken with a different ROM")
+        ram                 = memoryview(machine.ram).cast("B")
+        ram[:]              = self.data
+        if byteorder        == "big":
+            machine.ram.byteswap()
+        machine.A, machine.D, machine.pc = self.A, self.D, self.pc
+        machine.cycles      = self.cycles
+        return machine
+
+    def restore_batch(self, machine, machines = slice(None)):
+        """
+        BatchMachine の ROM は 32K 語に 0 を詰めてあるので、詰めた部分が 0 であることも確かめる
+        命令数は全マシンで共通なので、全部を復元したときだけ .cycles も戻す
+        """
+        import numpy as np
+        rom                 = machine.rom
+        if rom[self.romWords:].any() or not self.matches(array("H", rom[:self.romWords].tobytes())):
+            raise ValueError("Snapshot was taken with a different ROM")
+        machine.ram[machines] = np.frombuffer(self.data, dtype = "<u2")
+        machine.A[machines] = self.A
+        machine.D[machines] = self.D
+        machine.pc[machines] = self.pc
+        if isinstance(machines, slice) and (machines == slice(None)):
+            machine.cycles  = self.cycles
+        return machine
+
+    def close(self):
+        self.ram.release()
+        self.data.release()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def load_snapshot(path, writable = True):
+    """
+    writable なら copy-on-write (ACCESS_COPY)、そうでなければ読み込み専用 (ACCESS_READ) で mmap する
+    どちらもファイルには書き戻さず、書き換えていないページは他のプロセスとページキャッシュを共有する
+    """
+    with open(path, "rb") as f:
+        buffer              = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_COPY if writable else mmap.ACCESS_READ)
+    return Snapshot(buffer)
@@ -0,0 +1,151 @@
+"""ROM アドレス → ソースの位置の対応表 (ソースマップ)
+| class / function | args | description |
+| - | - | - |
+| SourceMap | file, lines, labels, variables | アドレスごとの行と、ラベル・変数のアドレスを持つ対応表 |
+| SourceMapTracer | - | アセンブル中のイベントから命令ごとの行とラベルを記録するトレーサー |
+| build_source_map | code, file | code を fast エンジンでアセンブルし、SourceMap を返す |
+| collect_source_map | analyzer, tracer, file | tracer を付けてアセンブルし終えた HackCodeAnalyze から SourceMap を作る |
+| load_source_map | path | .asm ならアセンブルして、それ以外はソースマップの JSON を読み込んで返す |
+
+命令のアドレスと行は tracing のイベント (addr, lineno)、変数は直近のアセンブルの varTable から作る
+batch.py はビルドに使う HackCodeAnalyze に SourceMapTracer を付け、書き出した .hack と同じアセンブルから作る
+(イベントの行はどちらのエンジンでも命令の行なので、ply でも fast でも同じソースマップになる)
+
+JSON (batch.py --source-map で build/<名前>.map.json に書き出す)
+| key | description |
+| - | - |
+| version | 形式の版 (SOURCE_MAP_VERSION) |
+| file | ソースのファイル名 |
+| lines | アドレス → 行番号 (1 から) のリスト |
+| labels | ラベル → アドレス |
+| variables | 変数 → RAM のアドレス |
+
+```python
+sourceMap = load_source_map("Pong.asm")
+sourceMap.lookup(8743)   # SourceLocation(file='Pong.asm', line=..., label='RET_ADDRESS_LT26', offset=0)
+```
+"""
+
+from asm import PREDEFINED_SYMBOLS, HackCodeAnalyze
+from tracing import Tracer
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+import json
+import os
+
+SOURCE_MAP_VERSION          = 1
+
+# offset はラベルからの命令数 (label が None ならアドレスそのもの)
+SourceLocation              = namedtuple("SourceLocation", "file line label offset")
+
+class SourceMap:
+    """ソースマップ
+| attribute / method | args | description |
+| - | - | - |
+| .file | - | ソースのファイル名 |
+| .lines | - | アドレス → 行番号 array('I') |
+| .labels | - | ラベル → アドレス |
+| .variables | - | 変数 → RAM のアドレス |
+| .lookup | addr | SourceLocation (ROM の外なら line は 0) を返す |
+| .label_at | addr | addr 以前で最も近いラベルと、そこからの命令数を返す |
+| .to_dict / .from_dict | - | JSON にできる dict との変換 |
+| .encode / .save / .load | path | JSON の bytes への変換、ファイルへの書き出し・読み込み |
+    """
+
+    def __init__(self, file, lines, labels, variables = None):
+        self.file           = file
+        self.lines          = array("I", lines)
+        self.labels         = dict(labels)
+        self.variables      = dict(variables or {})
+
+        # 同じアドレスのラベルは後に定義したもの (命令の直前に書かれたもの) を使う
+        byAddr              = {}
+        for label, addr in self.labels.items():
+            byAddr[addr]    = label
+        self.labelAddrs     = sorted(byAddr)
+        self.labelNames     = [byAddr[addr] for addr in self.labelAddrs]
+
+    def __len__(self):
+        return len(self.lines)
+
+    def label_at(self, addr):
+        i                   = bisect_right(self.labelAddrs, addr) - 1
+        if i                < 0:
+            return None, addr
+        return self.labelNames[i], addr - self.labelAddrs[i]
+
+    def lookup(self, addr):
+        line                = self.lines[addr] if addr < len(self.lines) else 0
+        label, offset       = self.label_at(addr)
+        return SourceLocation(self.file, line, label, offset)
+
+    def to_dict(self):
+        return {
+            "version"       : SOURCE_MAP_VERSION,
+            "file"          : self.file,
+            "lines"         : self.lines.tolist(),
+            "labels"        : self.labels,
+            "variables"     : self.variables,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("version") != SOURCE_MAP_VERSION:
+            raise ValueError(f"Unsupported source map version : {data.get('version')}")
+        return cls(data["file"], data["lines"], data["labels"], data["variables"])
+
+    def encode(self):
+        return json.dumps(self.to_dict(), separators = (",", ":")).encode("UTF-8")
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.encode())
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="UTF-8") as f:
+            return cls.from_dict(json.load(f))
+
+class SourceMapTracer(Tracer):
+    """A / C命令のイベントの行をアドレス順に、L命令のイベントをラベルとして記録する"""
+
+    def __init__(self):
+        self.lines          = array("I")
+        self.labels         = {}
+
+    def event(self, kind, addr, value, lineno):
+        if kind             == "L":
+            self.labels.pop(value, None)    # 定義し直したラベルは後の定義の順にする
+            self.labels[value] = addr
+            return
+        while len(self.lines) < addr:       # 念のため (アドレスは 1 つずつ増える)
+            self.lines.append(0)
+        if len(self.lines)  == addr:
+            self.lines.append(lineno)
+        else:
+            self.lines[addr] = lineno
+
+def collect_source_map(analyzer, tracer, file = "<string>"):
+    """
+    analyzer は tracer (SourceMapTracer) を付けて encode / asm を終えた HackCodeAnalyze
+    """
+    variables               = {
+        symbol              : addr
+        for symbol, addr in analyzer.varTable.items()
+        if (symbol not in PREDEFINED_SYMBOLS) and (symbol not in analyzer.labels)
+    }
+    return SourceMap(file, tracer.lines, tracer.labels, variables)
+
+def build_source_map(code, file = "<string>"):
+    tracer                  = SourceMapTracer()
+    with HackCodeAnalyze(code, debug = False, engine = "fast", tracer = tracer) as l:
+        l.encode()
+        return collect_source_map(l, tracer, file)
+
+def load_source_map(path):
+    if os.path.splitext(path)[1].lower() == ".asm":
+        with open(path, "r", encoding="UTF-8") as source:
+            return build_source_map(source.read(), os.path.basename(path))
+    return SourceMap.load(path)
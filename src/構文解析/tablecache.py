@@ -0,0 +1,110 @@
+"""PLY の字句・構文解析表のキャッシュ (asm.py と ../字句解析/sample.py で共有する)
+| function | args | description |
+| - | - | - |
+| table_dir | - | 表の保存先 (環境変数 HACKASM_CACHE で変更可能) |
+| grammar_hash | module | トークン定義と文法規則から求めたハッシュ (表のファイル名に使う) |
+| load_table | tabName, path | 保存した字句解析表 (.py) をモジュールとして読み込む |
+| cached_lexer | module, name | 字句解析表をキャッシュから読み込んで lexer を作る |
+| cached_parser | module, name | 構文解析表 (.pickle) をキャッシュから読み込んで parser を作る |
+| cached_build | module, name | (lexer, parser) を返す |
+
+表は <table_dir>/<name>_lextab_<hash>.py と <name>_parsetab_<hash>.pickle に保存し、
+規則を変更するとハッシュが変わって別の表として生成し直される
+生成は一時ディレクトリで行ってから置き換えるので、並列に起動しても書きかけの表は読まれない
+"""
+
+from ply import lex, yacc
+import hashlib
+import importlib.util
+import os
+import tempfile
+
+def table_dir():
+    """
+    生成した字句・構文解析表の保存先 (環境変数 HACKASM_CACHE で変更可能)
+    """
+    cacheHome                   = os.environ.get(
+        "XDG_CACHE_HOME",
+        os.path.join(os.path.expanduser("~"), ".cache")
+    )
+    return os.environ.get("HACKASM_CACHE", os.path.join(cacheHome, "hackasm"))
+
+def grammar_hash(module):
+    """
+    トークン定義と文法規則 (t_*, p_*, tokens) から求めたハッシュ
+    規則を変更すると別の表として生成し直される
+    """
+    digest                      = hashlib.sha256(
+        f"{lex.__version__} {yacc.__tabversion__}".encode()
+    )
+    for name in sorted(dir(module)):
+        if not (name.startswith(("t_", "p_")) or (name == "tokens")):
+            continue
+        value                   = getattr(module, name)
+        if callable(value):
+            value               = value.__doc__
+        digest.update(f"{name}={value!r}\n".encode())
+    return digest.hexdigest()[:16]
+
+def load_table(tabName, path):
+    spec                        = importlib.util.spec_from_file_location(tabName, path)
+    table                       = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(table)
+    return table
+
+def cached_lexer(module, name):
+    """
+    最適化済みの字句解析表をキャッシュから読み込んで lexer を作る
+    (キャッシュが無ければ生成して保存する)
+    """
+    tabName                     = f"{name}_lextab_{grammar_hash(module)}"
+    path                        = os.path.join(table_dir(), f"{tabName}.py")
+    if os.path.exists(path):
+        return lex.lex(
+            module              = module,
+            optimize            = True,
+            lextab              = load_table(tabName, path)
+        )
+
+    os.makedirs(table_dir(), exist_ok = True)
+    with tempfile.TemporaryDirectory(dir = table_dir()) as tmp:
+        lexer                   = lex.lex(
+            module              = module,
+            optimize            = True,
+            lextab              = tabName,
+            outputdir           = tmp
+        )
+        os.replace(os.path.join(tmp, f"{tabName}.py"), path)
+    return lexer
+
+def cached_parser(module, name):
+    """
+    LALR 構文解析表を pickle のキャッシュから読み込んで parser を作る
+    (キャッシュが無ければ生成して保存する。parser.out は出力しない)
+    """
+    tabName                     = f"{name}_parsetab_{grammar_hash(module)}"
+    path                        = os.path.join(table_dir(), f"{tabName}.pickle")
+    if os.path.exists(path):
+        return yacc.yacc(
+            module              = module,
+            picklefile          = path,
+            debug               = False,
+            write_tables        = False
+        )
+
+    os.makedirs(table_dir(), exist_ok = True)
+    with tempfile.TemporaryDirectory(dir = table_dir()) as tmp:   # 書きかけの表を読まれないように
+        tmpPath                 = os.path.join(tmp, f"{tabName}.pickle")
+        parser                  = yacc.yacc(
+            module              = module,
+            picklefile          = tmpPath,
+            debug               = False
+        )
+        os.replace(tmpPath, path)
+    return parser
+
+def cached_build(module, name):
+    """
+    字句解析表と構文解析表をキャッシュから読み込んで (lexer, parser) を作る
+    """
+    return cached_lexer(module, name), cached_parser(module, name)
@@ -0,0 +1,495 @@
+"""nand2tetris の CPUEmulator のテストスクリプト (.tst) と比較ファイル (.cmp) の実行
+| class / function | args | description |
+| - | - | - |
+| parse_script | text | .tst を命令のリストにする (repeat / while はブロックを持つ) |
+| OutputColumn | name, kind, left, width, right | output-list の 1 列 (RAM[0]%D2.6.2 など) |
+| ScriptRunner | path, engine, jit, maxCycles, writeOutput | 1 つの .tst を実行し、出力を .cmp と 1 行ずつ比べる |
+| collect_scripts | paths | ファイル・ディレクトリ (下の階層も含む)・glob から .tst の一覧を作る |
+| run_script | path, engine, jit, maxCycles, writeOutput | 1 つの .tst を実行して ScriptResult を返す |
+| run_all | files, jobs, engine, jit, maxCycles, writeOutput | プロセスプールで並列に実行する |
+| main | args | コマンドライン (スクリプトごとの時間と結果を表示する) |
+
+対応している命令 (CPUEmulator の命令のうち CPU のテストに使うもの)
+| command | description |
+| - | - |
+| load FILE | プログラムを読み込む (同名の .asm があれば HackCodeAnalyze でアセンブルし、無ければ .hack / .bin) |
+| output-file FILE / compare-to FILE | 出力ファイルと比較ファイル (.tst からの相対パス) |
+| output-list VAR%Fl.w.r ... | 出力する変数と書式 (F は D / X / B / S、書式を省略すると %B1.16.1) |
+| set VAR VALUE | RAM[n] / A / D / PC に値 (10 進、%X 16 進、%B 2 進、%D 10 進) を入れる |
+| tick / tock / ticktock | クロックの前半 / 後半 / 1 周期 (tock と ticktock で 1 命令実行し、time を 1 進める) |
+| output | 出力の 1 行を書き、.cmp の同じ行と比べる (* は任意の 1 文字) |
+| repeat N { ... } / while VAR OP VALUE { ... } | 繰り返し (OP は = <> < > <= >=) |
+| echo / clear-echo / breakpoint / clear-breakpoints | 何もしない |
+
+- 変数は A / D / PC / RAM[n] / ROM[n] / time、%D は 16bit の符号付きで表示する
+- time は load からのクロック数 (tock の回数)。tick の後で tock の前は %S で N+ と表示する
+- 中身が tick / tock / ticktock だけの repeat は、まとめて 1 回の run で実行する (JIT のブロックがそのまま使える)
+- 比較は CPUEmulator と同じく最初に食い違った行で失敗にする
+- tick / tock / ticktock も set も含まない while は条件が変わらないので、構文の誤りにする
+  (while の繰り返しの回数も命令数と同じ上限 maxCycles で止める)
+
+```bash
+python testscript.py projects/04 projects/06 -j 8
+python testscript.py Max.tst --interpret --no-output-file
+```
+"""
+
+from asm import HackCodeAnalyze
+from emulator import HackMachine, load_rom
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from sys import argv, exit
+import argparse
+import glob
+import os
+import re
+import time
+
+MAX_CYCLES                  = 100000000     # 1 スクリプトで実行する命令数の上限 (終わらない while を止める)
+DEFAULT_FORMAT              = ("B", 1, 16, 1)
+TICK_COMMANDS               = {"tick": 0, "tock": 1, "ticktock": 1}    # → 実行する命令数 (進むクロック数)
+SIGNED_VARIABLES            = frozenset(("RAM", "ROM", "A", "D"))
+IGNORED_COMMANDS            = frozenset(("echo", "clear-echo", "breakpoint", "clear-breakpoints"))
+CONDITIONS                  = {
+    "="                     : lambda x, y: x == y,
+    "<>"                    : lambda x, y: x != y,
+    "<"                     : lambda x, y: x < y,
+    ">"                     : lambda x, y: x > y,
+    "<="                    : lambda x, y: x <= y,
+    ">="                    : lambda x, y: x >= y,
+}
+TOKEN                       = re.compile(r'"[^"]*"|[{},;]|[^\s{},;"]+')
+VARIABLE                    = re.compile(r"^(RAM|ROM)\[(\d+)\]$|^(A|D|PC|time)$")
+COLUMN                      = re.compile(r"^(.+?)(?:%([DXBS])(\d+)\.(\d+)\.(\d+))?$")
+
+# スクリプト 1 つの結果 (成功時の error は None)
+# lines は出力した行数 (ヘッダを含む)、cycles は実行した命令数
+ScriptResult                = namedtuple("ScriptResult", "file error lines cycles sec")
+
+class ScriptError(Exception):
+    """
+    解釈できないテストスクリプト
+    """
+
+OutputColumn                = namedtuple("OutputColumn", "name kind left width right")
+
+def parse_value(text):
+    """
+    16bit に丸めた値を返す (-1 は 0xFFFF)
+    """
+    try:
+        if text.startswith("%X"):
+            value           = int(text[2:], 16)
+        elif text.startswith("%B"):
+            value           = int(text[2:], 2)
+        elif text.startswith("%D"):
+            value           = int(text[2:])
+        else:
+            value           = int(text)
+    except ValueError:
+        raise ScriptError(f"Invalid value : {text}")
+    return value & 0xFFFF
+
+def parse_variable(text):
+    match                   = VARIABLE.match(text)
+    if match is None:
+        raise ScriptError(f"Unknown variable : {text}")
+    if match.group(1):
+        return match.group(1), int(match.group(2))
+    return match.group(3), None
+
+def parse_column(text):
+    match                   = COLUMN.match(text)
+    name                    = match.group(1)
+    parse_variable(name)
+    if match.group(2) is None:
+        return OutputColumn(name, *DEFAULT_FORMAT)
+    return OutputColumn(name, match.group(2), int(match.group(3)), int(match.group(4)), int(match.group(5)))
+
+def make_command(words):
+    name, args              = words[0], words[1:]
+    if name in TICK_COMMANDS:
+        return (name,)
+    if name in IGNORED_COMMANDS:
+        return ("echo",)
+    if name                 == "output":
+        return ("output",)
+    if name in ("load", "output-file", "compare-to"):
+        return (name, args[0] if args else None)
+    if name                 == "output-list":
+        return (name, [parse_column(arg) for arg in args])
+    if name                 == "set":
+        if len(args)        != 2:
+            raise ScriptError(f"set needs a variable and a value : {' '.join(words)}")
+        return (name, parse_variable(args[0]), parse_value(args[1]))
+    raise ScriptError(f"Unknown command : {name}")
+
+def changes_state(body):
+    """
+    body (入れ子の repeat / while を含む) がマシンの状態を変える命令 (tick / tock / ticktock / set) を含むか
+    """
+    for command in body:
+        if (command[0] in TICK_COMMANDS) or (command[0] == "set"):
+            return True
+        if (command[0] in ("repeat", "while")) and changes_state(command[-1]):
+            return True
+    return False
+
+def make_loop(words, body):
+    if (words[0] == "repeat") and (len(words) == 2):
+        return ("repeat", int(words[1]), body)
+    if (words[0] == "while") and (len(words) == 4) and (words[2] in CONDITIONS):
+        if not changes_state(body):
+            raise ScriptError(f"while loop without tick / tock / set never ends : {' '.join(words)}")
+        return ("while", parse_variable(words[1]), words[2], parse_value(words[3]), body)
+    raise ScriptError(f"Invalid loop : {' '.join(words)}")
+
+def parse_block(tokens, pos, closing):
+    commands                = []
+    words                   = []
+    while pos               < len(tokens):
+        token               = tokens[pos]
+        pos                 += 1
+        if token in (",", ";"):
+            if words:
+                commands.append(make_command(words))
+            words           = []
+        elif token          == "{":
+            if not words:
+                raise ScriptError("Block without repeat / while")
+            body, pos       = parse_block(tokens, pos, True)
+            commands.append(make_loop(words, body))
+            words           = []
+        elif token          == "}":
+            if not closing:
+                raise ScriptError("Unexpected }")
+            if words:
+                commands.append(make_command(words))
+            return commands, pos
+        else:
+            words.append(token)
+    if closing:
+        raise ScriptError("Missing }")
+    if words:
+        commands.append(make_command(words))
+    return commands, pos
+
+def parse_script(text):
+    text                    = re.sub(r"/\*.*?\*/", " ", text, flags = re.S)
+    text                    = re.sub(r"//[^\n]*", "", text)
+    return parse_block(TOKEN.findall(text), 0, False)[0]
+
+def tick_count(body):
+    """
+    中身が tick / tock / ticktock だけならその命令数、それ以外は None
+    """
+    if all(command[0] in TICK_COMMANDS for command in body):
+        return sum(TICK_COMMANDS[command[0]] for command in body)
+    return None
+
+def signed(variable, value):
+    """
+    16bit の変数 (RAM / ROM / A / D) は 0x8000 以上を負の数にする (PC と time はそのまま)
+    """
+    if (variable[0] in SIGNED_VARIABLES) and (value & 0x8000):
+        return value - 0x10000
+    return value
+
+def format_cell(column, value, halfCycle = False):
+    """
+    value は符号なしの値 (%D のときだけ符号付きにする)
+    halfCycle は time を tick と tock の間で出力するとき (%S では N+ にする)
+    """
+    if column.kind          == "D":
+        text                = str(signed(parse_variable(column.name), value)).rjust(column.width)
+    elif column.kind        == "X":
+        text                = f"{value:0{column.width}X}"[-column.width:]
+    elif column.kind        == "B":
+        text                = f"{value:0{column.width}b}"[-column.width:]
+    else:
+        text                = (str(value) + ("+" if halfCycle else "")).ljust(column.width)
+    return " " * column.left + text + " " * column.right
+
+def format_header(column):
+    total                   = column.left + column.width + column.right
+    name                    = column.name[:total]
+    left                    = (total - len(name)) // 2
+    return " " * left + name + " " * (total - len(name) - left)
+
+def matches(line, expected):
+    return (len(line) == len(expected)) and all(e in ("*", c) for c, e in zip(line, expected))
+
+class ScriptRunner:
+    """1 つの .tst の実行
+| attribute / method | args | description |
+| - | - | - |
+| .machine | - | load で作ったマシン (JitMachine か HackMachine) |
+| .time / .halfCycle | - | load からのクロック数と、tick の後で tock の前か |
+| .lines | - | 出力した行 (ヘッダを含む) |
+| .expected | - | .cmp の行 (compare-to が無ければ None) |
+| .run | - | スクリプトを最後まで実行する (食い違いは ScriptError) |
+    """
+
+    programs                = {}            # (パス, 更新時刻, エンジン) → 命令語 (同じワーカーで同じプログラムを読み直さない)
+
+    def __init__(self, path, engine = "fast", jit = True, maxCycles = MAX_CYCLES, writeOutput = True):
+        self.path           = path
+        self.directory      = os.path.dirname(path)
+        self.engine         = engine
+        self.jit            = jit
+        self.maxCycles      = maxCycles
+        self.writeOutput    = writeOutput
+        self.machine        = None
+        self.time           = 0
+        self.halfCycle      = False
+        self.columns        = []
+        self.lines          = []
+        self.expected       = None
+        self.outputPath     = None
+
+    def load_words(self, name):
+        """
+        同名の .asm があればアセンブルし (.hack は別のアセンブラの出力の場合があるので、このアセンブラで作り直す)、
+        無ければ .hack / .bin を読む
+        """
+        path                = os.path.join(self.directory, name)
+        source              = os.path.splitext(path)[0] + ".asm"
+        if os.path.exists(source):
+            path            = source
+        key                 = (path, os.path.getmtime(path), self.engine)
+        if key not in self.programs:
+            if path.endswith(".asm"):
+                with open(path, "r", encoding="UTF-8") as f:
+                    with HackCodeAnalyze(f.read(), debug = False, engine = self.engine) as l:
+                        self.programs[key] = l.encode().words
+            else:
+                self.programs[key] = load_rom(path)
+        return self.programs[key]
+
+    def load(self, name):
+        if name is None:
+            name            = os.path.splitext(os.path.basename(self.path))[0] + ".hack"
+        words               = self.load_words(name)
+        if self.jit:
+            from jit import JitMachine
+            self.machine    = JitMachine(words)
+        else:
+            self.machine    = HackMachine(words)
+        self.time           = 0
+        self.halfCycle      = False
+
+    def get(self, variable):
+        name, index         = variable
+        m                   = self.require_machine()
+        if name             == "RAM":
+            return m.ram[index]
+        if name             == "ROM":
+            return m.rom[index] if index < len(m.rom) else 0
+        if name             == "time":
+            return self.time
+        return {"A": m.A, "D": m.D, "PC": m.pc}[name]
+
+    def get_signed(self, variable):
+        return signed(variable, self.get(variable))
+
+    def set(self, variable, value):
+        name, index         = variable
+        m                   = self.require_machine()
+        if name             == "RAM":
+            m.ram[index]    = value
+        elif name           == "A":
+            m.A             = value
+        elif name           == "D":
+            m.D             = value
+        elif name           == "PC":
+            m.pc            = value & 0x7FFF
+        else:
+            raise ScriptError(f"Can not set {name}")
+
+    def require_machine(self):
+        if self.machine is None:
+            raise ScriptError("No program is loaded")
+        return self.machine
+
+    def tick(self, cycles, halfCycle = False):
+        """
+        cycles 命令実行してクロックを cycles 進め、最後の命令が tick なら halfCycle にする
+        """
+        m                   = self.require_machine()
+        if m.cycles + cycles > self.maxCycles:
+            raise ScriptError(f"Cycle limit exceeded : {self.maxCycles}")
+        m.run(cycles)
+        self.time           += cycles
+        self.halfCycle      = halfCycle
+
+    def emit(self, line):
+        self.lines.append(line)
+        if self.expected is None:
+            return
+        index               = len(self.lines) - 1
+        if index            >= len(self.expected):
+            raise ScriptError(f"Comparison failure at line {index + 1} : no more lines in the compare file")
+        if not matches(line, self.expected[index]):
+            raise ScriptError(
+                f"Comparison failure at line {index + 1}\n"
+                f"  expected : {self.expected[index]}\n"
+                f"  actual   : {line}"
+            )
+
+    def execute(self, commands):
+        for command in commands:
+            name            = command[0]
+            if name in TICK_COMMANDS:
+                self.tick(TICK_COMMANDS[name], name == "tick")
+            elif name       == "output":
+                self.emit("|" + "|".join(
+                    format_cell(c, self.get(parse_variable(c.name)), self.halfCycle and (c.name == "time"))
+                    for c in self.columns
+                ) + "|")
+            elif name       == "set":
+                self.set(command[1], command[2])
+            elif name       == "repeat":
+                count       = tick_count(command[2])
+                if count is not None:
+                    if command[1] and command[2]:
+                        self.tick(command[1] * count, command[2][-1][0] == "tick")
+                else:
+                    for _ in range(command[1]):
+                        self.execute(command[2])
+            elif name       == "while":
+                _, variable, op, value, body = command
+                value       = signed(variable, value)
+                iterations  = 0
+                while CONDITIONS[op](self.get_signed(variable), value):
+                    iterations  += 1
+                    if iterations > self.maxCycles:
+                        raise ScriptError(f"Loop limit exceeded : {self.maxCycles} iterations")
+                    self.execute(body)
+            elif name       == "load":
+                self.load(command[1])
+            elif name       == "output-file":
+                self.outputPath = os.path.join(self.directory, command[1])
+            elif name       == "compare-to":
+                with open(os.path.join(self.directory, command[1]), "r", encoding="UTF-8") as f:
+                    self.expected = [line.rstrip("\r\n") for line in f if line.strip()]
+            elif name       == "output-list":
+                self.columns    = command[1]
+                self.emit("|" + "|".join(format_header(c) for c in self.columns) + "|")
+
+    def run(self):
+        with open(self.path, "r", encoding="UTF-8") as f:
+            commands        = parse_script(f.read())
+        try:
+            self.execute(commands)
+        finally:
+            if self.writeOutput and self.outputPath:
+                with open(self.outputPath, "w", encoding="UTF-8") as f:
+                    f.write("".join(line + "\n" for line in self.lines))
+        return self
+
+def collect_scripts(paths):
+    """
+    ディレクトリは下の階層も含めた *.tst、glob は一致したファイルに展開する (重複は除き、指定順を保つ)
+    """
+    files                   = []
+    for path in paths:
+        if os.path.isdir(path):
+            found           = sorted(glob.glob(os.path.join(path, "**", "*.tst"), recursive = True))
+        elif os.path.exists(path):
+            found           = [path]
+        else:
+            found           = sorted(glob.glob(path, recursive = True))
+            if not found:
+                raise FileNotFoundError(f"No such file or pattern : {path}")
+        files               += [f for f in found if os.path.isfile(f) and f not in files]
+    return files
+
+def run_script(path, engine = "fast", jit = True, maxCycles = MAX_CYCLES, writeOutput = True):
+    start                   = time.perf_counter()
+    runner                  = ScriptRunner(path, engine, jit, maxCycles, writeOutput)
+    error                   = None
+    try:
+        runner.run()
+    except Exception as e:
+        error               = str(e) if isinstance(e, ScriptError) else f"{type(e).__name__}: {e}"
+    cycles                  = runner.machine.cycles if runner.machine is not None else 0
+    return ScriptResult(path, error, len(runner.lines), cycles, time.perf_counter() - start)
+
+def warm_up(engine):
+    """
+    ワーカープロセスの起動時にアセンブラの表を読み込んでおく
+    """
+    HackCodeAnalyze(debug = False, engine = engine).build()
+
+def run_all(files, jobs = None, engine = "fast", jit = True, maxCycles = MAX_CYCLES, writeOutput = True):
+    """
+    jobs 個のワーカーで並列に実行し、ScriptResult を files の順で返す (jobs が 1 ならこのプロセスで順に)
+    """
+    n                       = len(files)
+    if (jobs == 1) or (n <= 1):
+        warm_up(engine)
+        return [run_script(f, engine, jit, maxCycles, writeOutput) for f in files]
+
+    jobs                    = jobs or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers = jobs, initializer = warm_up, initargs = (engine,)) as pool:
+        return list(pool.map(
+            run_script,
+            files,
+            [engine] * n,
+            [jit] * n,
+            [maxCycles] * n,
+            [writeOutput] * n,
+            chunksize       = max(1, n // (jobs * 4))  # 短いスクリプトが多いときの往復を減らす
+        ))
+
+def print_summary(results, elapsed):
+    width                   = max([len(r.file) for r in results] + [4])
+    print(f"{'file':<{width}} {'lines':>6} {'cycles':>12} {'sec':>8}  status")
+    for r in sorted(results, key = lambda r: -r.sec):
+        status              = "ok" if r.error is None else r.error.replace("\n", "\n" + " " * (width + 31))
+        print(f"{r.file:<{width}} {r.lines:>6} {r.cycles:>12} {r.sec:>8.3f}  {status}")
+
+    failed                  = sum([1 for r in results if r.error is not None])
+    cycles                  = sum([r.cycles for r in results])
+    print(
+        f"{len(results)} scripts, {failed} failed, {cycles} cycles "
+        f"in {elapsed:.3f}s ({sum([r.sec for r in results]):.3f}s in scripts)"
+    )
+    return failed
+
+def main(args):
+    parser                  = argparse.ArgumentParser(
+        description         = "nand2tetris の CPUEmulator のテストスクリプト (.tst) を実行し、.cmp と比べる"
+    )
+    parser.add_argument("scripts", nargs = "*", default = ["."], help = ".tst・ディレクトリ (下の階層も探す)・glob")
+    parser.add_argument("-j", "--jobs", type = int, default = None, help = "ワーカー数 (既定は CPU 数)")
+    parser.add_argument("--engine", choices = ("ply", "fast"), default = "fast", help = "アセンブラのエンジン")
+    parser.add_argument("--interpret", action = "store_true", help = "JIT を使わずに 1 命令ずつ実行する")
+    parser.add_argument("--max-cycles", type = int, default = MAX_CYCLES, help = "1 スクリプトの命令数の上限")
+    parser.add_argument("--no-output-file", action = "store_true", help = "output-file (.out) を書き出さない")
+    options                 = parser.parse_args(args)
+
+    try:
+        files               = collect_scripts(options.scripts)
+    except FileNotFoundError as e:
+        print(e)
+        return 2
+    if not files:
+        print("No test scripts found")
+        return 2
+
+    start                   = time.perf_counter()
+    results                 = run_all(
+        files,
+        jobs                = options.jobs,
+        engine              = options.engine,
+        jit                 = not options.interpret,
+        maxCycles           = options.max_cycles,
+        writeOutput         = not options.no_output_file
+    )
+    failed                  = print_summary(results, time.perf_counter() - start)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    exit(main(argv[1:]))
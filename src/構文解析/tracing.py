@@ -0,0 +1,165 @@
+"""構文解析のトレース
+| class / function | args | description |
+| - | - | - |
+| Tracer | - | トレーサーの基底クラス (event を上書きする) |
+| PrintTracer | - | debug=True のときに使う、命令ごとに print するトレーサー |
+| LoggingTracer | logger, level | logging にイベントを出力する |
+| CountingTracer | - | 命令の種類ごとの数を数える |
+| RingTracer | size | 直近 size 件のイベントを配列のリングバッファに記録する (I/O なし) |
+| MultiTracer | *tracers | 複数のトレーサーにイベントを配る |
+| trace_productions | productions, tracer | 文法アクションを tracer を呼ぶものに差し替えた複製を返す |
+
+イベントは event(kind, addr, value, lineno) で通知される
+| kind | addr | value |
+| - | - | - |
+| "A" | 命令のアドレス | 命令語 (int、定数名も値になる) かシンボル名 (str) |
+| "C" | 命令のアドレス | 命令語 (int) |
+| "L" | ラベルが指すアドレス | ラベル名 |
+
+lineno は命令の行 (ply エンジンはトレースするときだけ位置を記録しながら構文解析する)
+
+トレーサーを付けないときは文法アクションも fast エンジンのループも元のままで、
+トレースのための分岐は一切通らない
+
+```python
+counter = CountingTracer()
+with HackCodeAnalyze(code, tracer = counter) as l:
+    l.asm()
+counter.counts      # Pong.asm なら {"A": 9492, "C": 17991, "L": 882}
+```
+"""
+
+from array import array
+import copy
+import logging
+
+KINDS                       = ("A", "C", "L")
+
+class Tracer:
+    """トレーサーの基底クラス
+| method | args | description |
+| - | - | - |
+| .event | kind, addr, value, lineno | 命令 1 つごとに呼ばれる |
+    """
+
+    def event(self, kind, addr, value, lineno):
+        pass
+
+class PrintTracer(Tracer):
+    """従来の debug 出力と同じ内容を print する"""
+
+    MESSAGES                = {
+        "A"                 : "A命令",
+        "C"                 : "C命令",
+        "L"                 : "Label",
+    }
+
+    def event(self, kind, addr, value, lineno):
+        if (kind == "A") and isinstance(value, int):
+            print(f"0{value:015b}")
+        print(self.MESSAGES[kind])
+
+class LoggingTracer(Tracer):
+    """logging に出力する (logger の既定は "hackasm")"""
+
+    def __init__(self, logger = None, level = logging.DEBUG):
+        self.logger         = logger or logging.getLogger("hackasm")
+        self.level          = level
+
+    def event(self, kind, addr, value, lineno):
+        self.logger.log(self.level, "%s %5d %r (line %d)", kind, addr, value, lineno)
+
+class CountingTracer(Tracer):
+    """命令の種類ごとの数
+| attribute | description |
+| - | - |
+| .counts | 種類 ("A", "C", "L") → 数 |
+| .symbols | シンボルを参照した A命令の数 |
+    """
+
+    def __init__(self):
+        self.counts         = dict.fromkeys(KINDS, 0)
+        self.symbols        = 0
+
+    def event(self, kind, addr, value, lineno):
+        self.counts[kind]   += 1
+        if isinstance(value, str) and (kind == "A"):
+            self.symbols    += 1
+
+class RingTracer(Tracer):
+    """直近 size 件のイベントを固定長の配列に記録する
+| attribute / method | args | description |
+| - | - | - |
+| .total | - | これまでに受け取ったイベントの数 |
+| .events | - | 記録している (kind, addr, value, lineno) を古い順に返す |
+    """
+
+    def __init__(self, size = 4096):
+        self.size           = size
+        self.kinds          = array("B", bytes(size))
+        self.addrs          = array("I", bytes(4 * size))
+        self.lines          = array("I", bytes(4 * size))
+        self.values         = [None] * size     # 命令語かシンボル名 (参照だけを持つ)
+        self.total          = 0
+
+    def event(self, kind, addr, value, lineno):
+        i                   = self.total % self.size
+        self.kinds[i]       = KINDS.index(kind)
+        self.addrs[i]       = addr
+        self.lines[i]       = lineno
+        self.values[i]      = value
+        self.total          += 1
+
+    def events(self):
+        count               = min(self.total, self.size)
+        start               = self.total - count
+        return [
+            (KINDS[self.kinds[j]], self.addrs[j], self.values[j], self.lines[j])
+            for j in [(start + i) % self.size for i in range(count)]
+        ]
+
+class MultiTracer(Tracer):
+    def __init__(self, *tracers):
+        self.tracers        = tracers
+
+    def event(self, kind, addr, value, lineno):
+        for tracer in self.tracers:
+            tracer.event(kind, addr, value, lineno)
+
+def traced_action(action, kind, event):
+    """
+    文法アクションを実行したあとに event を呼ぶ関数を返す
+    行は命令の最初のトークンの行 (tracking=True で構文解析したときに記録される)
+    """
+    if kind                 == "L":
+        def traced(p):
+            action(p)
+            event("L", p.parser.ctx.pc, p[1]["label"], p.lineno(1))
+    else:
+        def traced(p):
+            action(p)
+            event(kind, p.parser.ctx.pc - 1, p[1], p.lineno(1))
+    return traced
+
+TRACED_ACTIONS              = {     # 文法アクション → イベントの種類
+    "p_statement_a"         : "A",
+    "p_statement_c"         : "C",
+    "p_statement_l"         : "L",
+}
+
+def trace_productions(productions, tracer):
+    """
+    PLY の productions を複製し、命令の文法アクションだけを tracer を呼ぶものに差し替える
+    (共有している元の表は書き換えない)
+    """
+    traced                  = []
+    for production in productions:
+        if production.func in TRACED_ACTIONS:
+            production      = copy.copy(production)
+            production.callable = traced_action(
+                production.callable,
+                TRACED_ACTIONS[production.func],
+                tracer.event
+            )
+        traced.append(production)
+    return traced
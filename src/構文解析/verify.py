@@ -0,0 +1,155 @@
+"""差分検証
+| function | args | description |
+| - | - | - |
+| assemble | file, engine | file を engine でアセンブルし、16bit バイナリのリストを返す |
+| parsed | file, engine | file を engine の parse() で構文解析し、(命令語, 未解決シンボル → 位置, ラベル) を返す |
+| stream | file, engine, chunk | file を engine の iter_asm で chunk 行ずつアセンブルし、リストにして返す |
+| first_diff | a, b | 2 つのリストで最初に異なる位置を返す (一致すれば None) |
+| verify | files | ply / fast 両エンジンの parse() / asm() / iter_asm() の出力、build/*.hack、最適化した出力を突き合わせる |
+| verify_peephole | cases | PEEPHOLE_CASES を最適化の前後で実行し、RAM と両エンジンの出力が一致するか確かめる |
+"""
+
+from asm import HackCodeAnalyze
+from emulator import HackMachine
+from peephole import PeepholeOptimizer
+from sys import argv, exit
+import glob
+import os
+
+ENGINES                     = ("ply", "fast")
+ITER_CHUNKS                 = (1, 1024)     # iter_asm の chunk (1 行ずつでもラベルの扱いが変わらないことを確かめる)
+PEEPHOLE_CYCLES             = 1000          # PEEPHOLE_CASES を実行する命令数 (最後は無限ループで止まる)
+
+# ピープホール最適化で誤って書き換えていたプログラム (空白区切りで 1 命令ずつ)
+PEEPHOLE_CASES              = (
+    # A を値として使うジャンプ命令の直前の数値 (@9 を付け直すと D の値が変わる)
+    "@20 @20 D=A @9 D=D-A;JLT @3 M=D @R13 M=D (END) @END 0;JMP",
+    # 飛ばなかったときに A を番地として使う数値 (@12 を付け直すと M=D の書き込み先が変わる)
+    "@7 D=A @20 M=D @20 D=M @0 D;JLT @12 D;JLT M=D @100 M=D (END) @END 0;JMP",
+    # 定義済みシンボル (ply は構文解析で数値にし、fast はシンボルのまま渡す)
+    "@SP D=M M=D @SP M=M+1 M=M-1 @R3 D;JLT @R13 M=D (L) @L 0;JMP",
+)
+
+def assemble(file, engine, optimizer = None):
+    with open(file, "r", encoding="UTF-8") as source:
+        program             = source.read()
+
+    with HackCodeAnalyze(program, debug = False, engine = engine, optimizer = optimizer) as l:
+        return l.asm()
+
+def parsed(file, engine):
+    with open(file, "r", encoding="UTF-8") as source:
+        program             = source.read()
+
+    with HackCodeAnalyze(program, debug = False, engine = engine) as l:
+        result              = l.parse()
+        return (
+            result.words.tolist(),
+            {symbol: indices.tolist() for symbol, indices in result.relocations.items()},
+            dict(l.context.symbols.labels)
+        )
+
+def stream(file, engine, chunk):
+    with open(file, "r", encoding="UTF-8") as source:
+        program             = source.read()
+
+    with HackCodeAnalyze(program, debug = False, engine = engine) as l:
+        return list(l.iter_asm(chunk = chunk))
+
+def first_diff(a, b):
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x                != y:
+            return i
+    if len(a)               != len(b):
+        return min(len(a), len(b))
+    return None
+
+def verify(files):
+    """
+    各ファイルを全エンジンの asm() と iter_asm() でアセンブルし、
+    それぞれの出力と build/<name>.hack (あれば) が一致するか確認する
+    不一致があれば False を返す
+    """
+    ok                      = True
+    for file in files:
+        results             = {engine: assemble(file, engine) for engine in ENGINES}
+        for engine in ENGINES:
+            for chunk in ITER_CHUNKS:
+                results[f"{engine} iter/{chunk}"] = stream(file, engine, chunk)
+
+        baseName            = os.path.splitext(os.path.basename(file))[0]
+        hackFile            = os.path.join(os.path.dirname(file), "build", f"{baseName}.hack")
+        if os.path.exists(hackFile):
+            with open(hackFile, "r", encoding="UTF-8") as f:
+                results["golden"] = f.read().split()
+
+        reference           = results[ENGINES[0]]
+        for name, result in results.items():
+            diff            = first_diff(reference, result)
+            if diff is None:
+                continue
+            ok              = False
+            print(f"NG  {file} : {ENGINES[0]} != {name} (word {diff})")
+            break
+        else:
+            print(f"OK  {file} : {len(reference)} words ({', '.join(results)})")
+
+        unresolved          = [parsed(file, engine) for engine in ENGINES]
+        if all(result == unresolved[0] for result in unresolved):
+            print(f"OK  {file} : {len(unresolved[0][0])} words (parse(), {', '.join(ENGINES)})")
+        else:
+            ok              = False
+            print(f"NG  {file} : parse() {' != '.join(ENGINES)}")
+
+        optimized           = {engine: assemble(file, engine, PeepholeOptimizer()) for engine in ENGINES}
+        diff                = first_diff(*optimized.values())
+        if diff is None:
+            print(f"OK  {file} : {len(optimized[ENGINES[0]])} words (optimized, {', '.join(ENGINES)})")
+        else:
+            ok              = False
+            print(f"NG  {file} : optimized {' != '.join(ENGINES)} (word {diff})")
+
+    return ok
+
+def run_words(words):
+    machine                 = HackMachine(words)
+    machine.run(PEEPHOLE_CYCLES)
+    return machine.ram
+
+def verify_peephole(cases = PEEPHOLE_CASES):
+    """
+    各プログラムを最適化せずに / 最適化して両エンジンでアセンブルし、
+    実行後の RAM がすべて同じで、最適化した命令語が両エンジンで同じか確かめる
+    """
+    ok                      = True
+    for i, case in enumerate(cases):
+        code                = "\n".join(case.split()) + "\n"
+        words               = {}
+        for engine in ENGINES:
+            for optimizer in (None, PeepholeOptimizer()):
+                with HackCodeAnalyze(code, debug = False, engine = engine, optimizer = optimizer) as l:
+                    words[(engine, optimizer is not None)] = l.encode().words
+
+        reference           = run_words(words[(ENGINES[0], False)])
+        bad                 = [
+            f"{engine}{' optimized' if optimized else ''}"
+            for (engine, optimized), result in words.items()
+            if run_words(result) != reference
+        ]
+        if first_diff(*[words[(engine, True)] for engine in ENGINES]) is not None:
+            bad.append(f"optimized {' != '.join(ENGINES)}")
+        if bad:
+            ok              = False
+            print(f"NG  peephole case {i} : {', '.join(bad)}")
+        else:
+            print(f"OK  peephole case {i} : {len(words[(ENGINES[0], True)])} words")
+    return ok
+
+
+if __name__ == "__main__":
+    if len(argv)            < 2:
+        files               = sorted(glob.glob("*.asm"))
+    else:
+        files               = argv[1:]
+
+    exit(0 if all([verify(files), verify_peephole()]) else 1)